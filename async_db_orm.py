@@ -1,16 +1,72 @@
 # -*- coding: utf-8 -*-
 from peewee import *
+from playhouse.migrate import SqliteMigrator, migrate
+from datetime import datetime
+import logging
+import statistics
+import time
 import config
+from server_info import ServerInfo
+from command_metrics import record_query
+
+# SqliteDatabase that counts and times every statement it runs towards the command being timed, see command_metrics
+class InstrumentedSqliteDatabase(SqliteDatabase):
+    def execute_sql(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, params)
+        finally:
+            record_query(time.perf_counter() - start)
+
+####################################################################################################################
+# Returns the pragmas of a connection profile from config.DbProfiles. Several bot processes (one per shard range) can
+# share the database, a busy timeout makes a writer wait for the others rather than fail.
+def db_pragmas(profile_name):
+    pragmas = dict(config.DbProfiles[profile_name])
+    pragmas['busy_timeout'] = int(config.DbBusyTimeoutSeconds * 1000)
+    return pragmas
+
+def profile_uses_wal(profile_name):
+    return config.DbProfiles[profile_name].get('journal_mode', '').lower() == 'wal'
 
 db_path = config.PRODUCTION_DB
 if config.TEST_MODE:
     db_path = config.TEST_DB
-db = SqliteDatabase(db_path)
+db = InstrumentedSqliteDatabase(db_path, timeout=config.DbBusyTimeoutSeconds, pragmas=db_pragmas(config.DbProfile))
+
+# Finish time string stored for forfeits, kept for display alongside the is_dnf flag
+DnfTime = "23:59:59"
+
+####################################################################################################################
+# Converts an "H:MM:SS" or "MM:SS" time string to a number of seconds. Returns None for an empty or malformed time.
+def game_time_to_seconds(time_str):
+    seconds = None
+    if time_str is not None and time_str != '':
+        parts = time_str.split(':')
+        try:
+            if len(parts) == 3:
+                seconds = (3600 * int(parts[0])) + (60 * int(parts[1])) + int(parts[2])
+            elif len(parts) == 2:
+                seconds = (60 * int(parts[0])) + int(parts[1])
+        except ValueError:
+            seconds = None
+    return seconds
+
+####################################################################################################################
+# Converts a number of seconds to an "H:MM:SS" time string, rounding to the nearest second. None becomes an empty string.
+def seconds_to_game_time(seconds):
+    if seconds is None:
+        return ""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
 
 class RaceCategory(Model):
     id = IntegerField(primary_key=True)
     name = CharField()
     description = CharField()
+    # Discord ID of the server this category belongs to
+    guild_id = IntegerField(null=True)
 
     class Meta:
         table_name = 'race_categories'
@@ -24,6 +80,8 @@ class AsyncRace(Model):
     additional_instructions = CharField()
     category_id = IntegerField()
     active = BooleanField(default=False)
+    # Discord ID of the server this race belongs to. Submissions and rosters belong to a server through their race.
+    guild_id = IntegerField(null=True)
 
     class Meta:
         table_name = 'async_races'
@@ -46,6 +104,10 @@ class AsyncSubmission(Model):
     username = CharField()
     finish_time_rta = CharField()
     finish_time_igt = CharField()
+    # Integer copies of the finish times used for sorting, NULL for forfeits and missing times
+    finish_seconds_rta = IntegerField(null=True)
+    finish_seconds_igt = IntegerField(null=True)
+    is_dnf = BooleanField(default=False)
     collection_rate = IntegerField()
     next_mode = CharField(null=True)
     comment = CharField(null=True)
@@ -55,6 +117,28 @@ class AsyncSubmission(Model):
         table_name = 'async_submissions'
         database = db
 
+    ################################################################################################################
+    # Sets the finish time strings and keeps the integer second columns in sync. Forfeits store DnfTime for display.
+    def set_finish_times(self, igt, rta, is_dnf=False):
+        self.is_dnf = is_dnf
+        if is_dnf:
+            igt = DnfTime
+            rta = DnfTime
+        self.finish_time_igt = igt
+        self.finish_time_rta = rta
+        self.finish_seconds_igt = None if is_dnf else game_time_to_seconds(igt)
+        self.finish_seconds_rta = None if is_dnf else game_time_to_seconds(rta)
+
+####################################################################################################################
+# Returns the integer finish time column leaderboards are sorted by
+def primary_time_field():
+    return AsyncSubmission.finish_seconds_rta if config.RtaIsPrimary else AsyncSubmission.finish_seconds_igt
+
+####################################################################################################################
+# Returns the ordering used for leaderboards: finishers by time, then forfeits. Ties are broken by submission order.
+def leaderboard_order():
+    return (AsyncSubmission.is_dnf, primary_time_field(), AsyncSubmission.id)
+
 class RaceRoster(Model):
     id = IntegerField(primary_key=True)
     race_id = IntegerField()
@@ -65,8 +149,610 @@ class RaceRoster(Model):
         table_name = 'async_race_rosters'
         database = db
 
+# Messages the bot has posted in a leaderboard channel, in display order, so the leaderboard can be edited in place
+class LeaderboardMessage(Model):
+    id = IntegerField(primary_key=True)
+    channel_id = IntegerField()
+    position = IntegerField()
+    message_id = IntegerField()
+    content_hash = CharField()
+
+    class Meta:
+        table_name = 'leaderboard_messages'
+        database = db
+        indexes = (
+            (('channel_id', 'position'), True),
+        )
+
+# Per server configuration, one row per Discord server the bot serves. See ServerInfo for what each field is used for.
+class ServerSettings(Model):
+    server_id = IntegerField(primary_key=True)
+    race_creator_role = IntegerField()
+    race_creator_channel = IntegerField()
+    # Comma separated channel IDs
+    bot_command_channels = CharField(default='')
+    weekly_submit_channel = IntegerField(default=0)
+    weekly_category_id = IntegerField(default=0)
+    weekly_leaderboard_channel = IntegerField(default=0)
+    announcements_channel = IntegerField(default=0)
+    weekly_racer_role = IntegerField(default=0)
+    weekly_race_done_role = IntegerField(default=0)
+    tourney_submit_channel = IntegerField(default=0)
+    tourney_async_channel = IntegerField(default=0)
+
+    class Meta:
+        table_name = 'server_settings'
+        database = db
+
+    def to_server_info(self):
+        fields = { name: getattr(self, name) for name in ServerInfo._fields }
+        fields['bot_command_channels'] = [int(c) for c in self.bot_command_channels.split(',') if c != '']
+        return ServerInfo(**fields)
+
+    @staticmethod
+    def from_server_info(server_info):
+        fields = server_info._asdict()
+        fields['bot_command_channels'] = ','.join(str(c) for c in server_info.bot_command_channels)
+        return ServerSettings(**fields)
+
+# Career statistics for one racer in one race category, refreshed by refresh_racer_stats in the same transaction as
+# every change to the racer's submissions so the stats command reads one row per category instead of scanning
+# submissions. Times are in seconds and NULL without a finish. The current weekly race is left out until the next one
+# starts so the stats can't give away its times.
+class RacerStats(Model):
+    user_id = IntegerField()
+    category_id = IntegerField()
+    races = IntegerField(default=0)
+    finishes = IntegerField(default=0)
+    dnfs = IntegerField(default=0)
+    best_igt = IntegerField(null=True)
+    median_igt = FloatField(null=True)
+    mean_igt = FloatField(null=True)
+    best_rta = IntegerField(null=True)
+    median_rta = FloatField(null=True)
+    mean_rta = FloatField(null=True)
+    # Leaderboard places of the racer's finishes. Places in a race still taking submissions are as of the racer's own
+    # submission, they're brought up to date for everyone in the race when it's finalized or the next weekly starts.
+    average_place = FloatField(null=True)
+    podiums = IntegerField(default=0)
+    # Consecutive weekly races entered up to last_weekly_race_id, only kept for weekly categories. A streak that
+    # missed the previous weekly is broken, see get_racer_stats.
+    weekly_streak = IntegerField(default=0)
+    last_weekly_race_id = IntegerField(null=True)
+    updated = DateTimeField()
+
+    class Meta:
+        table_name = 'racer_stats'
+        database = db
+        primary_key = CompositeKey('user_id', 'category_id')
+
+# A season of races in one category. Races count towards it if they started between start_date and end_date
+# (inclusive), scored by placement or by time relative to par, see season_race_points.
+class Season(Model):
+    id = IntegerField(primary_key=True)
+    guild_id = IntegerField()
+    category_id = IntegerField()
+    name = CharField()
+    start_date = DateField()
+    end_date = DateField()
+    scoring = CharField(default='placement')
+
+    class Meta:
+        table_name = 'seasons'
+        database = db
+
+# Points each racer scored in one race of a season. Kept so the standings can be updated by the difference when a race
+# is rescored, rather than by adding up the season again.
+class SeasonRacePoints(Model):
+    id = IntegerField(primary_key=True)
+    season_id = IntegerField()
+    race_id = IntegerField()
+    user_id = IntegerField()
+    points = FloatField()
+    # Leaderboard place, NULL for a forfeit
+    place = IntegerField(null=True)
+
+    class Meta:
+        table_name = 'season_race_points'
+        database = db
+        indexes = (
+            (('season_id', 'race_id', 'user_id'), True),
+            (('race_id',), False),
+        )
+
+# Running season totals per racer, served as is by the standings command
+class SeasonStanding(Model):
+    season_id = IntegerField()
+    user_id = IntegerField()
+    points = FloatField(default=0)
+    races = IntegerField(default=0)
+    wins = IntegerField(default=0)
+
+    class Meta:
+        table_name = 'season_standings'
+        database = db
+        primary_key = CompositeKey('season_id', 'user_id')
+        indexes = (
+            (('season_id', 'points'), False),
+        )
+
+####################################################################################################################
+# Returns the server the database was used with before it held more than one, races and categories created before
+# servers were tracked belong to it
+def default_server_id():
+    server_info = config.TEST_SERVER if config.TEST_MODE else config.PRODUCTION_SERVER
+    return server_info.server_id
+
+class SchemaVersion(Model):
+    version = IntegerField(primary_key=True)
+    description = CharField()
+    applied = DateTimeField()
+
+    class Meta:
+        table_name = 'schema_version'
+        database = db
+
+####################################################################################################################
+# Racer Stats
+####################################################################################################################
+
+# Racers refreshed per ranking query, keeps the query under SQLite's bound parameter limit
+StatsRefreshBatchSize = 500
+
+####################################################################################################################
+# Returns the IDs of every server's weekly race category. Until server_settings has been seeded (that happens after
+# the migrations run) the configured servers are used.
+def weekly_category_ids():
+    category_ids = { s.weekly_category_id for s in ServerSettings.select(ServerSettings.weekly_category_id) }
+    if len(category_ids) == 0:
+        servers = [config.TEST_SERVER if config.TEST_MODE else config.PRODUCTION_SERVER] + config.ADDITIONAL_SERVERS
+        category_ids = { s.weekly_category_id for s in servers }
+    category_ids.discard(0)
+    return category_ids
+
+####################################################################################################################
+# Returns the ID of the current weekly race of a weekly category, the newest active one, or None if there isn't one
+def current_weekly_race_id(category_id):
+    return AsyncRace.select(fn.MAX(AsyncRace.id))                                                   \
+                    .where((AsyncRace.category_id == category_id) & (AsyncRace.active == True))    \
+                    .scalar()
+
+####################################################################################################################
+# Returns (current race ID, weekly race IDs newest first) for a weekly category. The current race is the newest active
+# one (None if there isn't one), the list holds it and the older races that have submissions, so races that were
+# never run don't break streaks. With a limit only that many races are read.
+def weekly_race_ids(category_id, limit=None):
+    current_race_id = current_weekly_race_id(category_id)
+    race_ids = [] if current_race_id is None else [current_race_id]
+    has_submissions = fn.EXISTS(AsyncSubmission.select(SQL('1')).where(AsyncSubmission.race_id == AsyncRace.id))
+    query = AsyncRace.select(AsyncRace.id)                                                \
+                     .where((AsyncRace.category_id == category_id) & has_submissions)     \
+                     .order_by(AsyncRace.id.desc())                                       \
+                     .tuples()
+    if current_race_id is not None:
+        # Anything newer than the current race hasn't been run yet
+        query = query.where(AsyncRace.id < current_race_id)
+    if limit is not None:
+        query = query.limit(max(limit - len(race_ids), 0))
+    race_ids += [race_id for race_id, in query]
+    return current_race_id, race_ids
+
 ####################################################################################################################
-# Checks the database for the required tables, creating them if they don't exist.
+# Returns (streak, newest race in the streak) for the set of weekly race IDs a racer entered. The current race doesn't
+# break the streak while it's still open.
+def weekly_streak(race_ids, entered_race_ids, current_race_id):
+    streak = 0
+    last_race_id = None
+    for race_id in race_ids:
+        if race_id in entered_race_ids:
+            streak += 1
+            if last_race_id is None:
+                last_race_id = race_id
+        elif race_id != current_race_id:
+            break
+    return streak, last_race_id
+
+####################################################################################################################
+# Returns (best, median, mean) of a list of finish times in seconds, all None if it's empty
+def finish_time_stats(seconds):
+    if len(seconds) == 0:
+        return None, None, None
+    return min(seconds), statistics.median(seconds), statistics.fmean(seconds)
+
+####################################################################################################################
+# Returns the number of finishers ahead of each AsyncSubmission row in its race's leaderboard order, as a correlated
+# subquery counted through the leaderboard index rather than ranking every submission in the race. Missing times sort
+# first, like they do on the leaderboard.
+def finishers_ahead():
+    ahead = AsyncSubmission.alias()
+    time_field = primary_time_field()
+    ahead_time = getattr(ahead, time_field.name)
+    same_time = (ahead_time == time_field) | (ahead_time.is_null() & time_field.is_null())
+    faster = (ahead_time < time_field) | (ahead_time.is_null() & time_field.is_null(False))
+    return ahead.select(fn.COUNT(SQL('*')))                                                   \
+                .where((ahead.race_id == AsyncSubmission.race_id) & (ahead.is_dnf == False) & \
+                       (faster | (same_time & (ahead.id < AsyncSubmission.id))))
+
+####################################################################################################################
+# Returns a saved submission's place in its race's leaderboard, None for a forfeit
+def submission_place(submission):
+    if submission.is_dnf:
+        return None
+    return AsyncSubmission.select(finishers_ahead()).where(AsyncSubmission.id == submission.id).scalar() + 1
+
+####################################################################################################################
+# Recomputes the racer_stats rows of the given racers in one category from their whole submission history, read with
+# one query per batch of racers. Used when places change for everyone in a race (finalized, weekly rollover, deleted)
+# and for the backfill, a single saved submission goes through apply_submission_racer_stats instead. Racers left with
+# nothing to show lose their row. Runs in the caller's transaction.
+def refresh_racer_stats(user_ids, category_id):
+    user_ids = list(set(user_ids))
+    if len(user_ids) == 0:
+        return
+    current_race_id = None
+    race_ids = []
+    if category_id in weekly_category_ids():
+        current_race_id, race_ids = weekly_race_ids(category_id)
+    for i in range(0, len(user_ids), StatsRefreshBatchSize):
+        refresh_racer_stats_batch(user_ids[i:i + StatsRefreshBatchSize], category_id, current_race_id, race_ids)
+
+def refresh_racer_stats_batch(user_ids, category_id, current_race_id, race_ids):
+    # A finisher's place is one more than the number of finishers ahead of them
+    query = AsyncSubmission.select(AsyncSubmission.race_id, AsyncSubmission.user_id, AsyncSubmission.is_dnf,
+                                   AsyncSubmission.finish_seconds_igt, AsyncSubmission.finish_seconds_rta,
+                                   finishers_ahead().alias('ahead'))                                              \
+                           .join(AsyncRace, on=(AsyncSubmission.race_id == AsyncRace.id))                         \
+                           .where((AsyncSubmission.user_id.in_(user_ids)) & (AsyncRace.category_id == category_id)) \
+                           .tuples()
+
+    results = { user_id: [] for user_id in user_ids }
+    for race_id, user_id, is_dnf, igt, rta, ahead in query:
+        results[user_id].append((race_id, user_id, is_dnf, igt, rta, ahead + 1))
+
+    now = datetime.now()
+    rows = []
+    for user_id, submissions in results.items():
+        entered_race_ids = { race_id for race_id, _, _, _, _, _ in submissions }
+        streak, last_race_id = weekly_streak(race_ids, entered_race_ids, current_race_id)
+        submissions = [s for s in submissions if s[0] != current_race_id]
+        if len(submissions) == 0 and streak == 0:
+            continue
+        finishes = [s for s in submissions if not s[2]]
+        best_igt, median_igt, mean_igt = finish_time_stats([s[3] for s in finishes if s[3] is not None])
+        best_rta, median_rta, mean_rta = finish_time_stats([s[4] for s in finishes if s[4] is not None])
+        places = [s[5] for s in finishes]
+        rows.append({ RacerStats.user_id: user_id,
+                      RacerStats.category_id: category_id,
+                      RacerStats.races: len(submissions),
+                      RacerStats.finishes: len(finishes),
+                      RacerStats.dnfs: len(submissions) - len(finishes),
+                      RacerStats.best_igt: best_igt,
+                      RacerStats.median_igt: median_igt,
+                      RacerStats.mean_igt: mean_igt,
+                      RacerStats.best_rta: best_rta,
+                      RacerStats.median_rta: median_rta,
+                      RacerStats.mean_rta: mean_rta,
+                      RacerStats.average_place: statistics.fmean(places) if places else None,
+                      RacerStats.podiums: len([p for p in places if p <= 3]),
+                      RacerStats.weekly_streak: streak,
+                      RacerStats.last_weekly_race_id: last_race_id,
+                      RacerStats.updated: now })
+
+    if len(rows) > 0:
+        RacerStats.insert_many(rows).on_conflict_replace().execute()
+    if len(rows) < len(user_ids):
+        kept = [row[RacerStats.user_id] for row in rows]
+        RacerStats.delete().where((RacerStats.user_id.in_(user_ids)) & (RacerStats.user_id.not_in(kept)) &
+                                  (RacerStats.category_id == category_id)).execute()
+
+####################################################################################################################
+# Updates the submitter's racer_stats row for one saved submission. old_submission and old_place are the submission
+# and its place before an edit, both None for a new submission. The counts, places, podiums and weekly streak are
+# adjusted by the difference the submission made, only the time stats are recomputed, from the racer's finish times
+# in the category. A new entry to a weekly race other than the current one can join two streaks together, that falls
+# back to refresh_racer_stats. Runs in the caller's transaction.
+def apply_submission_racer_stats(race, submission, old_submission=None, old_place=None):
+    user_id = submission.user_id
+    category_id = race.category_id
+    current_race_id = None
+    race_ids = []
+    if category_id in weekly_category_ids():
+        # The current race and the weekly before it are all a new entry to the current race needs for its streak
+        current_race_id, race_ids = weekly_race_ids(category_id, limit=2)
+        if old_submission is None and (current_race_id is None or race.id != current_race_id):
+            refresh_racer_stats([user_id], category_id)
+            return
+        if old_submission is not None and race.id == current_race_id:
+            # Edits to the current weekly don't show until the next weekly starts
+            return
+
+    stats = RacerStats.get_or_none((RacerStats.user_id == user_id) & (RacerStats.category_id == category_id))
+    is_new_row = stats is None
+    if is_new_row:
+        stats = RacerStats(user_id=user_id, category_id=category_id)
+
+    if race.id == current_race_id:
+        # The current weekly stays out of the stats until the next weekly starts, entering it only extends the streak
+        previous_race_id = race_ids[1] if len(race_ids) > 1 else None
+        if stats.weekly_streak > 0 and previous_race_id is not None and stats.last_weekly_race_id == previous_race_id:
+            stats.weekly_streak += 1
+        else:
+            stats.weekly_streak = 1
+        stats.last_weekly_race_id = race.id
+    else:
+        place_total = round(stats.average_place * stats.finishes) if stats.average_place is not None else 0
+        changes = [(old_submission, old_place, -1), (submission, submission_place(submission), 1)]
+        for changed_submission, place, sign in changes:
+            if changed_submission is None:
+                continue
+            stats.races += sign
+            if changed_submission.is_dnf:
+                stats.dnfs += sign
+            else:
+                stats.finishes += sign
+                place_total += sign * place
+                if place <= 3:
+                    stats.podiums += sign
+        stats.average_place = place_total / stats.finishes if stats.finishes > 0 else None
+
+        finish_times = AsyncSubmission.select(AsyncSubmission.finish_seconds_igt, AsyncSubmission.finish_seconds_rta) \
+                                      .join(AsyncRace, on=(AsyncSubmission.race_id == AsyncRace.id))                \
+                                      .where((AsyncSubmission.user_id == user_id) &                                \
+                                             (AsyncRace.category_id == category_id) &                             \
+                                             (AsyncSubmission.is_dnf == False))                                   \
+                                      .tuples()
+        if current_race_id is not None:
+            finish_times = finish_times.where(AsyncSubmission.race_id != current_race_id)
+        finish_times = list(finish_times)
+        stats.best_igt, stats.median_igt, stats.mean_igt = finish_time_stats([igt for igt, rta in finish_times if igt is not None])
+        stats.best_rta, stats.median_rta, stats.mean_rta = finish_time_stats([rta for igt, rta in finish_times if rta is not None])
+
+    stats.updated = datetime.now()
+    stats.save(force_insert=is_new_row)
+
+####################################################################################################################
+# Recomputes the racer_stats rows of everyone who submitted to a race, used when places in the race become final
+def refresh_race_racer_stats(race_id):
+    race = AsyncRace.get_or_none(AsyncRace.id == race_id)
+    if race is not None:
+        user_ids = [user_id for user_id, in AsyncSubmission.select(AsyncSubmission.user_id).where(AsyncSubmission.race_id == race_id).tuples()]
+        refresh_racer_stats(user_ids, race.category_id)
+
+####################################################################################################################
+# Seasons
+####################################################################################################################
+
+####################################################################################################################
+# Scores a race for a season. Takes the race's (user ID, is DNF, primary time in seconds) rows in leaderboard order and
+# returns a dict of user ID to (points, place), place is None for forfeits.
+def season_race_points(scoring, leaderboard):
+    finishers = [(user_id, seconds) for user_id, is_dnf, seconds in leaderboard if not is_dnf]
+    par = None
+    if scoring == 'par':
+        par_times = [seconds for user_id, seconds in finishers if seconds is not None][:config.SeasonParRacers]
+        par = statistics.fmean(par_times) if len(par_times) > 0 else None
+    results = {}
+    for place, (user_id, seconds) in enumerate(finishers, start=1):
+        if scoring == 'par':
+            points = 0.0 if par is None or seconds is None else max(0.0, config.SeasonParPoints * (2 - seconds / par))
+        elif place <= len(config.SeasonPlacementPoints):
+            points = config.SeasonPlacementPoints[place - 1]
+        else:
+            points = config.SeasonFinishPoints
+        results[user_id] = (round(points, 2), place)
+    for user_id, is_dnf, seconds in leaderboard:
+        if is_dnf:
+            results[user_id] = (0.0, None)
+    return results
+
+####################################################################################################################
+# Rescores one race in every season it belongs to (or used to belong to) and applies the difference from its previous
+# score to the standings, so a submission only costs a pass over its own race. The current weekly race isn't scored
+# until the next weekly starts, the same as the racer stats. A deleted race has its points taken back out. Runs in the
+# caller's transaction.
+def refresh_race_season_points(race_id):
+    race = AsyncRace.get_or_none(AsyncRace.id == race_id)
+    season_ids = { season_id for season_id, in SeasonRacePoints.select(SeasonRacePoints.season_id)
+                                                              .where(SeasonRacePoints.race_id == race_id)
+                                                              .distinct()
+                                                              .tuples() }
+    seasons = []
+    if race is not None and race.start is not None:
+        seasons = list(Season.select().where((Season.category_id == race.category_id) &
+                                             (Season.start_date <= race.start) & (Season.end_date >= race.start)))
+        if len(seasons) > 0 and race.category_id in weekly_category_ids():
+            if race.id == current_weekly_race_id(race.category_id):
+                seasons = []
+    if len(seasons) == 0 and len(season_ids) == 0:
+        return
+
+    leaderboard = list(AsyncSubmission.select(AsyncSubmission.user_id, AsyncSubmission.is_dnf, primary_time_field()) \
+                                      .where(AsyncSubmission.race_id == race_id)                                      \
+                                      .order_by(*leaderboard_order())                                                 \
+                                      .tuples()) if len(seasons) > 0 else []
+    scores = { season.id: season_race_points(season.scoring, leaderboard) for season in seasons }
+    for season_id in season_ids | set(scores):
+        apply_season_race_points(season_id, race_id, scores.get(season_id, {}))
+
+####################################################################################################################
+# Replaces a race's points in a season with new_points (user ID to (points, place)) and adds the differences to the
+# standings
+def apply_season_race_points(season_id, race_id, new_points):
+    old_points = { user_id: (points, place) for user_id, points, place in
+                   SeasonRacePoints.select(SeasonRacePoints.user_id, SeasonRacePoints.points, SeasonRacePoints.place)
+                                   .where((SeasonRacePoints.season_id == season_id) & (SeasonRacePoints.race_id == race_id))
+                                   .tuples() }
+    changes = []
+    for user_id in old_points.keys() | new_points.keys():
+        old = old_points.get(user_id)
+        new = new_points.get(user_id)
+        points = round((0 if new is None else new[0]) - (0 if old is None else old[0]), 2)
+        races = (new is not None) - (old is not None)
+        wins = (new is not None and new[1] == 1) - (old is not None and old[1] == 1)
+        if points != 0 or races != 0 or wins != 0:
+            changes.append({ SeasonStanding.season_id: season_id,
+                             SeasonStanding.user_id: user_id,
+                             SeasonStanding.points: points,
+                             SeasonStanding.races: races,
+                             SeasonStanding.wins: wins })
+    if len(changes) == 0:
+        return
+
+    SeasonRacePoints.delete().where((SeasonRacePoints.season_id == season_id) & (SeasonRacePoints.race_id == race_id)).execute()
+    if len(new_points) > 0:
+        SeasonRacePoints.insert_many([{ SeasonRacePoints.season_id: season_id,
+                                        SeasonRacePoints.race_id: race_id,
+                                        SeasonRacePoints.user_id: user_id,
+                                        SeasonRacePoints.points: points,
+                                        SeasonRacePoints.place: place } for user_id, (points, place) in new_points.items()]).execute()
+    for i in range(0, len(changes), StatsRefreshBatchSize):
+        SeasonStanding.insert_many(changes[i:i + StatsRefreshBatchSize])                                        \
+                      .on_conflict(conflict_target=[SeasonStanding.season_id, SeasonStanding.user_id],
+                                   update={ SeasonStanding.points: fn.ROUND(SeasonStanding.points + EXCLUDED.points, 2),
+                                            SeasonStanding.races: SeasonStanding.races + EXCLUDED.races,
+                                            SeasonStanding.wins: SeasonStanding.wins + EXCLUDED.wins })      \
+                      .execute()
+    SeasonStanding.delete().where((SeasonStanding.season_id == season_id) & (SeasonStanding.races <= 0)).execute()
+
+####################################################################################################################
+# Schema Migrations
+#
+# Each migration is a function that takes no arguments and upgrades the schema by one version. Migrations are run in
+# order at startup by run_migrations(), each in its own transaction, and the applied version is recorded in the
+# schema_version table. To change the schema add a new function and append it to the Migrations list, never edit or
+# reorder a migration that has already shipped.
+####################################################################################################################
+
+####################################################################################################################
+# Creates an index, making it unique only if the existing rows allow it. Older databases can contain duplicate rows
+# (e.g. a double submission) that would make a unique index fail, those are left alone and reported instead.
+def create_index(model, name, fields, unique=False):
+    if unique:
+        duplicates = model.select(*fields)                    \
+                          .group_by(*fields)                  \
+                          .having(fn.COUNT(SQL('*')) > 1)     \
+                          .tuples()
+        duplicates = list(duplicates)
+        if len(duplicates) > 0:
+            logging.warning(f"Creating non-unique index {name}, {model._meta.table_name} has duplicate rows: {duplicates}")
+            unique = False
+    db.execute(ModelIndex(model, fields, unique=unique, safe=True, name=name))
+
+####################################################################################################################
+# Version 1: Indexes for the submission and roster lookups done on every command
+def migration_add_lookup_indexes():
+    # getSubmission, is_race_complete and get_leaderboard (via the race_id prefix)
+    create_index(AsyncSubmission, 'async_submissions_race_user', (AsyncSubmission.race_id, AsyncSubmission.user_id), unique=True)
+    # Race results for a user, newest first
+    create_index(AsyncSubmission, 'async_submissions_user_id', (AsyncSubmission.user_id, AsyncSubmission.id))
+    # get_roster, get_assignment and is_public_race (via the race_id prefix)
+    create_index(RaceRoster, 'async_race_rosters_race_user', (RaceRoster.race_id, RaceRoster.user_id), unique=True)
+
+####################################################################################################################
+# Version 2: Integer finish times and a DNF flag, backfilled from the "H:MM:SS" strings, so leaderboards can be sorted
+# by an indexed ORDER BY
+def migration_add_finish_seconds():
+    existing_columns = [c.name for c in db.get_columns(AsyncSubmission._meta.table_name)]
+    migrator = SqliteMigrator(db)
+    operations = []
+    for field in [AsyncSubmission.finish_seconds_igt, AsyncSubmission.finish_seconds_rta, AsyncSubmission.is_dnf]:
+        if field.column_name not in existing_columns:
+            operations.append(migrator.add_column(AsyncSubmission._meta.table_name, field.column_name, field))
+    migrate(*operations)
+
+    submissions = list(AsyncSubmission.select())
+    for s in submissions:
+        s.set_finish_times(s.finish_time_igt, s.finish_time_rta, is_dnf=(s.finish_time_igt == DnfTime))
+    AsyncSubmission.bulk_update(submissions,
+                                fields=[AsyncSubmission.finish_seconds_igt, AsyncSubmission.finish_seconds_rta, AsyncSubmission.is_dnf],
+                                batch_size=100)
+
+    create_index(AsyncSubmission, 'async_submissions_igt_leaderboard',
+                 (AsyncSubmission.race_id, AsyncSubmission.is_dnf, AsyncSubmission.finish_seconds_igt, AsyncSubmission.id))
+    create_index(AsyncSubmission, 'async_submissions_rta_leaderboard',
+                 (AsyncSubmission.race_id, AsyncSubmission.is_dnf, AsyncSubmission.finish_seconds_rta, AsyncSubmission.id))
+
+####################################################################################################################
+# Version 3: Server IDs on races and categories so one database can serve several servers. Existing rows are assigned
+# to the server the database was configured for.
+def migration_add_guild_ids():
+    migrator = SqliteMigrator(db)
+    operations = []
+    for model in [RaceCategory, AsyncRace]:
+        existing_columns = [c.name for c in db.get_columns(model._meta.table_name)]
+        if model.guild_id.column_name not in existing_columns:
+            operations.append(migrator.add_column(model._meta.table_name, model.guild_id.column_name, model.guild_id))
+    migrate(*operations)
+
+    RaceCategory.update(guild_id=default_server_id()).where(RaceCategory.guild_id.is_null()).execute()
+    AsyncRace.update(guild_id=default_server_id()).where(AsyncRace.guild_id.is_null()).execute()
+
+    # Active race selects and race pages for a server
+    create_index(AsyncRace, 'async_races_guild_category', (AsyncRace.guild_id, AsyncRace.category_id, AsyncRace.active))
+
+####################################################################################################################
+# Version 4: Per racer, per category career stats, backfilled from the existing submissions
+def migration_add_racer_stats():
+    if 'racer_stats' not in db.get_tables():
+        RacerStats.create_table()
+    category_ids = [category_id for category_id, in AsyncRace.select(AsyncRace.category_id).distinct().tuples()]
+    for category_id in category_ids:
+        user_ids = AsyncSubmission.select(AsyncSubmission.user_id)                              \
+                                  .join(AsyncRace, on=(AsyncSubmission.race_id == AsyncRace.id)) \
+                                  .where(AsyncRace.category_id == category_id)                  \
+                                  .distinct()                                                   \
+                                  .tuples()
+        refresh_racer_stats([user_id for user_id, in user_ids], category_id)
+
+####################################################################################################################
+# Version 5: Seasons, the points scored in each of their races and the running standings
+def migration_add_seasons():
+    tables = db.get_tables()
+    for model in [Season, SeasonRacePoints, SeasonStanding]:
+        if model._meta.table_name not in tables:
+            model.create_table()
+    create_index(Season, 'seasons_category_dates', (Season.category_id, Season.start_date))
+
+Migrations = [
+    (1, "Add submission and roster lookup indexes", migration_add_lookup_indexes),
+    (2, "Add integer finish times and DNF flag to submissions", migration_add_finish_seconds),
+    (3, "Add server IDs to races and categories", migration_add_guild_ids),
+    (4, "Add racer career stats", migration_add_racer_stats),
+    (5, "Add seasons and standings", migration_add_seasons),
+]
+
+####################################################################################################################
+# Returns the current schema version of the database, 0 if no migrations have been applied
+def get_schema_version():
+    version = SchemaVersion.select(fn.MAX(SchemaVersion.version)).scalar()
+    return 0 if version is None else version
+
+####################################################################################################################
+# Returns True if the database exists and has every migration applied
+def schema_is_current():
+    if 'schema_version' not in db.get_tables():
+        return False
+    return get_schema_version() >= Migrations[-1][0]
+
+####################################################################################################################
+# Copies the WAL back into the database file, mode is one of SQLite's checkpoint modes (PASSIVE, FULL, RESTART,
+# TRUNCATE). Has to run outside of a transaction. Returns (busy, WAL pages, checkpointed pages).
+def wal_checkpoint(mode='PASSIVE'):
+    return tuple(db.execute_sql(f"PRAGMA wal_checkpoint({mode})").fetchone())
+
+####################################################################################################################
+# Applies any migrations newer than the current schema version
+def run_migrations():
+    current_version = get_schema_version()
+    for version, description, migration in Migrations:
+        if version > current_version:
+            logging.info(f"Applying schema migration {version}: {description}")
+            with db.atomic():
+                migration()
+                SchemaVersion.create(version=version, description=description, applied=datetime.now())
+
+####################################################################################################################
+# Checks the database for the required tables, creating them if they don't exist, then brings the schema up to date.
 def check_add_db_tables():
     tables = db.get_tables()
 
@@ -84,3 +770,14 @@ def check_add_db_tables():
 
     if 'async_race_rosters' not in tables:
         RaceRoster.create_table()
+
+    if 'leaderboard_messages' not in tables:
+        LeaderboardMessage.create_table()
+
+    if 'schema_version' not in tables:
+        SchemaVersion.create_table()
+
+    if 'server_settings' not in tables:
+        ServerSettings.create_table()
+
+    run_migrations()
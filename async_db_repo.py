@@ -0,0 +1,634 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+from async_db_orm import *
+from command_metrics import record_db_call
+import race_export
+import config
+
+# One assigned racer in a race snapshot. username is None if the racer is missing from async_racers and submission is
+# None if they haven't submitted yet.
+class RosterEntry(NamedTuple):
+    assignment: RaceRoster
+    username: Optional[str]
+    submission: Optional[AsyncSubmission]
+
+    @property
+    def user_id(self):
+        return self.assignment.user_id
+
+# A race together with its roster, racer names and submission status, loaded in one go by get_race_snapshot
+class RaceSnapshot(NamedTuple):
+    race: AsyncRace
+    roster: list[RosterEntry]
+
+    # A race is public if it has no assigned racers
+    @property
+    def is_public(self):
+        return len(self.roster) == 0
+
+    def get_entry(self, user_id):
+        return next((e for e in self.roster if e.user_id == user_id), None)
+
+####################################################################################################################
+# Decorators used to define the repository queries below. The decorated function is written as a plain, blocking
+# peewee query and the decorator turns it into a coroutine method that runs the query on the repository's reader or
+# writer executor. The blocking version stays reachable through the `sync` attribute for offline scripts.
+def db_read(func):
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        return await self.read(func, *args, **kwargs)
+    wrapper.sync = func
+    return wrapper
+
+def db_write(func):
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        return await self.write(func, *args, **kwargs)
+    wrapper.sync = func
+    return wrapper
+
+####################################################################################################################
+# Runs the function inside a transaction, used for every write so a failed write never leaves partial changes behind.
+# The write lock is taken up front (BEGIN IMMEDIATE) so when several processes share the database, a writer waits for
+# the busy timeout instead of failing when it tries to upgrade a read lock another writer is waiting on.
+def run_atomic(func, *args, **kwargs):
+    with db.atomic(lock_type='IMMEDIATE'):
+        return func(*args, **kwargs)
+
+class AsyncRaceRepo():
+    '''Async data access layer for the race database.
+
+    All peewee access goes through this class so it never blocks the nextcord event loop. Writes are serialized on a
+    single writer thread (SQLite only allows one writer at a time) while reads are spread over a small reader pool.
+    Each executor thread gets its own SQLite connection from peewee's per-thread connection state.
+    '''
+
+    def __init__(self, reader_threads=config.DbReaderThreads):
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="arb-db-writer")
+        self.readers = ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix="arb-db-reader")
+        # Race kind cache, race ID to True for public races and False for assigned races. Only touched from the event
+        # loop. Kept up to date by assign_racer and remove_race, which are the only ways a race changes kind. Both bump
+        # the generation, a kind queried across one of them may be stale and isn't stored, see cache_race_kind.
+        self.public_races = {}
+        self.public_races_generation = 0
+
+    ####################################################################################################################
+    # Runs a blocking read-only function on the reader pool
+    async def read(self, func, *args, **kwargs):
+        return await self.run_in(self.readers, functools.partial(func, *args, **kwargs))
+
+    ####################################################################################################################
+    # Runs a blocking function on the writer thread, inside a transaction
+    async def write(self, func, *args, **kwargs):
+        return await self.run_in(self.writer, functools.partial(run_atomic, func, *args, **kwargs))
+
+    ####################################################################################################################
+    # Runs the call on an executor in a copy of the caller's context, so the statements it runs are counted towards the
+    # command being timed. The time spent waiting for the result, including any queueing, is the command's DB time.
+    async def run_in(self, executor, call):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(executor, functools.partial(contextvars.copy_context().run, call))
+        finally:
+            record_db_call(time.perf_counter() - start)
+
+    ####################################################################################################################
+    # Saves a model instance (race, submission, roster entry etc) on the writer thread
+    async def save(self, model_instance):
+        return await self.write(model_instance.save)
+
+    async def delete(self, model_instance):
+        return await self.write(model_instance.delete_instance)
+
+    ####################################################################################################################
+    # Returns True if the provided race_id is a public race (has no assigned racers), False otherwise. Answered from the
+    # race kind cache, falling back to an EXISTS query on a miss.
+    async def is_public_race(self, race_id):
+        is_public = self.public_races.get(race_id)
+        if is_public is None:
+            generation = self.public_races_generation
+            is_public = await self.query_is_public_race(race_id)
+            self.cache_race_kind(race_id, is_public, generation)
+        return is_public
+
+    ####################################################################################################################
+    # Stores a race kind read from the database, unless assign_racer or remove_race ran since the read started
+    # (generation is the generation read before it). A race never goes back from assigned to public, so a cached False
+    # is never replaced.
+    def cache_race_kind(self, race_id, is_public, generation):
+        if generation != self.public_races_generation or self.public_races.get(race_id) is False:
+            return
+        self.public_races[race_id] = is_public
+
+    ####################################################################################################################
+    # Adds a racer to a race roster, which makes the race an assigned race
+    async def assign_racer(self, race_id, user_id):
+        # Bumped on both sides of the write, a kind read that overlaps any part of it isn't cached
+        self.public_races_generation += 1
+        await self.save(RaceRoster(race_id=race_id, user_id=user_id))
+        self.public_races_generation += 1
+        self.public_races[race_id] = False
+
+    async def remove_race(self, race):
+        self.public_races_generation += 1
+        await self.delete_race(race)
+        self.public_races_generation += 1
+        self.public_races.pop(race.id, None)
+
+    ####################################################################################################################
+    # Returns a RaceSnapshot for the race, or None if it doesn't exist. Also refreshes the race kind cache.
+    async def get_race_snapshot(self, race_id):
+        generation = self.public_races_generation
+        snapshot = await self.query_race_snapshot(race_id)
+        if snapshot is not None:
+            self.cache_race_kind(race_id, snapshot.is_public, generation)
+        return snapshot
+
+    ####################################################################################################################
+    # Checkpoints the WAL on the writer thread, so it never waits on the bot's own writes. Not run through write()
+    # since SQLite can't checkpoint inside a transaction.
+    async def checkpoint_wal(self, mode='PASSIVE'):
+        return await self.run_in(self.writer, functools.partial(wal_checkpoint, mode))
+
+    def close(self):
+        logging.info("Shutting down database executors")
+        self.readers.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
+
+########################################################################################################################
+# Startup
+########################################################################################################################
+    @db_write
+    def check_db_tables():
+        check_add_db_tables()
+
+    @db_read
+    def is_schema_current():
+        return schema_is_current()
+
+########################################################################################################################
+# Categories
+########################################################################################################################
+    @db_read
+    def get_categories(guild_id):
+        return list(RaceCategory.select().where(RaceCategory.guild_id == guild_id))
+
+########################################################################################################################
+# Races
+########################################################################################################################
+    ####################################################################################################################
+    # Queries for a race by ID, returning None if it doesn't exist. If a guild ID is provided, races belonging to other
+    # servers are treated as missing.
+    @db_read
+    def get_race(race_id, guild_id=None):
+        query = AsyncRace.select().where(AsyncRace.id == race_id)
+        if guild_id is not None:
+            query = query.where(AsyncRace.guild_id == guild_id)
+        try:
+            race = query.get()
+        except DoesNotExist:
+            race = None
+        return race
+
+    ####################################################################################################################
+    # Queries several races at once, returning a dictionary of race ID to race. Missing races are left out.
+    @db_read
+    def get_races(race_ids):
+        return { r.id: r for r in AsyncRace.select().where(AsyncRace.id.in_(list(race_ids))) }
+
+    ####################################################################################################################
+    # Returns up to `limit` of a server's active races, optionally restricted to a single category, newest first
+    @db_read
+    def get_active_races(guild_id, category_id=None, limit=25):
+        query = AsyncRace.select().where((AsyncRace.guild_id == guild_id) & (AsyncRace.active == True))
+        if category_id is not None:
+            query = query.where(AsyncRace.category_id == category_id)
+        return list(query.order_by(AsyncRace.start.desc()).limit(limit))
+
+    ####################################################################################################################
+    # Returns a page of races in a category, newest first. Inactive races are only included if requested
+    @db_read
+    def get_race_page(category_id, page, page_size, include_inactive):
+        query = AsyncRace.select().where(AsyncRace.category_id == category_id)
+        if not include_inactive:
+            query = query.where(AsyncRace.active == True)
+        return list(query.order_by(AsyncRace.id.desc()).paginate(page, page_size))
+
+    ####################################################################################################################
+    # Deletes a race and refreshes the stats and season standings of everyone who submitted to it in the same transaction
+    @db_write
+    def delete_race(race):
+        user_ids = [user_id for user_id, in AsyncSubmission.select(AsyncSubmission.user_id).where(AsyncSubmission.race_id == race.id).tuples()]
+        race.delete_instance()
+        refresh_racer_stats(user_ids, race.category_id)
+        refresh_race_season_points(race.id)
+
+    ####################################################################################################################
+    # Queries the most recent, active race ID for the given category, 0 if there is none
+    @db_read
+    def get_latest_race_id(category_id):
+        race_id = 0
+        if category_id != 0:
+            race = AsyncRace.select()                                                                 \
+                            .where((AsyncRace.category_id == category_id) & (AsyncRace.active == True)) \
+                            .order_by(AsyncRace.id.desc())                                            \
+                            .first()
+            if race is not None:
+                race_id = race.id
+        return race_id
+
+
+########################################################################################################################
+# Racers
+########################################################################################################################
+    ####################################################################################################################
+    # Retrieves a racer by ID, None if they're not in the database
+    @db_read
+    def get_user(user_id):
+        try:
+            user = AsyncRacer.select().where(AsyncRacer.user_id == user_id).get()
+        except DoesNotExist:
+            user = None
+        return user
+
+    ####################################################################################################################
+    # Adds the member to the async_racers table if they're missing, and makes sure their username is up to date
+    @db_write
+    def check_add_member(user_id, username):
+        racer, created = AsyncRacer.get_or_create(user_id=user_id, defaults={ 'username': username, 'wheel_weight': 1 })
+        if not created and racer.username != username:
+            racer.username = username
+            racer.save()
+
+    ####################################################################################################################
+    # Returns a dict of user ID to username for every racer
+    @db_read
+    def get_racer_names():
+        return dict(AsyncRacer.select(AsyncRacer.user_id, AsyncRacer.username).tuples())
+
+    ####################################################################################################################
+    # Updates the usernames in a dict of user ID to username with one bulk update
+    @db_write
+    def update_racer_names(names):
+        racers = [AsyncRacer(user_id=user_id, username=username) for user_id, username in names.items()]
+        AsyncRacer.bulk_update(racers, fields=[AsyncRacer.username], batch_size=100)
+
+########################################################################################################################
+# Submissions
+########################################################################################################################
+    ####################################################################################################################
+    # Retrieves a submission based on race and user IDs. Returns None if no matching submission exists
+    @db_read
+    def get_submission(race_id, user_id):
+        try:
+            submission = AsyncSubmission.select()                                                                           \
+                                        .where((AsyncSubmission.race_id == race_id) & (AsyncSubmission.user_id == user_id)) \
+                                        .get()
+        except DoesNotExist:
+            submission = None
+        return submission
+
+    @db_read
+    def get_submission_by_id(submission_id):
+        try:
+            submission = AsyncSubmission.select().where(AsyncSubmission.id == submission_id).get()
+        except DoesNotExist:
+            submission = None
+        return submission
+
+    ####################################################################################################################
+    # Returns the submissions for the given race ID sorted by finish time with forfeits last. If a page is provided only
+    # that page of the leaderboard is returned
+    @db_read
+    def get_leaderboard(race_id, page=None, page_size=None):
+        query = AsyncSubmission.select()                                  \
+                               .where(AsyncSubmission.race_id == race_id) \
+                               .order_by(*leaderboard_order())
+        if page is not None:
+            query = query.paginate(page, page_size)
+        return list(query)
+
+    ####################################################################################################################
+    # Returns the leaderboard places for a batch of (race_id, user_id) pairs as a dictionary keyed by the pair. Places
+    # are 1 based and follow the leaderboard order, pairs without a submission are left out. All races are ranked with
+    # a single windowed query.
+    @db_read
+    def get_places(race_user_pairs):
+        race_user_pairs = set(race_user_pairs)
+        places = {}
+        if len(race_user_pairs) > 0:
+            race_ids = { race_id for race_id, user_id in race_user_pairs }
+            user_ids = { user_id for race_id, user_id in race_user_pairs }
+            place = fn.ROW_NUMBER().over(partition_by=[AsyncSubmission.race_id], order_by=leaderboard_order())
+            ranked = AsyncSubmission.select(AsyncSubmission.race_id, AsyncSubmission.user_id, place.alias('place')) \
+                                    .where(AsyncSubmission.race_id.in_(list(race_ids)))                           \
+                                    .alias('ranked')
+            query = Select([ranked], [ranked.c.race_id, ranked.c.user_id, ranked.c.place]) \
+                          .where(ranked.c.user_id.in_(list(user_ids)))                      \
+                          .bind(db)
+            for race_id, user_id, place in query.tuples():
+                if (race_id, user_id) in race_user_pairs:
+                    places[(race_id, user_id)] = place
+        return places
+
+    ####################################################################################################################
+    # Saves a new or edited submission to the race and updates the submitter's stats for the race's category and the
+    # race's season points in one transaction
+    @db_write
+    def save_submission(submission, race):
+        old_submission = None
+        old_place = None
+        if submission.id is not None:
+            # The stats are updated by the difference from the submission as it's stored before the edit
+            old_submission = AsyncSubmission.get_or_none(AsyncSubmission.id == submission.id)
+            if old_submission is not None:
+                old_place = submission_place(old_submission)
+        submission.save()
+        apply_submission_racer_stats(race, submission, old_submission, old_place)
+        refresh_race_season_points(race.id)
+
+    @db_read
+    def get_race_submission_count(race_id):
+        return AsyncSubmission.select().where(AsyncSubmission.race_id == race_id).count()
+
+    ####################################################################################################################
+    # Returns a page of a user's submissions to a server's races, newest first
+    @db_read
+    def get_user_submission_page(user_id, guild_id, page, page_size):
+        return list(AsyncSubmission.select()                                                                     \
+                                   .join(AsyncRace, on=(AsyncSubmission.race_id == AsyncRace.id))              \
+                                   .where((AsyncSubmission.user_id == user_id) & (AsyncRace.guild_id == guild_id)) \
+                                   .order_by(AsyncSubmission.id.desc())                                          \
+                                   .paginate(page, page_size))
+
+    ####################################################################################################################
+    # Returns True if any submission exists for the race
+    @db_read
+    def race_has_submissions(race_id):
+        return AsyncSubmission.select().where(AsyncSubmission.race_id == race_id).exists()
+
+    ####################################################################################################################
+    # Collects the next mode suggestions from the race_count most recent active races in the given category with a
+    # single join. Suggestions that only differ by case or whitespace are merged. Returns a list of
+    # (suggestion, [usernames]) tuples, most suggested first.
+    @db_read
+    def get_next_mode_suggestions(category_id, race_count):
+        recent_races = AsyncRace.select(AsyncRace.id)                                                           \
+                                .where((AsyncRace.category_id == category_id) & (AsyncRace.active == True)) \
+                                .order_by(AsyncRace.start.desc())                                            \
+                                .limit(race_count)
+        query = AsyncSubmission.select(AsyncSubmission.next_mode, AsyncSubmission.username, AsyncRacer.username)                     \
+                               .join(AsyncRacer, JOIN.LEFT_OUTER, on=(AsyncSubmission.user_id == AsyncRacer.user_id))               \
+                               .where((AsyncSubmission.race_id.in_(recent_races)) & (AsyncSubmission.next_mode.is_null(False)))      \
+                               .order_by(AsyncSubmission.id)                                                                        \
+                               .tuples()
+        suggestions = {}
+        for next_mode, submission_username, racer_username in query:
+            next_mode_str = ' '.join(next_mode.split())
+            if next_mode_str == "" or next_mode_str == "None":
+                continue
+            username = racer_username if racer_username is not None else submission_username
+            usernames = suggestions.setdefault(next_mode_str.lower(), (next_mode_str, []))[1]
+            if username not in usernames:
+                usernames.append(username)
+        # Stable sort, ties stay in the order they were first suggested
+        return sorted(suggestions.values(), key=lambda s: len(s[1]), reverse=True)
+
+########################################################################################################################
+# Rosters
+########################################################################################################################
+    ####################################################################################################################
+    # Returns a list of racers assigned to the provided race_id, or None if no racers are assigned
+    @db_read
+    def get_roster(race_id):
+        roster = list(RaceRoster.select().where(RaceRoster.race_id == race_id))
+        if len(roster) == 0:
+            roster = None
+        return roster
+
+    ####################################################################################################################
+    # Returns the IDs of the racers assigned to any active race on a server
+    @db_read
+    def get_rostered_user_ids(guild_id):
+        query = RaceRoster.select(RaceRoster.user_id)                                                     \
+                          .join(AsyncRace, on=(RaceRoster.race_id == AsyncRace.id))                       \
+                          .where((AsyncRace.guild_id == guild_id) & (AsyncRace.active == True))           \
+                          .tuples()
+        return {user_id for user_id, in query}
+
+    ####################################################################################################################
+    # Returns the race roster assignment row for this race ID/User ID combo, or None if it doesn't exist
+    @db_read
+    def get_assignment(race_id, user_id):
+        try:
+            assignment = RaceRoster.select()                                                         \
+                                   .where((RaceRoster.race_id == race_id) & (RaceRoster.user_id == user_id)) \
+                                   .get()
+        except DoesNotExist:
+            assignment = None
+        return assignment
+
+    ####################################################################################################################
+    # Loads a RaceSnapshot for the race, or None if it doesn't exist. The roster, racer names and submissions are
+    # fetched with a single joined query.
+    @db_read
+    def query_race_snapshot(race_id):
+        try:
+            race = AsyncRace.select().where(AsyncRace.id == race_id).get()
+        except DoesNotExist:
+            return None
+        query = RaceRoster.select(RaceRoster, AsyncRacer, AsyncSubmission)                                      \
+                          .join(AsyncRacer, JOIN.LEFT_OUTER, on=(RaceRoster.user_id == AsyncRacer.user_id), attr='racer') \
+                          .switch(RaceRoster)                                                                     \
+                          .join(AsyncSubmission, JOIN.LEFT_OUTER,
+                                on=((AsyncSubmission.race_id == RaceRoster.race_id) & (AsyncSubmission.user_id == RaceRoster.user_id)),
+                                attr='submission')                                                                \
+                          .where(RaceRoster.race_id == race_id)                                                   \
+                          .order_by(RaceRoster.id)
+        roster = []
+        for r in query:
+            username = None if r.racer is None else r.racer.username
+            roster.append(RosterEntry(assignment=r, username=username, submission=r.submission))
+        return RaceSnapshot(race=race, roster=roster)
+
+    @db_read
+    def query_is_public_race(race_id):
+        return not RaceRoster.select().where(RaceRoster.race_id == race_id).exists()
+
+    ####################################################################################################################
+    # Finalizes a race in a single transaction. Every rostered racer without a submission gets a forfeit, found with one
+    # query and written with one insert, and the race is marked inactive if deactivate is set. The stats of everyone in
+    # the race are refreshed now that their places are final and the race is rescored for its seasons. Returns the
+    # number of forfeits added.
+    @db_write
+    def finalize_race(race_id, deactivate, add_forfeits=True):
+        forfeit_count = 0
+        if add_forfeits:
+            missing = RaceRoster.select(RaceRoster.user_id, AsyncRacer.username)                                \
+                                .join(AsyncRacer, JOIN.LEFT_OUTER, on=(RaceRoster.user_id == AsyncRacer.user_id)) \
+                                .switch(RaceRoster)                                                               \
+                                .join(AsyncSubmission, JOIN.LEFT_OUTER,
+                                      on=((AsyncSubmission.race_id == RaceRoster.race_id) & (AsyncSubmission.user_id == RaceRoster.user_id))) \
+                                .where((RaceRoster.race_id == race_id) & (AsyncSubmission.id.is_null()))         \
+                                .tuples()
+            rows = []
+            for user_id, username in missing:
+                rows.append({ AsyncSubmission.race_id: race_id,
+                              AsyncSubmission.user_id: user_id,
+                              AsyncSubmission.username: username,
+                              AsyncSubmission.finish_time_igt: DnfTime,
+                              AsyncSubmission.finish_time_rta: DnfTime,
+                              AsyncSubmission.finish_seconds_igt: None,
+                              AsyncSubmission.finish_seconds_rta: None,
+                              AsyncSubmission.is_dnf: True,
+                              AsyncSubmission.collection_rate: 216,
+                              AsyncSubmission.comment: None,
+                              AsyncSubmission.next_mode: None })
+            if len(rows) > 0:
+                AsyncSubmission.insert_many(rows).execute()
+            forfeit_count = len(rows)
+        if deactivate:
+            AsyncRace.update(active=False).where(AsyncRace.id == race_id).execute()
+        refresh_race_racer_stats(race_id)
+        refresh_race_season_points(race_id)
+        return forfeit_count
+
+########################################################################################################################
+# Racer Stats
+########################################################################################################################
+    ####################################################################################################################
+    # Returns a racer's stats in a server's categories as a list of (category, RacerStats), oldest category first. A
+    # weekly streak that didn't include one of the two most recent weekly races has been broken and is returned as 0,
+    # checked with a lookup of just those two races.
+    @db_read
+    def get_racer_stats(user_id, guild_id):
+        query = RacerStats.select(RacerStats, RaceCategory)                                                   \
+                          .join(RaceCategory, on=(RacerStats.category_id == RaceCategory.id), attr='category') \
+                          .where((RacerStats.user_id == user_id) & (RaceCategory.guild_id == guild_id))        \
+                          .order_by(RaceCategory.id)
+        results = []
+        for stats in query:
+            if stats.weekly_streak > 0:
+                current_race_id, race_ids = weekly_race_ids(stats.category_id, limit=2)
+                if stats.last_weekly_race_id not in race_ids:
+                    stats.weekly_streak = 0
+            results.append((stats.category, stats))
+        return results
+
+    ####################################################################################################################
+    # Refreshes the stats and season points of everyone who submitted to a race, e.g. when it stops being the current
+    # weekly race
+    @db_write
+    def refresh_race_stats(race_id):
+        refresh_race_racer_stats(race_id)
+        refresh_race_season_points(race_id)
+
+########################################################################################################################
+# Seasons
+########################################################################################################################
+    ####################################################################################################################
+    # Returns a server's seasons, most recently started first
+    @db_read
+    def get_seasons(guild_id):
+        return list(Season.select().where(Season.guild_id == guild_id).order_by(Season.start_date.desc(), Season.id.desc()))
+
+    ####################################################################################################################
+    # Adds a season and scores the races it already covers
+    @db_write
+    def add_season(season):
+        season.save()
+        races = AsyncRace.select(AsyncRace.id)                                                  \
+                         .where((AsyncRace.category_id == season.category_id) &
+                                (AsyncRace.start >= season.start_date) & (AsyncRace.start <= season.end_date)) \
+                         .tuples()
+        for race_id, in races:
+            refresh_race_season_points(race_id)
+
+    ####################################################################################################################
+    # Returns a page of a season's standings as (rank, user ID, username, points, races, wins) tuples, most points
+    # first. Racers with the same points share a rank.
+    @db_read
+    def get_season_standings(season_id, page, page_size):
+        query = SeasonStanding.select(SeasonStanding.user_id, AsyncRacer.username, SeasonStanding.points,
+                                      SeasonStanding.races, SeasonStanding.wins)                                      \
+                              .join(AsyncRacer, JOIN.LEFT_OUTER, on=(SeasonStanding.user_id == AsyncRacer.user_id)) \
+                              .where(SeasonStanding.season_id == season_id)                                         \
+                              .order_by(SeasonStanding.points.desc(), SeasonStanding.wins.desc(), SeasonStanding.user_id) \
+                              .paginate(page, page_size)                                                             \
+                              .tuples()
+        standings = []
+        rank = None
+        previous_points = None
+        for position, (user_id, username, points, races, wins) in enumerate(query):
+            if points != previous_points:
+                if position == 0:
+                    rank = SeasonStanding.select().where((SeasonStanding.season_id == season_id) &
+                                                         (SeasonStanding.points > points)).count() + 1
+                else:
+                    rank = (page - 1) * page_size + position + 1
+                previous_points = points
+            standings.append((rank, user_id, username, points, races, wins))
+        return standings
+
+    @db_read
+    def get_season_standing_count(season_id):
+        return SeasonStanding.select().where(SeasonStanding.season_id == season_id).count()
+
+########################################################################################################################
+# Exports
+########################################################################################################################
+    ####################################################################################################################
+    # Streams the submissions matching the filters (see race_export.export_query) into a binary file object as gzip
+    # compressed CSV or JSON Lines. Runs on a reader thread, so writes carry on while a large export is written. Returns
+    # the number of rows exported.
+    @db_read
+    def export_submissions(fileobj, export_format, **filters):
+        return race_export.export_submissions(fileobj, export_format, **filters)
+
+########################################################################################################################
+# Servers
+########################################################################################################################
+    ####################################################################################################################
+    # Returns a dict of server ID to ServerInfo for every server the bot is configured for
+    @db_read
+    def get_servers():
+        return { s.server_id: s.to_server_info() for s in ServerSettings.select() }
+
+    ####################################################################################################################
+    # Adds the provided ServerInfos to the server_settings table. Servers that already have a row are left as they are,
+    # once stored the database copy is the one that's used.
+    @db_write
+    def seed_servers(server_infos):
+        existing_ids = { s.server_id for s in ServerSettings.select(ServerSettings.server_id) }
+        for server_info in server_infos:
+            if server_info.server_id not in existing_ids:
+                ServerSettings.from_server_info(server_info).save(force_insert=True)
+                existing_ids.add(server_info.server_id)
+
+########################################################################################################################
+# Leaderboard Channel Messages
+########################################################################################################################
+    ####################################################################################################################
+    # Returns the messages posted in a leaderboard channel, in display order
+    @db_read
+    def get_leaderboard_messages(channel_id):
+        return list(LeaderboardMessage.select()                                       \
+                                      .where(LeaderboardMessage.channel_id == channel_id) \
+                                      .order_by(LeaderboardMessage.position))
+
+    ####################################################################################################################
+    # Replaces the recorded messages for a leaderboard channel with a list of (message_id, content_hash) tuples
+    @db_write
+    def set_leaderboard_messages(channel_id, messages):
+        LeaderboardMessage.delete().where(LeaderboardMessage.channel_id == channel_id).execute()
+        rows = [{ 'channel_id': channel_id, 'position': idx, 'message_id': message_id, 'content_hash': content_hash }
+                for idx, (message_id, content_hash) in enumerate(messages)]
+        if len(rows) > 0:
+            LeaderboardMessage.insert_many(rows).execute()
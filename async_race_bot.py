@@ -7,20 +7,39 @@ import bot_tokens
 import argparse
 import logging
 import asyncio
+from gateway_intents import cog_requirements
 
 logging.basicConfig(level=logging.INFO)
 
 parser = argparse.ArgumentParser(description='Async Race Discord Bot')
 parser.add_argument('-test', '-t', action='store_true', help='Runs the bot in test mode')
+parser.add_argument('-shard_count', type=int, default=config.ShardCount, help='Runs the bot sharded with this many shards in total, 0 uses the count recommended by Discord')
+parser.add_argument('-shard_ids', default=None, help='Shards run by this process, as a range and/or list e.g. "0-3" or "0,2,4". Requires -shard_count')
 args = parser.parse_args(sys.argv[1:])
 
+# Parses a shard list like "0-3,6" into [0, 1, 2, 3, 6]
+def parse_shard_ids(shard_ids_str):
+    shard_ids = []
+    for part in shard_ids_str.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            shard_ids += list(range(int(first), int(last) + 1))
+        elif part.strip() != '':
+            shard_ids.append(int(part))
+    return shard_ids
+
+shard_ids = config.ShardIds if args.shard_ids is None else parse_shard_ids(args.shard_ids)
+if shard_ids is not None and not args.shard_count:
+    parser.error("-shard_ids requires a non-zero -shard_count")
+
 bot_token = bot_tokens.PRODUCTION_TOKEN
 test_mode = args.test == True or config.TEST_MODE
 if test_mode:
     logging.info("Setting test mode for BOT")
     bot_token = bot_tokens.TEST_TOKEN
 
-class Bot(commands.Bot):
+# Shared setup for the plain and sharded bots
+class BotMixin():
     def __init__(self, **kwargs):
         super().__init__(command_prefix=commands.when_mentioned_or('$'), **kwargs)
         for cog in config.cogs:
@@ -32,14 +51,37 @@ class Bot(commands.Bot):
     async def on_ready(self):
         logging.info('Logged on as {0} (ID: {0.id})'.format(self.user))
 
+    # nextcord syncs the application commands with Discord on every gateway connect by default. Only add them to the
+    # bot here, AsyncRaceHandler syncs them once on startup if they have changed since the last sync.
+    async def on_connect(self):
+        self.add_all_application_commands()
+
     async def close(self):
         await self.get_cog('AsyncRaceHandler').close()
         await super().close()
 
+class Bot(BotMixin, commands.Bot):
+    pass
+
+# Runs several gateway connections, each receiving the events of a subset of the servers, so event traffic from large
+# servers doesn't hold up command handling for the others
+class ShardedBot(BotMixin, commands.AutoShardedBot):
+    pass
 
-intents = nextcord.Intents.all()
-intents.members = True
-bot = Bot(intents=intents)
+# Only ask for the events the loaded cogs use. The server member lists aren't chunked into the cache at startup, the
+# cogs cache the members they need themselves, and no cog reads cached messages
+intents, member_cache_flags = cog_requirements(config.cogs)
+logging.info(f"Gateway intents: {', '.join(name for name, enabled in intents if enabled)}")
+bot_options = dict(intents=intents,
+                   member_cache_flags=member_cache_flags,
+                   chunk_guilds_at_startup=False,
+                   max_messages=None)
+if args.shard_count is None:
+    bot = Bot(**bot_options)
+else:
+    shard_count = None if args.shard_count == 0 else args.shard_count
+    logging.info(f"Running shards {'all' if shard_ids is None else shard_ids} of {shard_count or 'recommended count'}")
+    bot = ShardedBot(shard_count=shard_count, shard_ids=shard_ids, **bot_options)
 if test_mode:
     server_utils_cog = bot.get_cog('ServerUtils')
     if server_utils_cog is not None:
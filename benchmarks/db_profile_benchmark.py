@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Replays a burst of weekly race submissions against a temporary copy of a database under each connection profile in
+# config.DbProfiles. Each submission runs the same repository calls as AsyncHandler.submit_time and then re-reads the
+# leaderboard, the way the leaderboard channel update does, so reads and writes overlap like they do after a weekly
+# race goes live. The original database file is never modified.
+#
+# Usage: python benchmarks/db_profile_benchmark.py [database] [submissions] [concurrency]
+import asyncio
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from async_db_orm import db, db_pragmas, profile_uses_wal, check_add_db_tables, AsyncRace, AsyncSubmission
+from async_db_repo import AsyncRaceRepo
+
+FirstUserId = 900000000000000000
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def submit(repo, race_id, user_id, semaphore, submit_ms, read_ms):
+    async with semaphore:
+        start = time.perf_counter()
+        race = await repo.get_race(race_id)
+        await repo.check_add_member(user_id, f"bench_{user_id - FirstUserId}")
+        await repo.is_public_race(race_id)
+        submission = await repo.get_submission(race_id, user_id)
+        if submission is None:
+            submission = AsyncSubmission(race_id=race_id, user_id=user_id, username=f"bench_{user_id - FirstUserId}",
+                                         collection_rate=216, comment="benchmark", next_mode="")
+        submission.set_finish_times("1:23:45", "1:25:00", False)
+        submission.submit_date = "2024-01-01 00:00"
+        await repo.save_submission(submission, race)
+        submit_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        await repo.get_leaderboard(race_id)
+        read_ms.append((time.perf_counter() - start) * 1000)
+
+async def replay(submissions, concurrency):
+    repo = AsyncRaceRepo()
+    await repo.check_db_tables()
+    race_id = await repo.read(lambda: AsyncRace.select(AsyncRace.id).order_by(AsyncRace.id.desc()).scalar())
+    semaphore = asyncio.Semaphore(concurrency)
+    submit_ms = []
+    read_ms = []
+    start = time.perf_counter()
+    await asyncio.gather(*(submit(repo, race_id, FirstUserId + i, semaphore, submit_ms, read_ms) for i in range(submissions)))
+    elapsed = time.perf_counter() - start
+    wal_size = None
+    if profile_uses_wal(config.DbProfile):
+        wal_size = os.path.getsize(f"{db.database}-wal")
+        await repo.checkpoint_wal('TRUNCATE')
+    repo.close()
+    return elapsed, submit_ms, read_ms, wal_size
+
+def run_profile(profile_name, source, submissions, concurrency):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.join(tmp_dir, os.path.basename(source))
+        shutil.copyfile(source, db_file)
+        config.DbProfile = profile_name
+        db.init(db_file, timeout=config.DbBusyTimeoutSeconds, pragmas=db_pragmas(profile_name))
+        elapsed, submit_ms, read_ms, wal_size = asyncio.run(replay(submissions, concurrency))
+        db.close()
+    print(f"    {profile_name:<10} {submissions / elapsed:8.0f} submissions/s   "
+          f"submit p50/p95/p99: {percentile(submit_ms, 50):6.2f} / {percentile(submit_ms, 95):6.2f} / {percentile(submit_ms, 99):6.2f} ms   "
+          f"leaderboard p50/p95/p99: {percentile(read_ms, 50):6.2f} / {percentile(read_ms, 95):6.2f} / {percentile(read_ms, 99):6.2f} ms"
+          + ("" if wal_size is None else f"   WAL before checkpoint: {wal_size / 1024:.0f} KiB"))
+
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 else "testDbUtil.db"
+    submissions = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    print(f"{submissions} submissions to {source}, {concurrency} at a time, {config.DbReaderThreads} reader threads")
+    for profile_name in config.DbProfiles:
+        run_profile(profile_name, source, submissions, concurrency)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Compares the query plans and timings of the hot submission/roster lookups before and after the schema migrations.
+# The benchmark runs against a temporary copy of the database so the original file is never modified.
+#
+# Usage: python benchmarks/index_benchmark.py [database] [iterations]
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from async_db_orm import db, check_add_db_tables, get_schema_version
+
+# Each query is named after the bot code path it backs. Parameters are filled in from the data in the database.
+Queries = {
+    "getSubmission":      ("SELECT * FROM async_submissions WHERE race_id = ? AND user_id = ?", ("race_id", "user_id")),
+    "get_leaderboard":    ("SELECT * FROM async_submissions WHERE race_id = ?", ("race_id",)),
+    "race_results_impl":  ("SELECT * FROM async_submissions WHERE user_id = ? ORDER BY id DESC LIMIT 5", ("user_id",)),
+    "get_assignment":     ("SELECT * FROM async_race_rosters WHERE race_id = ? AND user_id = ?", ("race_id", "user_id")),
+    "is_public_race":     ("SELECT 1 FROM async_race_rosters WHERE race_id = ? LIMIT 1", ("race_id",)),
+}
+
+def sample_params(conn):
+    race_id, user_id = conn.execute("SELECT race_id, user_id FROM async_submissions ORDER BY id DESC LIMIT 1").fetchone()
+    return { "race_id": race_id, "user_id": user_id }
+
+def run_queries(db_file, iterations):
+    results = {}
+    conn = sqlite3.connect(db_file)
+    params = sample_params(conn)
+    for name, (sql, param_names) in Queries.items():
+        args = tuple(params[p] for p in param_names)
+        plan = " / ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, args))
+        start = time.perf_counter()
+        for i in range(iterations):
+            conn.execute(sql, args).fetchall()
+        elapsed_us = (time.perf_counter() - start) * 1e6 / iterations
+        results[name] = (plan, elapsed_us)
+    conn.close()
+    return results
+
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 else "GmpRaceInfo.db"
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.join(tmp_dir, os.path.basename(source))
+        shutil.copyfile(source, db_file)
+
+        before = run_queries(db_file, iterations)
+
+        db.init(db_file)
+        check_add_db_tables()
+        version = get_schema_version()
+        db.close()
+
+        after = run_queries(db_file, iterations)
+
+    print(f"{source}: {iterations} iterations per query, schema migrated to version {version}\n")
+    for name in Queries:
+        before_plan, before_us = before[name]
+        after_plan, after_us = after[name]
+        print(f"{name}")
+        print(f"    before: {before_us:8.1f} us  {before_plan}")
+        print(f"    after:  {after_us:8.1f} us  {after_plan}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# Compares the memory the gateway cache holds for a synthetic large server when the bot runs with every intent and the
+# full member list chunked at startup (how it used to run) against the intents and member cache flags computed from
+# the configured cogs, with only the weekly race done role holders and the rostered racers cached the way the async
+# race cog caches them at startup. The server is fed through nextcord's own guild and chunk handling, nothing connects
+# to Discord.
+#
+# Usage: python benchmarks/intents_benchmark.py [members] [voice_members] [role_holders] [rostered_racers]
+import gc
+import os
+import sys
+import tracemalloc
+
+import nextcord
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from gateway_intents import cog_requirements, cache_matching
+
+GuildId = 485284146063736832
+FirstUserId = 200000000000000000
+FirstRoleId = 300000000000000000
+TextChannelId = 400000000000000000
+VoiceChannelId = 400000000000000001
+RoleCount = 40
+WeeklyRaceDoneRoleId = FirstRoleId + RoleCount
+ChunkSize = 1000
+
+# The first role_holders members hold the weekly race done role
+def make_member(i, role_holders=0):
+    user_id = FirstUserId + i
+    roles = [str(FirstRoleId + (i % RoleCount)), str(FirstRoleId + ((i * 7) % RoleCount))]
+    if i < role_holders:
+        roles.append(str(WeeklyRaceDoneRoleId))
+    return {
+        'user': {'id': str(user_id), 'username': f"racer_{i:06d}", 'global_name': f"Racer {i}", 'discriminator': '0', 'avatar': None},
+        'roles': roles,
+        'joined_at': '2022-01-01T00:00:00+00:00',
+        'nick': None if i % 3 else f"nick_{i}",
+        'deaf': False,
+        'mute': False,
+    }
+
+def make_presence(i):
+    return {
+        'user': {'id': str(FirstUserId + i)},
+        'status': 'online' if i % 2 else 'idle',
+        'activities': [{'name': 'A Link to the Past', 'type': 0, 'created_at': 0}],
+        'client_status': {'desktop': 'online'},
+    }
+
+def make_voice_state(i):
+    return {'user_id': str(FirstUserId + i), 'channel_id': str(VoiceChannelId), 'session_id': f"s{i}", 'deaf': False,
+            'mute': False, 'self_deaf': False, 'self_mute': False, 'self_video': False, 'suppress': False,
+            'member': make_member(i)}
+
+# The GUILD_CREATE payload Discord sends for a large server: members and presences only for the users in voice, the
+# rest of the member list only arrives through member chunks
+def make_guild(member_count, voice_count, intents):
+    guild = {
+        'id': str(GuildId),
+        'name': 'Synthetic Large Server',
+        'member_count': member_count,
+        'large': True,
+        'roles': [{'id': str(GuildId), 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0, 'hoist': False,
+                   'managed': False, 'mentionable': False}] +
+                 [{'id': str(FirstRoleId + r), 'name': f"role_{r}", 'permissions': '0', 'position': r + 1, 'color': 0,
+                   'hoist': False, 'managed': False, 'mentionable': True} for r in range(RoleCount + 1)],
+        'channels': [{'id': str(TextChannelId), 'type': 0, 'name': 'async', 'position': 0, 'permission_overwrites': []},
+                     {'id': str(VoiceChannelId), 'type': 2, 'name': 'voice', 'position': 1, 'permission_overwrites': [],
+                      'bitrate': 64000, 'user_limit': 0}],
+        'members': [],
+        'presences': [],
+        'voice_states': [],
+    }
+    if intents.voice_states:
+        guild['voice_states'] = [make_voice_state(i) for i in range(voice_count)]
+        guild['members'] = [make_member(i) for i in range(voice_count)]
+        if intents.presences:
+            guild['presences'] = [make_presence(i) for i in range(voice_count)]
+    return guild
+
+# Same member and presence handling as ConnectionState.parse_guild_members_chunk followed by the chunk request adding
+# the members to the guild
+def load_chunks(state, guild, member_count, intents, role_holders):
+    for first in range(0, member_count, ChunkSize):
+        indexes = range(first, min(first + ChunkSize, member_count))
+        members = [nextcord.Member(data=make_member(i, role_holders), guild=guild, state=state) for i in indexes]
+        if intents.presences:
+            for member, i in zip(members, indexes):
+                member._presence_update(make_presence(i), {})
+        if state.member_cache_flags.joined:
+            for member in members:
+                guild._add_member(member)
+
+# Same filtering as gateway_intents.cache_matching_members: the member list is paged through and only the role holders
+# and rostered racers of each page are cached
+def cache_kept_members(state, guild, member_count, role_holders, rostered_ids):
+    for first in range(0, member_count, ChunkSize):
+        members = [nextcord.Member(data=make_member(i, role_holders), guild=guild, state=state)
+                   for i in range(first, min(first + ChunkSize, member_count))]
+        cache_matching(guild, members,
+                       lambda member: member.id in rostered_ids or member.get_role(WeeklyRaceDoneRoleId) is not None)
+
+def measure(label, intents, member_cache_flags, chunk_guilds, member_count, voice_count, role_holders, rostered_ids):
+    gc.collect()
+    tracemalloc.start()
+    client = nextcord.Client(intents=intents, member_cache_flags=member_cache_flags, chunk_guilds_at_startup=chunk_guilds)
+    state = client._connection
+    guild = state._add_guild_from_data(make_guild(member_count, voice_count, intents))
+    if chunk_guilds and intents.members:
+        load_chunks(state, guild, member_count, intents, role_holders)
+    elif intents.members:
+        cache_kept_members(state, guild, member_count, role_holders, rostered_ids)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    voice_states = len(guild.get_channel(VoiceChannelId).voice_states)
+    print(f"    {label:<10} cached members: {len(guild.members):>7}  voice states: {voice_states:>4}  retained: {current / 2**20:8.2f} MiB  peak: {peak / 2**20:8.2f} MiB")
+    return client
+
+def main():
+    member_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    voice_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    role_holders = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+    rostered_count = int(sys.argv[4]) if len(sys.argv) > 4 else 50
+    # Rostered racers are taken from the end of the member list so they don't overlap the role holders
+    rostered_ids = {FirstUserId + member_count - 1 - i for i in range(rostered_count)}
+    intents, member_cache_flags = cog_requirements(config.cogs)
+    print(f"{member_count} members, {voice_count} in voice, {role_holders} role holders, {rostered_count} rostered racers, cogs: {', '.join(config.cogs)}")
+    print(f"Computed intents: {', '.join(name for name, enabled in intents if enabled)}")
+    print(f"Computed member cache flags: {', '.join(name for name, enabled in member_cache_flags if enabled) or 'none'}")
+    measure("all", nextcord.Intents.all(), nextcord.MemberCacheFlags.all(), True, member_count, voice_count,
+            role_holders, rostered_ids)
+    measure("computed", intents, member_cache_flags, False, member_count, voice_count, role_holders, rostered_ids)
+
+if __name__ == '__main__':
+    main()
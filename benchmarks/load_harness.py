@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+# Offline load harness for AsyncHandler. Runs the cog against a temporary copy of a database with stand-in Discord
+# objects (interactions, servers, members, roles and text channels) that record what the bot sends, edits, deletes and
+# purges, and answer REST calls after a fixed delay. Generates racers, races and submissions, then drives submit_time,
+# leaderboard_impl, race_results_impl, show_race_info_impl, the stats command and post_results concurrently and reports
+# the latency percentiles and SQL statements per command, so slow paths and query count regressions show up without
+# Discord.
+#
+# Usage: python benchmarks/load_harness.py [-racers N] [-races M] [-submissions K] [-concurrency C] [-rest_ms MS]
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from async_db_orm import *
+from command_metrics import CommandMetrics, current_timing, record_rest_call
+from table_renderer import render_table
+
+FirstUserId = 900000000000000000
+FirstMessageId = 1
+AssignedRaceRosterSize = 4
+
+########################################################################################################################
+# Discord stand-ins
+########################################################################################################################
+class Recorder():
+    '''Counts the Discord calls the bot makes and simulates their latency.'''
+
+    def __init__(self, rest_ms):
+        self.rest_seconds = rest_ms / 1000
+        self.calls = Counter()
+        self.message_ids = itertools.count(FirstMessageId)
+
+    async def rest_call(self, kind):
+        self.calls[kind] += 1
+        start = time.perf_counter()
+        await asyncio.sleep(self.rest_seconds)
+        record_rest_call(time.perf_counter() - start)
+
+class FakeRole():
+    def __init__(self, role_id, name):
+        self.id = role_id
+        self.name = name
+        self.mention = f"<@&{role_id}>"
+
+    def __eq__(self, other):
+        return isinstance(other, FakeRole) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+class FakeMember():
+    def __init__(self, recorder, user_id, name, roles=None):
+        self.recorder = recorder
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{user_id}>"
+        self.roles = list(roles or [])
+
+    async def add_roles(self, *roles, reason=None):
+        await self.recorder.rest_call("add_roles")
+        self.roles += [role for role in roles if role not in self.roles]
+
+    async def remove_roles(self, *roles, reason=None):
+        await self.recorder.rest_call("remove_roles")
+        self.roles = [role for role in self.roles if role not in roles]
+
+class FakeMessage():
+    def __init__(self, channel, message_id, content, author):
+        self.channel = channel
+        self.id = message_id
+        self.content = content
+        self.author = author
+
+    async def edit(self, content=None, **kwargs):
+        await self.channel.recorder.rest_call("edit")
+        self.content = content
+
+    async def delete(self):
+        await self.channel.recorder.rest_call("delete")
+        self.channel.messages.pop(self.id, None)
+
+class FakeHistory():
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def flatten(self):
+        return self.messages
+
+class FakeTextChannel():
+    def __init__(self, recorder, channel_id, bot_user):
+        self.recorder = recorder
+        self.id = channel_id
+        self.bot_user = bot_user
+        self.messages = {}
+
+    async def send(self, content=None, **kwargs):
+        await self.recorder.rest_call("send")
+        message = FakeMessage(self, next(self.recorder.message_ids), content, self.bot_user)
+        self.messages[message.id] = message
+        return message
+
+    def get_partial_message(self, message_id):
+        return self.messages.get(message_id) or FakeMessage(self, message_id, None, self.bot_user)
+
+    def history(self, limit=None):
+        return FakeHistory(list(self.messages.values())[-limit:])
+
+    async def purge(self, **kwargs):
+        await self.recorder.rest_call("purge")
+        self.messages = {}
+
+class FakeGuild():
+    def __init__(self, recorder, server_info, bot_user):
+        self.id = server_info.server_id
+        role_ids = [server_info.race_creator_role, server_info.weekly_race_done_role, server_info.weekly_racer_role]
+        self.roles = [FakeRole(role_id, f"role_{role_id}") for role_id in role_ids if role_id != 0]
+        channel_ids = [server_info.weekly_submit_channel, server_info.tourney_submit_channel, server_info.race_creator_channel,
+                       server_info.weekly_leaderboard_channel, server_info.announcements_channel,
+                       server_info.tourney_async_channel] + list(server_info.bot_command_channels)
+        self.channels = {channel_id: FakeTextChannel(recorder, channel_id, bot_user) for channel_id in set(channel_ids) if channel_id != 0}
+
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+class FakeResponse():
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def defer(self, ephemeral=False, with_message=False):
+        await self.interaction.recorder.rest_call("defer")
+        self.done = True
+
+    async def send_message(self, content=None, **kwargs):
+        await self.interaction.recorder.rest_call("respond")
+        self.done = True
+
+    async def send_modal(self, modal):
+        await self.interaction.recorder.rest_call("modal")
+        self.done = True
+
+class FakeInteraction():
+    ids = itertools.count(1)
+
+    def __init__(self, recorder, guild, member, channel_id):
+        self.recorder = recorder
+        self.id = next(FakeInteraction.ids)
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = member
+        self.channel = guild.get_channel(channel_id)
+        self.channel_id = channel_id
+        self.response = FakeResponse(self)
+
+    # Like nextcord, the first send is the initial response and the rest are followups
+    async def send(self, content=None, **kwargs):
+        await self.recorder.rest_call("respond" if not self.response.done else "followup")
+        self.response.done = True
+
+class FakeHttp():
+    async def request(self, *args, **kwargs):
+        pass
+
+class FakeBot():
+    def __init__(self, recorder):
+        self.user = FakeMember(recorder, 1, "AsyncRaceBot")
+        self.http = FakeHttp()
+        self.application_id = None
+        self.guilds = {}
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def get_channel(self, channel_id):
+        for guild in self.guilds.values():
+            channel = guild.get_channel(channel_id)
+            if channel is not None:
+                return channel
+        return None
+
+    def get_all_application_commands(self):
+        return []
+
+    async def sync_application_commands(self):
+        pass
+
+class FakeTextInput():
+    def __init__(self, value):
+        self.value = value
+
+# Stands in for the SubmitTimeModal the submit buttons open, filled in with a random time
+class FakeSubmitModal():
+    def __init__(self, rng, forfeit):
+        from cogs.async_handler import AsyncHandler
+        seconds = rng.randint(4000, 9000)
+        finish = f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+        self.user_id = None
+        self.submitType = AsyncHandler.SubmitType.FORFEIT if forfeit else AsyncHandler.SubmitType.SUBMIT
+        self.igt = FakeTextInput(finish)
+        self.rta = FakeTextInput(finish)
+        self.collection_rate = FakeTextInput(str(rng.randint(100, 216)))
+        self.comment = FakeTextInput("load harness")
+        self.next_mode = FakeTextInput(rng.choice(["open", "keysanity", "ad", "mc boss", ""]))
+        self.vod_link = FakeTextInput("")
+
+########################################################################################################################
+# Data generation
+########################################################################################################################
+# Adds the racers and races to the database. The last public race is the current weekly race, every fourth race is
+# assigned to a roster of racers. Runs on the repository's writer thread. Returns the public and assigned race IDs.
+def generate_data(server_info, racer_count, race_count, rng):
+    AsyncRacer.insert_many([{'user_id': FirstUserId + i, 'username': f"racer_{i:05d}", 'wheel_weight': 1}
+                            for i in range(racer_count)]).on_conflict_ignore().execute()
+    public_races = []
+    assigned_races = []
+    for i in range(race_count):
+        is_assigned = i % 4 == 3
+        category_id = 0 if is_assigned else server_info.weekly_category_id
+        race = AsyncRace.create(start=date.today(), seed=f"https://alttpr.com/h/harness{i}", description=f"Harness race {i}",
+                                additional_instructions="", category_id=category_id, active=True,
+                                guild_id=server_info.server_id)
+        if is_assigned:
+            assigned_races.append(race.id)
+            for user_index in rng.sample(range(racer_count), min(AssignedRaceRosterSize, racer_count)):
+                RaceRoster.create(race_id=race.id, user_id=FirstUserId + user_index)
+        else:
+            public_races.append(race.id)
+    return public_races, assigned_races
+
+########################################################################################################################
+# Load generation
+########################################################################################################################
+class Harness():
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.recorder = Recorder(args.rest_ms)
+        self.metrics = CommandMetrics()
+        self.samples = defaultdict(list)
+
+    ####################################################################################################################
+    # Runs one command under its own timing and records its latency and statement count
+    async def timed(self, name, coro):
+        token = self.metrics.start(name)
+        timing = current_timing.get()
+        try:
+            await coro
+        finally:
+            self.metrics.finish(token)
+            self.samples[name].append(timing)
+
+    def interaction(self, member, channel_id=None):
+        return FakeInteraction(self.recorder, self.guild, member, channel_id or self.server_info.weekly_submit_channel)
+
+    def member(self, user_id):
+        return FakeMember(self.recorder, user_id, f"racer_{user_id - FirstUserId:05d}")
+
+    async def run(self):
+        from cogs.async_handler import AsyncHandler
+        args = self.args
+        bot = FakeBot(self.recorder)
+        handler = AsyncHandler(bot)
+        self.server_info = handler.default_server
+        self.guild = FakeGuild(self.recorder, self.server_info, bot.user)
+        bot.guilds[self.guild.id] = self.guild
+        await handler.on_ready_handler()
+        public_races, assigned_races = await handler.db.write(generate_data, self.server_info, args.racers, args.races, self.rng)
+        rosters = {race_id: [r.user_id for r in await handler.db.get_roster(race_id)] for race_id in assigned_races}
+        race_creator = FakeMember(self.recorder, FirstUserId - 1, "race_creator", [self.guild.get_role(self.server_info.race_creator_role)])
+        all_races = public_races + assigned_races
+
+        # Submissions go to random public races, weighted towards the current weekly race, and to the rosters of the
+        # assigned races until each is complete, which posts its results
+        operations = []
+        roster_slots = [(race_id, user_id) for race_id, user_ids in rosters.items() for user_id in user_ids]
+        self.rng.shuffle(roster_slots)
+        for i in range(args.submissions):
+            if i % 5 == 4 and len(roster_slots) > 0:
+                race_id, user_id = roster_slots.pop()
+            else:
+                race_id = public_races[-1] if self.rng.random() < 0.5 else self.rng.choice(public_races)
+                user_id = FirstUserId + self.rng.randrange(args.racers)
+            modal = FakeSubmitModal(self.rng, forfeit=self.rng.random() < 0.05)
+            operations.append(("submit_time", lambda m=modal, r=race_id, u=user_id: handler.submit_time(m, self.interaction(self.member(u)), r)))
+        for i in range(args.submissions):
+            user_id = FirstUserId + self.rng.randrange(args.racers)
+            race_id = self.rng.choice(all_races)
+            kind = self.rng.choice(("leaderboard_impl", "race_results_impl", "show_race_info_impl", "racer_stats"))
+            if kind == "leaderboard_impl":
+                operations.append((kind, lambda r=race_id: handler.leaderboard_impl(self.interaction(race_creator), r)))
+            elif kind == "race_results_impl":
+                operations.append((kind, lambda u=user_id: handler.race_results_impl(self.interaction(self.member(u)), AsyncHandler.RaceResultsData(1, u))))
+            elif kind == "racer_stats":
+                operations.append((kind, lambda u=user_id: handler.racer_stats.callback(handler, self.interaction(self.member(u)), None)))
+            else:
+                operations.append((kind, lambda r=race_id, u=user_id: handler.show_race_info_impl(self.interaction(self.member(u)), r)))
+        for race_id in assigned_races[:max(1, len(assigned_races) // 2)]:
+            operations.append(("post_results", lambda r=race_id: self.post_results(handler, r)))
+        self.rng.shuffle(operations)
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        async def run_operation(name, make_coro):
+            async with semaphore:
+                await self.timed(name, make_coro())
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run_operation(name, make_coro) for name, make_coro in operations))
+        elapsed = time.perf_counter() - start
+        await handler.close()
+        return len(operations), elapsed
+
+    async def post_results(self, handler, race_id):
+        await handler.post_results(await handler.db.get_race(race_id))
+
+    def report(self, operation_count, elapsed):
+        args = self.args
+        print(f"{args.racers} racers, {args.races} races, {args.submissions} submissions, {operation_count} commands "
+              f"with {args.concurrency} in flight, {args.rest_ms} ms per Discord call: {elapsed:.2f}s, "
+              f"{operation_count / elapsed:.0f} commands/s")
+        rows = []
+        for name in sorted(self.samples):
+            timings = self.samples[name]
+            wall_ms = sorted(t.wall_seconds * 1000 for t in timings)
+            rows.append([name,
+                         len(timings),
+                         f"{percentile(wall_ms, 50):.1f}",
+                         f"{percentile(wall_ms, 95):.1f}",
+                         f"{percentile(wall_ms, 99):.1f}",
+                         f"{sum(t.db_seconds for t in timings) * 1000 / len(timings):.1f}",
+                         f"{sum(t.queries for t in timings) / len(timings):.1f}",
+                         max(t.queries for t in timings)])
+        for message in render_table(["Command", "Runs", "p50 ms", "p95 ms", "p99 ms", "DB ms", "Queries", "Max queries"], rows, 100000, align={"Command": "l"}):
+            print(message.strip("`"))
+        print("Discord calls: " + ", ".join(f"{kind} {count}" for kind, count in sorted(self.recorder.calls.items())))
+
+def percentile(ordered_values, pct):
+    return ordered_values[min(len(ordered_values) - 1, int(len(ordered_values) * pct / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load harness for the async race cog')
+    parser.add_argument('-db', default="testDbUtil.db", help='Database to run against, a temporary copy is used')
+    parser.add_argument('-racers', type=int, default=200, help='Number of racers to generate')
+    parser.add_argument('-races', type=int, default=20, help='Number of races to generate, every fourth one is assigned')
+    parser.add_argument('-submissions', type=int, default=500, help='Number of submissions, the same number of read commands is mixed in')
+    parser.add_argument('-concurrency', type=int, default=20, help='Commands in flight at once')
+    parser.add_argument('-rest_ms', type=float, default=0, help='Simulated latency of each Discord call in ms')
+    parser.add_argument('-seed', type=int, default=1, help='Random seed')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.join(tmp_dir, os.path.basename(args.db))
+        shutil.copyfile(args.db, db_file)
+        db.init(db_file, timeout=config.DbBusyTimeoutSeconds, pragmas=db_pragmas(config.DbProfile))
+        config.CommandTreeHashFile = os.path.join(tmp_dir, "command_tree.hash")
+        config.MetricsFile = None
+        config.DbCheckpointSeconds = None
+        config.LeaderboardDebounceSeconds = 0.05
+        harness = Harness(args)
+        operation_count, elapsed = asyncio.run(harness.run())
+        db.close()
+    harness.report(operation_count, elapsed)
+
+if __name__ == '__main__':
+    main()
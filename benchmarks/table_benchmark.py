@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Compares rendering a leaderboard with the shared PrettyTable + buildResponseMessageList path the bot used to use against
+# table_renderer.render_table, and checks that both produce the same table text. PrettyTable is only needed to run this
+# benchmark, the bot itself no longer uses it.
+#
+# Usage: python benchmarks/table_benchmark.py [rows] [iterations]
+import os
+import sys
+import time
+
+from prettytable import PrettyTable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from table_renderer import render_table
+
+CharLimit = 2000 - 10
+FieldNames = ["#", "Name", "IGT", "RTA", "CR"]
+
+def make_rows(count):
+    return [[i + 1, f"racer_{i:04d}", f"{i % 3}:{i % 60:02d}:{(i * 7) % 60:02d}", "DNF" if i % 11 == 0 else "1:23:45", 100 + (i % 50)]
+            for i in range(count)]
+
+# Same line based splitting as AsyncHandler.buildResponseMessageList for messages without over long lines
+def split_lines(message):
+    if len(message) <= CharLimit:
+        return [message]
+    message_list = []
+    curr_message = ""
+    for line in message.split("\n"):
+        if len(curr_message) + len(line) > CharLimit:
+            message_list.append(curr_message)
+            curr_message = ""
+        curr_message += line + "\n"
+    message_list.append(curr_message)
+    return message_list
+
+def prettytable_render(rows):
+    pt = PrettyTable()
+    pt.field_names = FieldNames
+    for row in rows:
+        pt.add_row(row)
+    return [f"`{msg}`" for msg in split_lines(pt.get_string())]
+
+def renderer_render(rows):
+    return render_table(FieldNames, rows, CharLimit)
+
+def time_it(func, rows, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(rows)
+    return (time.perf_counter() - start) * 1e3 / iterations
+
+def table_text(message_list):
+    return "\n".join(msg.strip("`").strip("\n") for msg in message_list)
+
+def main():
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rows = make_rows(row_count)
+
+    same = table_text(prettytable_render(rows)) == table_text(renderer_render(rows))
+    pt_ms = time_it(prettytable_render, rows, iterations)
+    tr_ms = time_it(renderer_render, rows, iterations)
+
+    print(f"{row_count} rows, {iterations} iterations, identical table text: {same}")
+    print(f"    prettytable:    {pt_ms:8.3f} ms  {len(prettytable_render(rows))} messages")
+    print(f"    table_renderer: {tr_ms:8.3f} ms  {len(renderer_render(rows))} messages")
+
+if __name__ == '__main__':
+    main()
@@ -2,17 +2,33 @@
 from nextcord.ext import commands
 import nextcord
 import logging
-from prettytable import PrettyTable, DEFAULT, ALL
 import re
 import asyncio
+import hashlib
+import io
+import tempfile
+import time
+from collections import defaultdict
 from datetime import datetime, date
 from async_db_orm import *
+from async_db_repo import AsyncRaceRepo
+from race_cache import LruCache
+from leaderboard_publisher import LeaderboardPublisher
+from table_renderer import render_table
+from role_reset import RoleResetJob
+from gateway_intents import cache_members, cache_matching_members, uncache_members
+from racer_directory import RacerDirectory
+from response_pipeline import ResponsePipeline, pack_messages
+from command_sync import sync_if_changed
+from command_metrics import metrics, timed_callback, instrument_rest
+from race_export import ExportFormats
 from enum import Enum
 import config
 
 # Discord limit is 2000 characters, subtract a few to account for formatting, newlines, etc
 DiscordApiCharLimit = 2000 - 10
 ItemsPerPage = 5
+StandingsPerPage = 20
 
 # We use certain emojis and it's easier to refer to a variable name than use the emoji itself, particularly for the user specific ones
 ThumbsUpEmoji = '👍'
@@ -24,47 +40,12 @@ NoPermissionMsg = "You do not have permissions to use this command in this chann
 SubmitChannelMsg = "Click below to submit/edit a time or FF from this week's race. Once you've submitted a time you can view the leaderboard."
 SelfEditNoPermission = "Editing of assigned async race submissions is not allowed. Contact a race creator (mod) to edit"
 
-DnfTime = "23:59:59"
-
-# Returns a dictionary of race category options from the database, where the key is the category name and the value is the category ID.
-# This is used to create a Select UI element with the race categories as drop down options.
-def getRaceCategoryChoices():
-    cats = RaceCategory.select()
-    choices = {}
-    for c in cats:
-        choices[c.name] = c.id
-    return choices
-
-# Returns a dictionary of inactive races from the race database, where the key is a string containing race ID and description and the value is the race ID.
-# This is used to create a Select UI element with the races as drop down options.
-def getInactiveRaceChoices():
-    races = AsyncRace.select().where(AsyncRace.active == False)
-    choices = {}
-    for r in races:
-        choices[f"{r.id} - {r.description}"] = r.id
-    return choices
-
-# Used to sort game times stored in the database (IGT or RTA)
-def sort_game_time(submission):
-    game_time = submission.finish_time_igt
-    if config.RtaIsPrimary:
-        game_time = submission.finish_time_rta
-    # Convert the time to seconds for sorting
-    ret = 0
-    if game_time is not None and game_time != '':
-        parts = game_time.split(':')
-        hours = 0
-        mins = 0
-        sec = 0
-        if len(parts) == 3:
-            hours = int(parts[0])
-            min = int(parts[1])
-            sec = int(parts[2])
-        else:
-            min = int(parts[0])
-            sec = int(parts[1])
-        ret = (3600 * hours) + (60 * min) + sec
-    return ret
+# The member lists aren't chunked into the cache. The cog caches the holders of the weekly race done role and the
+# racers assigned to active races, see cacheServerMembers. With the joined flag, nextcord also caches members that join
+# or are updated, so a member given the role by hand is cached too. The rest are dropped by pruneMemberCache.
+RequiredIntents = nextcord.Intents(guilds=True, members=True)
+RequiredMemberCacheFlags = nextcord.MemberCacheFlags.none()
+RequiredMemberCacheFlags.joined = True
 
 class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     '''Cog which handles commands related to Async Races.'''
@@ -72,16 +53,37 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     def __init__(self, bot):
         self.bot = bot
         self.test_mode = False
-        # Once server info is defined, it should be set here as follows:
-        self.server_info = config.PRODUCTION_SERVER
+        # Servers the bot is configured for, keyed by Discord server ID. Loaded from the database in on_ready, the
+        # default server from config is added to the database the first time the bot runs.
+        self.servers = {}
+        self.default_server = config.PRODUCTION_SERVER
         if config.TEST_MODE:
             self.setTestMode()
-        self.pt = PrettyTable()
-        self.resetPrettyTable()
+        # All database access goes through the repository so queries never block the event loop
+        self.db = AsyncRaceRepo()
+        # Rendered leaderboard message lists keyed by race ID. Anything that changes a race or its submissions must
+        # invalidate that race's entry
+        self.leaderboard_cache = LruCache(config.LeaderboardCacheSize)
+        # Background leaderboard channel updaters keyed by channel ID, see signalLeaderboardUpdate
+        self.leaderboard_publishers = {}
+        self.leaderboard_update_locks = defaultdict(asyncio.Lock)
+        # Running weekly role resets keyed by server ID
+        self.role_reset_jobs = {}
+        # The latest member cache load or prune of each server keyed by server ID, a role reset waits for it to finish
+        self.member_cache_tasks = {}
+        self.racer_directory = RacerDirectory(self.db, config.RacerNameFlushSeconds)
+        # Startup runs on the first on_ready only, created_at is the start of the startup timings
+        self.started = False
+        self.created_at = time.perf_counter()
+        # Command timings in progress keyed by interaction ID, and the task writing config.MetricsFile
+        self.command_timings = {}
+        self.metrics_task = None
+        self.checkpoint_task = None
+        instrument_rest(bot)
 
     def setTestMode(self):
         self.test_mode = True
-        self.server_info = config.TEST_SERVER
+        self.default_server = config.TEST_SERVER
 
 ########################################################################################################################
 # UI Elements
@@ -97,7 +99,7 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     # This modal will display a form that has fields matching the required info for a database submission or a forfeit. 
     # On completion it will call the AsyncHandler submit_time function to add the submission to the database.
     class SubmitTimeModal(nextcord.ui.Modal):
-        def __init__(self, asyncHandler, race_id, isWeeklyAsync, submitType):
+        def __init__(self, asyncHandler, race_id, isWeeklyAsync, isPublicRace, submitType):
             super().__init__("Async Time Submit", timeout=None)
             self.asyncHandler = asyncHandler
             self.race_id = race_id
@@ -150,12 +152,13 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             self.add_item(self.comment)
             if isWeeklyAsync and config.SuggestNextWeeklyMode:
                 self.add_item(self.next_mode)
-            if not self.asyncHandler.is_public_race(race_id):
+            if not isPublicRace:
                 self.add_item(self.vod_link)
 
+        @timed_callback
         async def callback(self, interaction: nextcord.Interaction) -> None:
             await self.asyncHandler.submit_time(self, interaction, self.race_id)
-            if self.asyncHandler.queryLatestWeeklyRaceId() == self.race_id:
+            if await self.asyncHandler.queryLatestWeeklyRaceId(interaction.guild_id) == self.race_id:
                 await self.asyncHandler.assignWeeklyAsyncRole(interaction.guild, interaction.user)
 
     ########################################################################################################################
@@ -164,8 +167,9 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     # On completion, saves the race in the database and calls the member callback function if it has been populated.
     # This callback mechanism is used by AsyncHandler to do special handling of weekly races (announcement, roles, etc).
     class AddRaceModal(nextcord.ui.Modal):
-        def __init__(self, race=None):
+        def __init__(self, asyncHandler, race=None):
             super().__init__("Add Race", timeout=None)
+            self.asyncHandler = asyncHandler
             self.start_race_callback = None
             self.race = race
             self.category_id = None if race is None else race.category_id
@@ -184,12 +188,14 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
                 required=False)
             self.add_item(self.instructions)
 
+        @timed_callback
         async def callback(self, interaction: nextcord.Interaction):
             start_date = None
             is_create = False
             if self.race is None:
                 # Create a new race
                 race = AsyncRace()
+                race.guild_id = interaction.guild_id
                 is_create = True
             else:
                 race = self.race
@@ -198,7 +204,8 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             race.additional_instructions = self.instructions.value
             race.category_id = self.category_id
             race.active = False if is_create else race.active
-            race.save()
+            await self.asyncHandler.db.save(race)
+            self.asyncHandler.leaderboard_cache.invalidate(race.id)
             verb = "Added" if is_create else "Edited"
             await interaction.send(f"{verb} race ID: {race.id}")
             if self.start_race_callback is not None:
@@ -207,13 +214,10 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     # Implements a Select (drop down list) with a list of available race categories in the database
     # On selection, calls the provided callback function
     class CategorySelect(nextcord.ui.Select):
-        def __init__(self, callback_func, data):
+        def __init__(self, callback_func, data, categories):
             self.callback_func = callback_func
             self.user_data = data
 
-            # Query the categories
-            categories = RaceCategory.select()
-
             # Create the options list from the categories
             options = []
             for c in categories:
@@ -227,15 +231,16 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
                 max_values=1,
                 options=options)
 
+        @timed_callback
         async def callback(self, interaction: nextcord.Interaction):
             await self.callback_func(interaction, int(interaction.data['values'][0]), self.user_data)
 
     # Discord View object that prompts the user with a CategorySelect and sends the selection to the AddRaceModal
     class AddRaceView(nextcord.ui.View):
-        def __init__(self, add_race_modal):
+        def __init__(self, add_race_modal, categories):
             super().__init__(timeout=None)
             self.add_race_modal = add_race_modal
-            self.category_select = AsyncHandler.CategorySelect(self.callback_func, add_race_modal)
+            self.category_select = AsyncHandler.CategorySelect(self.callback_func, add_race_modal, categories)
             self.add_item(self.category_select)
 
         async def callback_func(self, interaction, category_id, add_race_modal):
@@ -244,9 +249,9 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
 
     # Discord View object that prompts the user with a CcategorySelect and sends the result to the provided callback function.
     class CategorySelectView(nextcord.ui.View):
-        def __init__(self, callback_func, data):
+        def __init__(self, callback_func, data, categories):
             super().__init__(timeout=None)
-            self.category_select = AsyncHandler.CategorySelect(callback_func, data)
+            self.category_select = AsyncHandler.CategorySelect(callback_func, data, categories)
             self.add_item(self.category_select)
 
     ########################################################################################################################
@@ -267,6 +272,7 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
                 max_values=1,
                 options=options)
 
+        @timed_callback
         async def callback(self, interaction: nextcord.Interaction):
             await self.callback_func(interaction, (self.values[0]=="Yes"), self.data)
 
@@ -281,16 +287,10 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     # Select UI element that prompts the user to select a race from a list of active races. The result is sent to the
     # provided callback.
     class RaceSelect(nextcord.ui.Select):
-        def __init__(self, callback_func, userdata):
+        def __init__(self, callback_func, userdata, races):
             self.callback_func = callback_func
             self.userdata = userdata
 
-            # Query the active races
-            races = AsyncRace.select()                         \
-                             .where(AsyncRace.active == True)  \
-                             .order_by(AsyncRace.start.desc()) \
-                             .limit(25)
-
             # Create the options list from the races
             options = []
             for r in races:
@@ -303,6 +303,7 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
                 max_values=1,
                 options=options)
 
+        @timed_callback
         async def callback(self, interaction: nextcord.Interaction):
             if self.userdata is None:
                 await self.callback_func(interaction, int(interaction.data['values'][0]))
@@ -311,25 +312,19 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
 
     # Discord View that displays a RaceSelect and sends the user choice to the provided callback
     class RaceSelectView(nextcord.ui.View):
-        def __init__(self, callback_func, userdata=None):
+        def __init__(self, callback_func, races, userdata=None):
             super().__init__(timeout=None)
             self.callback_func = callback_func
-            self.race_select = AsyncHandler.RaceSelect(self.callback_func, userdata)
+            self.race_select = AsyncHandler.RaceSelect(self.callback_func, userdata, races)
             self.add_item(self.race_select)
 
     # Select UI element that allows the user to select multiple races from a single race category. The chosen result
     # is sent to the provided callback.
     class MultiRaceSelect(nextcord.ui.Select):
-        def __init__(self, callback_func, data, category_id):
+        def __init__(self, callback_func, data, races):
             self.callback_func = callback_func
             self.user_data = data
 
-            # Query the active races
-            races = AsyncRace.select()                                                                   \
-                             .where((AsyncRace.active == True) & (AsyncRace.category_id == category_id)) \
-                             .order_by(AsyncRace.start.desc())                                           \
-                             .limit(25)
-
             # Create the options list from the races
             options = []
             for r in races:
@@ -342,15 +337,16 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
                 max_values=len(options),
                 options=options)
 
+        @timed_callback
         async def callback(self, interaction: nextcord.Interaction):
             await self.callback_func(interaction, self.user_data, interaction.data['values'])
 
     # Discord View that displays a MultiRaceSelect and sends the chosen options to the provided callback.
     class MultiRaceSelectView(nextcord.ui.View):
-        def __init__(self, callback_func, data, category_id):
+        def __init__(self, callback_func, data, races):
             super().__init__(timeout=None)
             self.callback_func = callback_func
-            self.race_select = AsyncHandler.MultiRaceSelect(self.callback_func, data, category_id)
+            self.race_select = AsyncHandler.MultiRaceSelect(self.callback_func, data, races)
             self.add_item(self.race_select)
 
     ########################################################################################################################
@@ -360,6 +356,7 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             super().__init__(style=style, row=row, label=label)
             self.race_id = race_id
             self.asyncHandler = asyncHandler
+        @timed_callback
         async def callback(self, interaction):
             await self.asyncHandler.leaderboard_impl(interaction, self.race_id)
 
@@ -368,6 +365,7 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             super().__init__(style=style, row=row, label=label)
             self.race_id = race_id
             self.asyncHandler = asyncHandler
+        @timed_callback
         async def callback(self, interaction):
             await self.asyncHandler.show_race_info_impl(interaction, self.race_id)
 
@@ -403,6 +401,7 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             self.callback_func = callback_func
             self.data = data
 
+        @timed_callback
         async def callback(self, interaction):
             self.data.page += 1
             await self.callback_func(interaction, self.data)
@@ -413,6 +412,7 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             self.callback_func = callback_func
             self.data = data
 
+        @timed_callback
         async def callback(self, interaction):
             self.data.page -= 1
             if self.data.page <= 0:
@@ -432,33 +432,36 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     ########################################################################################################################
     # Discord view which contains a row of buttons for Submit/Edit submission, Forfeit and Leaderboard
     class RaceInfoButtonView(nextcord.ui.View):
-        def __init__(self, asyncHandler, race_id):
+        def __init__(self, asyncHandler, race, isPublicRace):
             super().__init__(timeout=None)
-            race = asyncHandler.get_race(race_id)
-            isWeeklyAsync = race.category_id == asyncHandler.server_info.weekly_category_id
-            self.submit = AsyncHandler.SubmitTimeModal(asyncHandler, race_id, isWeeklyAsync, AsyncHandler.SubmitType.SUBMIT)
-            self.edit = AsyncHandler.SubmitTimeModal(asyncHandler, race_id, isWeeklyAsync, AsyncHandler.SubmitType.EDIT)
-            self.ff = AsyncHandler.SubmitTimeModal(asyncHandler, race_id, isWeeklyAsync, AsyncHandler.SubmitType.FORFEIT)
+            race_id = race.id
+            isWeeklyAsync = asyncHandler.isWeeklyRace(race)
+            self.submit = AsyncHandler.SubmitTimeModal(asyncHandler, race_id, isWeeklyAsync, isPublicRace, AsyncHandler.SubmitType.SUBMIT)
+            self.edit = AsyncHandler.SubmitTimeModal(asyncHandler, race_id, isWeeklyAsync, isPublicRace, AsyncHandler.SubmitType.EDIT)
+            self.ff = AsyncHandler.SubmitTimeModal(asyncHandler, race_id, isWeeklyAsync, isPublicRace, AsyncHandler.SubmitType.FORFEIT)
+            self.isPublicRace = isPublicRace
             self.race_id = race_id
             self.asyncHandler = asyncHandler
             leaderboard_button = AsyncHandler.LeaderboardButton(race_id, asyncHandler)
             self.add_item(leaderboard_button)
 
         @nextcord.ui.button(style=nextcord.ButtonStyle.blurple, label='Submit Time')
+        @timed_callback
         async def submit_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
-            submission = self.asyncHandler.getSubmission(self.race_id, interaction.user.id)
+            submission = await self.asyncHandler.db.get_submission(self.race_id, interaction.user.id)
             if submission is None:
                 await interaction.response.send_modal(self.submit)
             else:
                 await interaction.send(AlreadySubmittedMsg, ephemeral=True)
 
         @nextcord.ui.button(style=nextcord.ButtonStyle.grey, label='Edit Time')
+        @timed_callback
         async def edit_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
             # Get the user's current submission
-            submission = self.asyncHandler.getSubmission(self.race_id, interaction.user.id)
+            submission = await self.asyncHandler.db.get_submission(self.race_id, interaction.user.id)
             if submission is not None:
                 # Only allow edits of public races
-                if self.asyncHandler.is_public_race(submission.race_id):
+                if self.isPublicRace:
                     # Update default values using the existing submission
                     self.edit.igt.default_value = submission.finish_time_igt
                     self.edit.collection_rate.default_value = str(submission.collection_rate)
@@ -473,8 +476,9 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             await interaction.response.send_modal(self.edit)
 
         @nextcord.ui.button(style=nextcord.ButtonStyle.red, label='FF')
+        @timed_callback
         async def ff_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
-            submission = self.asyncHandler.getSubmission(self.race_id, interaction.user.id)
+            submission = await self.asyncHandler.db.get_submission(self.race_id, interaction.user.id)
             if submission is None:
                 await interaction.response.send_modal(self.ff)
             else:
@@ -485,43 +489,88 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
 # Utility Functions
 ########################################################################################################################
 ########################################################################################################################
-    def resetPrettyTable(self):
-        self.pt.set_style(DEFAULT)
-        self.pt.clear()
+    ####################################################################################################################
+    # Returns the ServerInfo for a Discord server ID, None if the bot isn't configured for that server
+    def get_server_info(self, guild_id):
+        return self.servers.get(guild_id)
+
+    ####################################################################################################################
+    # Runs before every application command in this cog, commands are only handled in servers the bot is configured for
+    async def cog_application_command_check(self, interaction):
+        if self.get_server_info(interaction.guild_id) is None:
+            await interaction.send("This server is not set up for async races", ephemeral=True)
+            return False
+        return True
+
+    ####################################################################################################################
+    # Every application command in this cog is timed, see command_metrics. UI callbacks are timed by timed_callback.
+    async def cog_application_command_before_invoke(self, interaction):
+        self.command_timings[interaction.id] = metrics.start(interaction.application_command.qualified_name)
+
+    async def cog_application_command_after_invoke(self, interaction):
+        token = self.command_timings.pop(interaction.id, None)
+        if token is not None:
+            metrics.finish(token)
+
+    ####################################################################################################################
+    # Writes the command metrics to config.MetricsFile every config.MetricsFileSeconds
+    async def write_metrics_file(self):
+        while True:
+            await asyncio.sleep(config.MetricsFileSeconds)
+            try:
+                metrics.write_file(config.MetricsFile)
+            except OSError:
+                logging.exception(f"Failed to write command metrics to {config.MetricsFile}")
+
+    ####################################################################################################################
+    # Checkpoints the database WAL every config.DbCheckpointSeconds
+    async def checkpoint_database(self):
+        while True:
+            await asyncio.sleep(config.DbCheckpointSeconds)
+            try:
+                busy, wal_pages, checkpointed_pages = await self.db.checkpoint_wal()
+                logging.info(f"Checkpointed {checkpointed_pages}/{wal_pages} WAL pages{' (busy)' if busy else ''}")
+            except Exception:
+                logging.exception("Failed to checkpoint the database WAL")
 
     def isRaceCreator(self, guild, user):
         ret = False
-        role = guild.get_role(self.server_info.race_creator_role)
-        if role in user.roles:
-            ret =  True
+        server_info = self.get_server_info(guild.id)
+        if server_info is not None:
+            role = guild.get_role(server_info.race_creator_role)
+            if role in user.roles:
+                ret =  True
         return ret
 
-    def isRaceCreatorChannel(self, channel_id):
-        return channel_id == self.server_info.race_creator_channel
+    def isRaceCreatorChannel(self, guild_id, channel_id):
+        server_info = self.get_server_info(guild_id)
+        return server_info is not None and channel_id == server_info.race_creator_channel
+
+    # Returns True if the race is in its server's weekly race category
+    def isWeeklyRace(self, race):
+        server_info = self.get_server_info(race.guild_id)
+        return server_info is not None and race.category_id == server_info.weekly_category_id
 
     # Checks that the user sending an interaction is both a race creator and sending the command from a race creator channel
     def checkRaceCreatorCommand(self, interaction):
         is_race_creator = self.isRaceCreator(interaction.guild, interaction.user)
         logging.info(f"User is race creator: {is_race_creator}")
-        return is_race_creator and self.isRaceCreatorChannel(interaction.channel_id)
+        return is_race_creator and self.isRaceCreatorChannel(interaction.guild_id, interaction.channel_id)
 
     ####################################################################################################################
     # Updates the Weekly Async Submit channel with the current race info and submit/ff/leaderboard buttons.
     # NOTE: This will remove all existing messages in the submit channel
-    async def add_submit_buttons(self, race=None):
-        if self.server_info.weekly_submit_channel != 0:
+    async def add_submit_buttons(self, server_info, race=None):
+        if server_info.weekly_submit_channel != 0:
             # Get the weekly submit channel
-            weekly_submit_channel = self.bot.get_channel(self.server_info.weekly_submit_channel)
+            weekly_submit_channel = self.bot.get_channel(server_info.weekly_submit_channel)
             # Remove any existing submit messages
             await weekly_submit_channel.purge()
-            if race is None:
-                # Add the new messages
-                race_id = self.queryLatestWeeklyRaceId()
-                race = self.get_race(race_id)
-            else:
-                race_id = race.id
-            await weekly_submit_channel.send(self.getRaceInfoTable(race), embed=self.getSeedEmbed(race))
-            await weekly_submit_channel.send(SubmitChannelMsg, view=AsyncHandler.RaceInfoButtonView(self, race_id))
+            # Add the new messages
+            race_id = await self.queryLatestWeeklyRaceId(server_info.server_id) if race is None else race.id
+            snapshot = await self.db.get_race_snapshot(race_id)
+            await weekly_submit_channel.send(self.getRaceInfoTable(snapshot), embed=self.getSeedEmbed(snapshot.race))
+            await weekly_submit_channel.send(SubmitChannelMsg, view=AsyncHandler.RaceInfoButtonView(self, snapshot.race, snapshot.is_public))
 
     ####################################################################################################################
     # This function breaks a response into multiple messages that meet the Discord API character limit
@@ -539,11 +588,9 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
                 curr_message_len = 0
 
                 for line in line_list:
-                    # If adding this line would put us over the limit, add the current message to the list and start over
-                    if curr_message_len + len(line) > DiscordApiCharLimit:
-                        if curr_message == "":
-                            logging.error("Something went wrong in buildResponseMessageList")
-                            continue
+                    # If adding this line would put us over the limit, add the current message to the list and start over.
+                    # A line that's over the limit by itself is split into sentences below.
+                    if curr_message != "" and curr_message_len + len(line) > DiscordApiCharLimit:
                         message_list.append(curr_message)
                         curr_message = ""
                         curr_message_len = 0
@@ -552,7 +599,7 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
                     if len(line) > DiscordApiCharLimit:
                         sentences = re.split('[.?!;]', line)
                         for s in sentences:
-                            if curr_message_len + len(s) > charLimit:
+                            if curr_message_len + len(s) > DiscordApiCharLimit:
                                 if curr_message == "":
                                     logging.error("Something went wrong in buildmessage_listFromLines")
                                     continue
@@ -568,35 +615,10 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
                     message_list.append(curr_message)
         return message_list
 
-    ####################################################################################################################
-    # Queries for a race by ID, returning None if it doesn't exist. Moved to a helper function to reduce the verbose
-    # try/except syntax
-    def get_race(self, race_id):
-        try:
-            race = AsyncRace.select().where(AsyncRace.id == race_id).get()
-        except:
-            race = None
-        return race
-    
     ####################################################################################################################
     # Returns the submissions for the given race ID sorted by finish time
-    def get_leaderboard(self, race):
-        submissions = AsyncSubmission.select()                                  \
-                                     .where(AsyncSubmission.race_id == race.id)
-        return sorted(submissions, key=sort_game_time)
-
-    ####################################################################################################################
-    # Returns a string containing which numeric place (e.g. 1st, 2nd, 3rd) a user came in a specific race
-    def get_place(self, race, userid):
-        place = 0
-
-        leaderboard = self.get_leaderboard(race)
-
-        if len(leaderboard) > 0:
-            for idx, s in enumerate(leaderboard):
-                if s.user_id == userid:
-                    place = (idx+1) # Plus one because the list is zero based but places are 1 based
-        return self.get_place_str(place)
+    async def get_leaderboard(self, race):
+        return await self.db.get_leaderboard(race.id)
 
     ####################################################################################################################
     # Given a numeric place, returns the ordinal string. e.g. 1 returns "1st", 2 "2nd" etc
@@ -665,101 +687,207 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     ####################################################################################################################
     # Assigns the weekly async racer role, which unlocks access to the spoiler channel
     async def assignWeeklyAsyncRole(self, guild, author):
-        if self.server_info.weekly_race_done_role != 0:
-            role = nextcord.utils.get(guild.roles, id=self.server_info.weekly_race_done_role)
+        server_info = self.get_server_info(guild.id)
+        if server_info is not None and server_info.weekly_race_done_role != 0:
+            role = nextcord.utils.get(guild.roles, id=server_info.weekly_race_done_role)
+            # Don't let a reset that's still running take the role back off
+            role_reset_job = self.role_reset_jobs.get(guild.id)
+            if role_reset_job is not None and role_reset_job.running():
+                role_reset_job.keep(author.id)
+            # Cached before the role is added so the member update event gives the cached member the role
+            cache_members(guild, [author])
             await author.add_roles(role)
 
     ####################################################################################################################
-    # Removes the weekly async racer role from all users in the server
+    # Removes the weekly async racer role from everyone who has it. The removals run in a background job so the caller
+    # doesn't wait on them, progress is posted to the channel the interaction came from.
     async def removeWeeklyAsyncRole(self, interaction):
-        if self.server_info.weekly_race_done_role != 0:
-            role = nextcord.utils.get(interaction.guild.roles, id=self.server_info.weekly_race_done_role)
-            for m in interaction.guild.members:
-                await m.remove_roles(role)
+        server_info = self.get_server_info(interaction.guild_id)
+        if server_info.weekly_race_done_role != 0:
+            role = nextcord.utils.get(interaction.guild.roles, id=server_info.weekly_race_done_role)
+            if interaction.guild_id in self.role_reset_jobs:
+                # Any members the previous job didn't get to yet still hold the role and are picked up by this one
+                await self.role_reset_jobs[interaction.guild_id].close()
+            status_channel = interaction.channel
+            status_message = None
+
+            async def report_progress(job, finished):
+                nonlocal status_message
+                if finished:
+                    text = f"Removed the {role.name} role from {job.removed}/{job.total} members"
+                    if job.failed > 0:
+                        text += f", {job.failed} failed (see log)"
+                else:
+                    text = f"Removing the {role.name} role: {job.done_count}/{job.total} members"
+                if not job.members_complete:
+                    text += ". The member list couldn't be fully loaded (see log), some members may still have the role"
+                if status_message is None:
+                    status_message = await status_channel.send(text)
+                else:
+                    await status_message.edit(content=text)
+
+            role_reset_job = RoleResetJob(role,
+                                          report_progress,
+                                          config.RoleResetConcurrency,
+                                          config.RoleResetProgressSeconds,
+                                          reason="New weekly async started",
+                                          members_loaded=self.member_cache_tasks.get(interaction.guild_id))
+            self.role_reset_jobs[interaction.guild_id] = role_reset_job
+            # The job waits for the member cache in the background, the interaction doesn't wait on it
+            role_reset_task = role_reset_job.start()
+            guild = interaction.guild
+
+            # Once the job is done, drops the members it took the role from. If the member cache couldn't be fully
+            # loaded for this reset, it's loaded again for the next one.
+            async def refresh_after_reset():
+                await asyncio.wait([role_reset_task])
+                if not await role_reset_job.wait_members_loaded():
+                    return await self.cacheServerMembers(guild, server_info)
+                self.pruneMemberCache(guild, await self.memberCacheFilter(guild, server_info))
+                return True
+
+            self.member_cache_tasks[guild.id] = asyncio.create_task(refresh_after_reset())
 
     ####################################################################################################################
-    # Queries the most recent, active weekly async race ID
-    def queryLatestWeeklyRaceId(self):
-        race_id = 0
-        if self.server_info.weekly_category_id != 0:
-            race_id =  AsyncRace.select()                                                                               \
-                                .where(AsyncRace.category_id == self.server_info.weekly_category_id & AsyncRace.active) \
-                                .order_by(AsyncRace.id.desc())                                                          \
-                                .get()                                                                                  \
-                                .id
-        return race_id
+    # Queries the most recent, active weekly async race ID for a server, 0 if there is none
+    async def queryLatestWeeklyRaceId(self, guild_id):
+        server_info = self.get_server_info(guild_id)
+        if server_info is None:
+            return 0
+        return await self.db.get_latest_race_id(server_info.weekly_category_id)
 
     ####################################################################################################################
-    # Builds the leaderboard message list for a specific race ID
-    def buildLeaderboardMessageList(self, race_id):
-        # Query race info
-        race = self.get_race(race_id)
-        race_submissions = self.get_leaderboard(race)
+    # Builds the leaderboard message list for a specific race ID, served from the leaderboard cache when possible
+    async def buildLeaderboardMessageList(self, race_id):
+        message_list = self.leaderboard_cache.get(race_id)
+        if message_list is None:
+            generation = self.leaderboard_cache.generation
+            # Query race info
+            race = await self.db.get_race(race_id)
+            if race is None:
+                return [f'No race found matching race ID {race_id}']
+            message_list = tuple(await self.renderLeaderboardMessageList(race))
+            self.leaderboard_cache.put(race_id, message_list, generation)
+        return list(message_list)
 
-        if race is not None:
-            leaderboardStr = ""
-            started_on_str = f"which started on {race.start}"
-            if len(race_submissions) == 0:
-                leaderboard_str = f'No results yet for race {race_id} ({race.description}) '
-                if self.is_public_race(race_id):
-                    leaderboard_str += started_on_str
+    ####################################################################################################################
+    # Queries the race submissions and renders the leaderboard message list
+    async def renderLeaderboardMessageList(self, race):
+        race_id = race.id
+        race_submissions = await self.get_leaderboard(race)
+        is_public_race = await self.db.is_public_race(race_id)
+        started_on_str = f"which started on {race.start}"
+        if len(race_submissions) == 0:
+            leaderboard_str = f'No results yet for race {race_id} ({race.description}) '
+            if is_public_race:
+                leaderboard_str += started_on_str
+        else:
+            leaderboard_str = f'Results for race {race_id} '
+            if is_public_race:
+                leaderboard_str += started_on_str
+            leaderboard_str += f'\n    **Mode: {race.description}**'
+            leaderboard_str += "\n"
+            if config.ShowSecondaryTimeField:
+                field_names = ["#", "Name", "IGT", "RTA", "CR"]
             else:
-                leaderboard_str = f'Results for race {race_id} '
-                if self.is_public_race(race_id):
-                    leaderboard_str += started_on_str
-                leaderboard_str += f'\n    **Mode: {race.description}**'
-                leaderboard_str += "\n"
-                self.resetPrettyTable()
+                if config.RtaIsPrimary:
+                    field_names = ["#", "Name", "RTA", "CR"]
+                else:
+                    field_names = ["#", "Name", "IGT", "CR"]
+            rows = []
+            for idx, submission in enumerate(race_submissions):
+                rowNum = idx+1
+                igt_str = "DNF" if submission.is_dnf else submission.finish_time_igt
+                rta_str = "DNF" if submission.is_dnf else submission.finish_time_rta
                 if config.ShowSecondaryTimeField:
-                    self.pt.field_names = ["#", "Name", "IGT", "RTA", "CR"]
+                    rows.append([rowNum, submission.username, igt_str, rta_str, submission.collection_rate])
                 else:
                     if config.RtaIsPrimary:
-                        self.pt.field_names = ["#", "Name", "RTA", "CR"]
+                        rows.append([rowNum, submission.username, rta_str, submission.collection_rate])
                     else:
-                        self.pt.field_names = ["#", "Name", "IGT", "CR"]
-                for idx, submission in enumerate(race_submissions):
-                    rowNum = idx+1
-                    igt_str = "DNF" if submission.finish_time_igt == DnfTime else submission.finish_time_igt
-                    rta_str = "DNF" if submission.finish_time_rta == DnfTime else submission.finish_time_rta
-                    if config.ShowSecondaryTimeField:
-                        self.pt.add_row([rowNum, submission.username, igt_str, rta_str, submission.collection_rate])
-                    else:
-                        if config.RtaIsPrimary:
-                            self.pt.add_row([rowNum, submission.username, rta_str, submission.collection_rate])
-                        else:
-                            self.pt.add_row([rowNum, submission.username, igt_str, submission.collection_rate])
-
-            message_list = self.buildResponseMessageList(leaderboard_str)
-            table_message_list = []
-            if len(race_submissions) > 0:
-                table_message_list = self.buildResponseMessageList(self.pt.get_string())
-                for idx, msg in enumerate(table_message_list):
-                    table_message_list[idx] = "`{}`".format(msg)
-            return message_list + table_message_list
-        else:
-            return [f'No race found matching race ID {race_id}']
+                        rows.append([rowNum, submission.username, igt_str, submission.collection_rate])
+
+        message_list = self.buildResponseMessageList(leaderboard_str)
+        table_message_list = []
+        if len(race_submissions) > 0:
+            table_message_list = render_table(field_names, rows, DiscordApiCharLimit)
+        return message_list + table_message_list
 
     ####################################################################################################################
-    # Updates the weekly leaderboard channel
+    # Updates the weekly leaderboard channel. The posted message IDs are stored in the database so existing messages can
+    # be edited in place, only the chunks whose content changed are edited and messages are only sent or deleted when
+    # the number of chunks changes.
     async def updateLeaderboardMessage(self, race_id, guild):
-        if self.server_info.weekly_leaderboard_channel != 0:
-            # Remove all messages from the leaderboard channel
-            leaderboard_channel = guild.get_channel(self.server_info.weekly_leaderboard_channel)
+        server_info = self.get_server_info(guild.id)
+        if server_info is not None and server_info.weekly_leaderboard_channel != 0:
+            channel_id = server_info.weekly_leaderboard_channel
+            # The background publisher and the mod utility can both update the channel, only one may edit it at a time
+            async with self.leaderboard_update_locks[channel_id]:
+                await self.updateLeaderboardMessageImpl(race_id, guild.get_channel(channel_id))
+
+    async def updateLeaderboardMessageImpl(self, race_id, leaderboard_channel):
+        message_list = await self.buildLeaderboardMessageList(race_id)
+        posted_messages = await self.db.get_leaderboard_messages(leaderboard_channel.id)
+
+        # If nothing has been recorded for this channel yet, start from a clean channel
+        repost = len(posted_messages) == 0
+        new_messages = []
+        if not repost:
+            for idx, msg in enumerate(message_list):
+                content_hash = hashlib.sha1(msg.encode()).hexdigest()
+                if idx < len(posted_messages):
+                    message_id = posted_messages[idx].message_id
+                    if posted_messages[idx].content_hash != content_hash:
+                        try:
+                            await leaderboard_channel.get_partial_message(message_id).edit(content=msg)
+                        except nextcord.NotFound:
+                            # Someone deleted one of our messages, sending a replacement would put the chunks
+                            # out of order so repost the whole leaderboard instead
+                            repost = True
+                            break
+                else:
+                    message_id = (await leaderboard_channel.send(msg)).id
+                new_messages.append((message_id, content_hash))
+            if not repost:
+                for posted_message in posted_messages[len(message_list):]:
+                    try:
+                        await leaderboard_channel.get_partial_message(posted_message.message_id).delete()
+                    except nextcord.NotFound:
+                        pass
+
+        if repost:
             await leaderboard_channel.purge()
-
-            # Then build and post the latest leaderboard
-            message_list = self.buildLeaderboardMessageList(race_id)
+            new_messages = []
             for msg in message_list:
-                await leaderboard_channel.send(msg)
+                message = await leaderboard_channel.send(msg)
+                new_messages.append((message.id, hashlib.sha1(msg.encode()).hexdigest()))
+
+        await self.db.set_leaderboard_messages(leaderboard_channel.id, new_messages)
+
+    ####################################################################################################################
+    # Queues a background update of the weekly leaderboard channel. Updates signalled in quick succession are coalesced
+    # into one, so callers don't wait on the channel edits.
+    def signalLeaderboardUpdate(self, race_id, guild):
+        server_info = self.get_server_info(guild.id)
+        channel_id = 0 if server_info is None else server_info.weekly_leaderboard_channel
+        if channel_id != 0:
+            publisher = self.leaderboard_publishers.get(channel_id)
+            if publisher is None:
+                publisher = LeaderboardPublisher(lambda race_id: self.updateLeaderboardMessage(race_id, guild),
+                                                 config.LeaderboardDebounceSeconds,
+                                                 config.LeaderboardPublishMaxRetries)
+                self.leaderboard_publishers[channel_id] = publisher
+            publisher.signal(race_id)
 
     ####################################################################################################################
     # Posts an announcement about a new weekly async, pinging the weekly async role
     async def post_announcement(self, race, interaction):
-        if self.server_info.announcements_channel != 0:
-            announcements_channel = self.bot.get_channel(self.server_info.announcements_channel)
+        server_info = self.get_server_info(interaction.guild_id)
+        if server_info.announcements_channel != 0:
+            announcements_channel = self.bot.get_channel(server_info.announcements_channel)
             ping = ""
-            if self.server_info.weekly_racer_role != 0:
-                role = interaction.guild.get_role(self.server_info.weekly_racer_role)
+            if server_info.weekly_racer_role != 0:
+                role = interaction.guild.get_role(server_info.weekly_racer_role)
                 ping = role.mention
             announcement_text = f'{ping}The new weekly async is live! Mode is: {race.description}'
             msg = await announcements_channel.send(announcement_text)
@@ -767,43 +895,22 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     ####################################################################################################################
     # Fetches a users display name
     async def getDisplayName(self, guild, user_id):
-        member = await guild.get_member(user_id)
+        member = guild.get_member(user_id)
+        if member is None:
+            member = await guild.fetch_member(user_id)
         return member.display_name
 
     ####################################################################################################################
     # Checks if the provided member is in the asyc_racers table, adds them if not
-    def checkAddMember(self, member):
-        # First check if the racer exists, if not add them
-        racer = None
-        try:
-            racer = AsyncRacer.select() \
-                              .where((AsyncRacer.user_id == member.id)) \
-                              .get()
-        except:
-            racer, created = AsyncRacer.get_or_create(user_id = member.id, username = member.name, wheel_weight=1)
-        
-        # Next make sure their username is up to date
-        if racer.username != member.name:
-                racer.username = member.name
-                racer.save()
-
-    ####################################################################################################################
-    ####################################################################################################################
-    # Retrieves a submission from the database based on race and user IDs. Returns None if no matching submission exists
-    def getSubmission(self, race_id, user_id):
-        try:
-            submission = AsyncSubmission.select()                                                                           \
-                                        .where((AsyncSubmission.race_id == race_id) & (AsyncSubmission.user_id == user_id)) \
-                                        .get()
-        except:
-            submission = None
-        return submission
+    async def checkAddMember(self, member):
+        await self.racer_directory.check_add(member.id, member.name)
 
     ####################################################################################################################
-    # Creates a nicely formatted table with race info
-    def getRaceInfoTable(self, race, is_race_creator=False):
+    # Creates a nicely formatted table with race info from a race snapshot
+    def getRaceInfoTable(self, snapshot, is_race_creator=False):
         info_str = None
-        if race is not None:
+        if snapshot is not None:
+            race = snapshot.race
             info_str =      f"`| Race Id:         |` {race.id}\n"
             info_str +=     f"`| Start Date:      |` {race.start}\n"
             info_str +=     f"`| Seed:            |` {race.seed}\n"
@@ -811,20 +918,18 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             if race.additional_instructions is not None and race.additional_instructions.strip() != "":
                 info_str += f"`| Add'l Info:      |` {race.additional_instructions}\n"
             # For assigned races, include the currently assigned racers
-            if not self.is_public_race(race.id):
-                roster = self.get_roster(race.id)
+            if not snapshot.is_public:
                 roster_str = f"`| Assigned Racers: |`"
                 first = True
-                for r in roster:
-                    user = self.get_user(r.user_id)
-                    started = "" if r.race_info_time is None else " *[started]*"
-                    started = started if self.getSubmission(r.race_id, r.user_id) is None else " *[submitted]*"
-                    if user is not None:
+                for entry in snapshot.roster:
+                    started = "" if entry.assignment.race_info_time is None else " *[started]*"
+                    started = started if entry.submission is None else " *[submitted]*"
+                    if entry.username is not None:
                         if first:
                             first = False
                         else:
                             roster_str += "`|                  |`"
-                        roster_str += f" {user.username}{started}\n"
+                        roster_str += f" {entry.username}{started}\n"
                 info_str += f"{roster_str}"
             if is_race_creator:
                 info_str += f"`| Is Active:       |` {race.active}\n"
@@ -843,16 +948,16 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
         logging.info('Handling submit_time')
 
         # First check if the race exists
-        race = self.get_race(race_id)
+        race = await self.db.get_race(race_id)
         if race is None or not race.active:
             await interaction.send(f"Error submitting time for race {race_id}. Race doesn't exist or is not active. Please notfiy the bot overlord(s)", ephemeral=True)
             return
 
-        user = interaction.user if modal.user_id is None else self.get_user(modal.user_id)
+        user = interaction.user if modal.user_id is None else await self.db.get_user(modal.user_id)
 
         # Then check if the user has permission to submit to this race
-        if user is not None and self.has_permission(race_id, user.id):
-            self.checkAddMember(user)
+        if user is not None and await self.has_permission(race_id, user.id):
+            await self.checkAddMember(user)
             user_id = user.id
             igt = "" if modal.igt.value is None else modal.igt.value
             rta = "" if modal.rta.value is None else modal.rta.value
@@ -861,7 +966,8 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             next_mode = modal.next_mode.value
             vod_link = modal.vod_link.value
 
-            if modal.submitType is AsyncHandler.SubmitType.FORFEIT:
+            is_dnf = modal.submitType is AsyncHandler.SubmitType.FORFEIT
+            if is_dnf:
                 igt = DnfTime
                 rta = DnfTime
 
@@ -893,53 +999,50 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             if rta is not None and len(rta.split(':')) == 2:
                 rta = "0:" + rta
 
-            submission = self.getSubmission(race_id, user_id)
+            submission = await self.db.get_submission(race_id, user_id)
             if submission is None:
                 # Create a brand new submission
                 submission = AsyncSubmission(race_id= race_id, user_id= user_id, username= user.name,
-                                             finish_time_igt= igt, collection_rate= cr_int, finish_time_rta=rta,
-                                             comment=comment, next_mode=next_mode, vod_link=vod_link)
+                                             collection_rate= cr_int, comment=comment, next_mode=next_mode, vod_link=vod_link)
             else:
                 # Update the fields of the existing submission
-                submission.finish_time_igt= igt
                 submission.collection_rate= cr_int
-                submission.finish_time_rta=rta
                 submission.comment=comment
                 submission.next_mode=next_mode
                 submission.vod_link = vod_link
 
+            submission.set_finish_times(igt, rta, is_dnf)
             submission.submit_date = datetime.now().isoformat(timespec='minutes').replace('T', ' ')
-            submission.save()
+            await self.db.save_submission(submission, race)
+            self.leaderboard_cache.invalidate(race_id)
             await interaction.send("Submission complete", ephemeral=True)
 
             # Check if this submission completes the race
-            if not self.is_public_race(race_id):
-                is_race_complete = self.is_race_complete(race)
+            if not await self.db.is_public_race(race_id):
+                is_race_complete = self.is_race_complete(await self.db.get_race_snapshot(race_id))
                 # If all racers have now submitted, post the race results
                 if is_race_complete:
                     logging.info(f"race complete, posting results")
                     await self.post_results(race)
 
             # Finally update the leaderboard if this is for the current weekly async
-            if race_id == self.queryLatestWeeklyRaceId():
-                await self.updateLeaderboardMessage(race_id, interaction.guild)
+            if race_id == await self.queryLatestWeeklyRaceId(race.guild_id):
+                self.signalLeaderboardUpdate(race_id, interaction.guild)
         else:
             await interaction.send("You are not assigned to this async race, submission cancelled")
 
     ####################################################################################################################
     # Checks if a race is complete. For assigned races, it is complete when all racers have submitted. For public races,
     # a race is complete when it is no longer active
-    def is_race_complete(self, race):
-        if race is not None:
+    def is_race_complete(self, snapshot):
+        if snapshot is not None:
             is_race_complete = True
-            if self.is_public_race(race.id):
-                is_race_complete = not race.active
+            if snapshot.is_public:
+                is_race_complete = not snapshot.race.active
             else:
-                # Query for the race roster
-                roster = self.get_roster(race.id)
                 # For each assigned racer see if there's a submission
-                for r in roster:
-                    if self.getSubmission(race.id, r.user_id) is None:
+                for entry in snapshot.roster:
+                    if entry.submission is None:
                         # if anyone has not submitted, the race is not complete
                         is_race_complete = False
                         break
@@ -947,105 +1050,54 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             is_race_complete = False
         return is_race_complete
 
-    ####################################################################################################################
-    # Returns a list of racers assigned to the provided race_id, or None if no racers are assigned
-    def get_roster(self, race_id):
-        roster = RaceRoster.select()                             \
-                           .where(RaceRoster.race_id == race_id)
-        if roster is None or len(roster) == 0:
-            roster = None
-        return roster
-
-    ####################################################################################################################
-    # Returns the race roster assignment row for this race ID/User ID combo, or None if it doesn't exist
-    def get_assignment(self, race_id, user_id):
-        try:
-            assignment = RaceRoster.select()                                                                              \
-                                   .where((RaceRoster.race_id == race_id) & (RaceRoster.user_id == user_id)) \
-                                   .get()
-        except:
-            assignment = None
-        return assignment
-
-    ####################################################################################################################
-    # Returns True if the provided race_id is a public race (has no assigned racers), False otherwise
-    def is_public_race(self, race_id):
-        roster = self.get_roster(race_id)
-        return (roster is None)
-
-    ####################################################################################################################
-    # Retrieves a user by ID from the database
-    def get_user(self, user_id):
-        try:
-            user = AsyncRacer.select().where(AsyncRacer.user_id == user_id).get()
-        except:
-            user = None
-        return user
-
     ####################################################################################################################
     # Posts the results of the provided race
     async def post_results(self, race):
         # Add a FF for any missing racer info
-        roster = self.get_roster(race.id)
-        users = []
-        for r in roster:
-            user = self.get_user(r.user_id)
-            users.append(user)
-            s = self.getSubmission(race.id, r.user_id)
-            if s is None:
-                submission = AsyncSubmission(race_id= race.id, user_id= r.user_id, username= user.username, finish_time_igt= DnfTime, collection_rate= 216, finish_time_rta=DnfTime, comment=None, next_mode=None)
-                submission.save()
+        await self.db.finalize_race(race.id, deactivate=False)
+        self.leaderboard_cache.invalidate(race.id)
+        await self.post_race_leaderboard(race)
+
+    ####################################################################################################################
+    # Posts the leaderboard of a finalized race to the async channel and pings the racers
+    async def post_race_leaderboard(self, race):
+        snapshot = await self.db.get_race_snapshot(race.id)
+        server_info = self.get_server_info(race.guild_id)
         # Post leaderboard to async channel
-        async_channel = self.bot.get_channel(self.server_info.tourney_async_channel)
-        message_list = self.buildLeaderboardMessageList(race.id)
+        async_channel = self.bot.get_channel(server_info.tourney_async_channel)
+        message_list = await self.buildLeaderboardMessageList(race.id)
         for message in message_list:
             await async_channel.send(message)
         # Ping assigned racers
         ping_msg = ""
-        guild = self.bot.get_guild(self.server_info.server_id)
+        guild = self.bot.get_guild(server_info.server_id)
         if config.PingRaceCreatorOnRaceEnd:
-            role = guild.get_role(self.server_info.race_creator_role)
+            role = guild.get_role(server_info.race_creator_role)
             ping_msg += f"{role.mention} "
-        for u in users:
-            member = guild.get_member(u.user_id)
-            ping_msg += f"{member.mention} "
+        for entry in snapshot.roster:
+            ping_msg += f"<@{entry.user_id}> "
         await async_channel.send(ping_msg)
 
-    ####################################################################################################################
-    # Returns True if all assigned racers for the given race_id have submmissions, or if the race is public
-    def is_race_complete(self, race_id):
-        race_complete = True
-        if not self.is_public_race(race_id):
-            roster = self.get_roster(race_id)
-            for r in roster:
-                try:
-                    s = AsyncSubmission.select().where(AsyncSubmission.race_id == race_id & AsyncSubmission.user_id == r.user_id).get()
-                except:
-                    s = None
-                if s is None:
-                    race_complete = False
-                    break
-        return race_complete
-
     ####################################################################################################################
     # Pings assigned racers and gives instructions on how to get seed and submit time for an async race
-    async def notify_assigned_racers(self, race_id):
-        guild = self.bot.get_guild(self.server_info.server_id)
-        async_channel = guild.get_channel(self.server_info.tourney_async_channel)
-        roster = self.get_roster(race_id)
+    async def notify_assigned_racers(self, race):
+        race_id = race.id
+        server_info = self.get_server_info(race.guild_id)
+        guild = self.bot.get_guild(server_info.server_id)
+        async_channel = guild.get_channel(server_info.tourney_async_channel)
+        roster = await self.db.get_roster(race_id)
         msg = ""
         for r in roster:
-            member = guild.get_member(r.user_id)
-            msg += f"{member.mention} "
+            msg += f"<@{r.user_id}> "
         msg += f"You have been assigned to Async Race {race_id}. Use the command `/async_race info {race_id}` to get the seed and submit your time when complete"
         await async_channel.send(msg)
 
     ####################################################################################################################
     # Determines if a user has permission to view/submit to the given race ID
-    def has_permission(self, race_id, user_id):
-        has_permission = self.is_public_race(race_id)
+    async def has_permission(self, race_id, user_id):
+        has_permission = await self.db.is_public_race(race_id)
         if not has_permission:
-            a = self.get_assignment(race_id, user_id)
+            a = await self.db.get_assignment(race_id, user_id)
             if a is not None:
                 has_permission = True
         return has_permission
@@ -1084,36 +1136,34 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
         self.log_command(interaction.user, "RESULTS")
         if user is None:
             user = interaction.user
-        self.checkAddMember(user)
+        await self.checkAddMember(user)
         await self.race_results_impl(interaction, AsyncHandler.RaceResultsData(1, user.id))
 
     ####################################################################################################################
     # Displays race submissions for the given user_id
     async def race_results_impl(self, interaction, data):
-        query_results = AsyncSubmission.select()                                       \
-                                       .where(AsyncSubmission.user_id == data.user_id) \
-                                       .order_by(AsyncSubmission.id.desc()) \
-                                       .paginate(data.page, ItemsPerPage)
+        response = ResponsePipeline(interaction, DiscordApiCharLimit)
+        await response.defer()
+        query_results = await self.db.get_user_submission_page(data.user_id, interaction.guild_id, data.page, ItemsPerPage)
 
-        latest_weekly_id = self.queryLatestWeeklyRaceId()
+        latest_weekly_id = await self.queryLatestWeeklyRaceId(interaction.guild_id)
         if len(query_results) > 0:
-            self.resetPrettyTable()
-            self.pt.hrules = True
-            self.pt.field_names = ["Race ID", "Submission ID", "Date", "Place", "IGT", "Collection Rate", "RTA", "Mode", "Comment"]
-            self.pt._max_width = {"Mode": 50}
-            race_id_list = []
+            rows = []
+            race_id_list = [result.race_id for result in query_results]
+            # Look up the races and the user's place in each of them with one query each, rather than once per row
+            races = await self.db.get_races(race_id_list)
+            places = await self.db.get_places([(race_id, data.user_id) for race_id in race_id_list])
             for result in query_results:
                 # First find info about the race this submission is for
                 race_id = result.race_id
-                race_id_list.append(race_id)
-                race = self.get_race(race_id)
+                race = races.get(race_id)
                 date        = result.submit_date
                 mode        = race.description if race is not None else ""
                 igt         = result.finish_time_igt
                 cr          = result.collection_rate
                 rta         = result.finish_time_rta
                 submit_id   = result.id
-                place       = self.get_place(race, data.user_id)
+                place       = self.get_place_str(places.get((race_id, data.user_id), 0))
                 comment     = result.comment if result.comment is not None else ""
 
                 if rta is None: rta = ""
@@ -1124,16 +1174,118 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
                     rta = "**:**:**"
                     cr = "***"
                     place = "****"
-                self.pt.add_row([race_id, submit_id, date, place, igt, cr, rta, mode, comment])
-
-            total_submissions = AsyncSubmission.select(fn.COUNT(AsyncSubmission.id)).where(AsyncSubmission.user_id == data.user_id).get()
-            await interaction.send(f"Recent Async Submissions, page {data.page}:", ephemeral=True)
-            table_message_list = self.buildResponseMessageList(self.pt.get_string())
-            for table_message in table_message_list:
-                await interaction.send(f"`{table_message}`", ephemeral=True)
-            await interaction.send(view=AsyncHandler.ShowRacesView(self, race_id_list, self.race_results_impl, data), ephemeral=True)
+                rows.append([race_id, submit_id, date, place, igt, cr, rta, mode, comment])
+
+            response.add(f"Recent Async Submissions, page {data.page}:")
+            table_message_list = render_table(["Race ID", "Submission ID", "Date", "Place", "IGT", "Collection Rate", "RTA", "Mode", "Comment"],
+                                              rows,
+                                              DiscordApiCharLimit,
+                                              max_width={"Mode": 50},
+                                              hrules=True)
+            response.add(*table_message_list)
+            await response.send(view=AsyncHandler.ShowRacesView(self, race_id_list, self.race_results_impl, data))
+        else:
+            response.add("There are no submissions in that range")
+            await response.send()
+
+########################################################################################################################
+# STATS
+########################################################################################################################
+    @async_race.subcommand(name="stats", description="Show Career Stats for a User")
+    async def racer_stats(self,
+                          interaction,
+                          user: nextcord.User = nextcord.SlashOption(description="User to view stats for", required=False)):
+        self.log_command(interaction.user, "RACER_STATS")
+        if user is None:
+            user = interaction.user
+        response = ResponsePipeline(interaction, DiscordApiCharLimit)
+        await response.defer()
+        # Served from the precomputed racer_stats rows, one per category
+        category_stats = await self.db.get_racer_stats(user.id, interaction.guild_id)
+        if len(category_stats) == 0:
+            response.add(f"{user.name} has no race results yet")
+            await response.send()
+            return
+
+        def place(value):
+            return "" if value is None else f"{value:.1f}"
+
+        rows = [["Races"]       + [s.races for c, s in category_stats],
+                ["Finishes"]    + [s.finishes for c, s in category_stats],
+                ["Forfeits"]    + [s.dnfs for c, s in category_stats],
+                ["Best IGT"]    + [seconds_to_game_time(s.best_igt) for c, s in category_stats],
+                ["Median IGT"]  + [seconds_to_game_time(s.median_igt) for c, s in category_stats],
+                ["Mean IGT"]    + [seconds_to_game_time(s.mean_igt) for c, s in category_stats],
+                ["Best RTA"]    + [seconds_to_game_time(s.best_rta) for c, s in category_stats],
+                ["Median RTA"]  + [seconds_to_game_time(s.median_rta) for c, s in category_stats],
+                ["Mean RTA"]    + [seconds_to_game_time(s.mean_rta) for c, s in category_stats],
+                ["Avg Place"]   + [place(s.average_place) for c, s in category_stats],
+                ["Podiums"]     + [s.podiums for c, s in category_stats]]
+        weekly_category_id = self.get_server_info(interaction.guild_id).weekly_category_id
+        if any(s.category_id == weekly_category_id for c, s in category_stats):
+            rows.append(["Weekly Streak"] + [s.weekly_streak if s.category_id == weekly_category_id else "" for c, s in category_stats])
+        response.add(f"Career stats for {user.name}, the current weekly race is left out until it's over:")
+        response.add(*render_table([""] + [c.name for c, s in category_stats],
+                                   rows,
+                                   DiscordApiCharLimit,
+                                   max_width={c.name: 20 for c, s in category_stats},
+                                   align={"": "l"}))
+        await response.send()
+
+########################################################################################################################
+# STANDINGS
+########################################################################################################################
+    class StandingsData():
+        def __init__(self, page, season):
+            self.page = page
+            self.season = season
+
+    @async_race.subcommand(description="Show Season Standings")
+    async def standings(self,
+                        interaction,
+                        season_id: int = nextcord.SlashOption(description="Season to view, the current season if not provided", required=False, min_value=1)):
+        self.log_command(interaction.user, "STANDINGS")
+        seasons = await self.db.get_seasons(interaction.guild_id)
+        if len(seasons) == 0:
+            await interaction.send("No seasons have been added yet", ephemeral=True)
+            return
+
+        if season_id is None:
+            # The most recently started season, or the next one to start if none have started yet
+            today = date.today()
+            season = next((s for s in seasons if s.start_date <= today), seasons[-1])
         else:
-            await interaction.send("There are no submissions in that range", ephemeral=True)
+            season = next((s for s in seasons if s.id == season_id), None)
+            if season is None:
+                season_list = '\n'.join(f"{s.id}: {s.name} ({s.start_date} to {s.end_date})" for s in seasons)
+                await interaction.send(f"No season found with ID {season_id}, the seasons are:\n{season_list}", ephemeral=True)
+                return
+        await self.standings_impl(interaction, AsyncHandler.StandingsData(1, season))
+
+    ####################################################################################################################
+    # Displays a page of a season's standings, served from the season_standings table
+    async def standings_impl(self, interaction, data):
+        response = ResponsePipeline(interaction, DiscordApiCharLimit)
+        await response.defer()
+        season = data.season
+        standings = await self.db.get_season_standings(season.id, data.page, StandingsPerPage)
+        if len(standings) == 0:
+            response.add("There are no standings in that range")
+            await response.send()
+            return
+
+        page_count = (await self.db.get_season_standing_count(season.id) + StandingsPerPage - 1) // StandingsPerPage
+        rows = []
+        for rank, user_id, username, points, races, wins in standings:
+            rows.append([rank, username if username is not None else user_id, f"{points:g}", races, wins])
+        scoring = "time relative to par" if season.scoring == 'par' else "placement"
+        response.add(f"{season.name} standings ({season.start_date} to {season.end_date}, scored by {scoring}), page {data.page} of {page_count}:")
+        response.add(*render_table(["Rank", "Racer", "Points", "Races", "Wins"],
+                                   rows,
+                                   DiscordApiCharLimit,
+                                   max_width={"Racer": 32},
+                                   align={"Racer": "l"}))
+        await response.send(view=AsyncHandler.NextPrevButtonView(self.standings_impl, data))
 
 ########################################################################################################################
 # LEADERBOARD
@@ -1143,10 +1295,10 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
                           interaction,
                           race_id: int = nextcord.SlashOption(description="Race ID to view leaderboard of", required=False, min_value=1)):
         self.log_command(interaction.user, "LEADERBOARD")
-        self.checkAddMember(interaction.user)
+        await self.checkAddMember(interaction.user)
         # If no race ID was provided, prompt the user to select one
         if race_id is None:
-            race_select_view = AsyncHandler.RaceSelectView(self.leaderboard_impl)
+            race_select_view = AsyncHandler.RaceSelectView(self.leaderboard_impl, await self.db.get_active_races(interaction.guild_id))
             await interaction.send(view=race_select_view, ephemeral=True)
         else:
             await self.leaderboard_impl(interaction, race_id)
@@ -1154,28 +1306,24 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     ####################################################################################################################
     # Does the actual work for the leaderboard command, moved to a separate function to be reusable with buttons
     async def leaderboard_impl(self, interaction, race_id):
+        response = ResponsePipeline(interaction, DiscordApiCharLimit)
+        await response.defer()
         # check if the user has permission to view the leaderboard. They have permission if they submitted to it or have appropriate role
-        can_view = self.isRaceCreator(interaction.guild, interaction.user) or self.getSubmission(race_id, interaction.user.id) is not None
+        can_view = self.isRaceCreator(interaction.guild, interaction.user) or await self.db.get_submission(race_id, interaction.user.id) is not None
         # Make sure this race exists
-        try:
-            race = AsyncRace.select()                       \
-                            .where(AsyncRace.id == race_id) \
-                            .get()
-        except:
-            race = None
+        race = await self.db.get_race(race_id, interaction.guild_id)
 
-        total_submissions = AsyncSubmission.select(fn.COUNT(AsyncSubmission.id)).where(AsyncSubmission.race_id == race_id).get()
+        total_submissions = 0 if race is None else await self.db.get_race_submission_count(race_id)
         total_submissions = "No" if total_submissions == 0 else total_submissions
-        await interaction.send(f"There have been {total_submissions} submissions to this race so far.", ephemeral=True)
+        response.add(f"There have been {total_submissions} submissions to this race so far.")
 
         if race is not None and can_view:
-            message_list = self.buildLeaderboardMessageList(race_id)
-            for message in message_list:
-                await interaction.send(message, ephemeral=True)
+            response.add(*await self.buildLeaderboardMessageList(race_id))
         elif can_view:
-            await interaction.send(f"Invalid Race ID: {race_id}", ephemeral=True)
+            response.add(f"Invalid Race ID: {race_id}")
         else:
-            await interaction.send(f"You must submit a time or FF from the race before the leaderboard can be displayed", ephemeral=True)
+            response.add(f"You must submit a time or FF from the race before the leaderboard can be displayed")
+        await response.send()
 
 ########################################################################################################################
 # RACES
@@ -1188,12 +1336,15 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     @async_race.subcommand(description="List Current Races")
     async def list(self, interaction):
         self.log_command(interaction.user, "RACES")
-        categoryCount = RaceCategory.select().count()
-        logging.info(f"Category Count: {categoryCount}")
-        if int(categoryCount) == 1:
-            await self.list_races_impl(interaction, AsyncHandler.RacesData(page=1, category=1))
+        categories = await self.db.get_categories(interaction.guild_id)
+        logging.info(f"Category Count: {len(categories)}")
+        if len(categories) == 0:
+            await interaction.send("No race categories have been added yet", ephemeral=True)
+        elif len(categories) == 1:
+            await self.list_races_impl(interaction, AsyncHandler.RacesData(page=1, category=categories[0].id))
         else:
-            await interaction.send(view=AsyncHandler.CategorySelectView(self.list_races_first_impl, 1), ephemeral=True)
+            category_select_view = AsyncHandler.CategorySelectView(self.list_races_first_impl, 1, categories)
+            await interaction.send(view=category_select_view, ephemeral=True)
 
     ########################################################################################################################
     async def list_races_first_impl(self, interaction, category_id, page):
@@ -1202,47 +1353,35 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     ########################################################################################################################
     # Implementation of the races command, moved to separate function to be able to reuse
     async def list_races_impl(self, interaction, data):
-        self.checkAddMember(interaction.user)
+        response = ResponsePipeline(interaction, DiscordApiCharLimit)
+        await response.defer()
+        await self.checkAddMember(interaction.user)
         is_race_creator = self.isRaceCreator(interaction.guild, interaction.user)
 
-        races = None
-        if is_race_creator:
-            races = AsyncRace.select()                                      \
-                             .where(AsyncRace.category_id == data.category) \
-                             .order_by(AsyncRace.id.desc())                 \
-                             .paginate(data.page, ItemsPerPage)
-        else:
-            races = AsyncRace.select()                                                                     \
-                             .where((AsyncRace.category_id == data.category) & (AsyncRace.active == True)) \
-                             .order_by(AsyncRace.id.desc())                                                \
-                             .paginate(data.page, ItemsPerPage)
-        
+        # Race creators can see inactive races as well
+        races = await self.db.get_race_page(data.category, data.page, ItemsPerPage, is_race_creator)
+
         if races is not None and len(races) > 0:
-            self.resetPrettyTable()
-            
             if is_race_creator:
-                self.pt.field_names = ["ID", "Start Date", "Mode", "Active"]
+                field_names = ["ID", "Start Date", "Mode", "Active"]
             else:
-                self.pt.field_names = ["ID", "Start Date", "Mode"]
-
-            self.pt._max_width = {"Mode": 50}
-            self.pt.align["Mode"] = "l"
+                field_names = ["ID", "Start Date", "Mode"]
 
             race_id_list = []
+            rows = []
             for race in races:
                 race_id_list.append(race.id)
                 if is_race_creator:
-                    self.pt.add_row([race.id, race.start, race.description, race.active])
+                    rows.append([race.id, race.start, race.description, race.active])
                 else:
-                    self.pt.add_row([race.id, race.start, race.description])
-            message = self.pt.get_string()
-            await interaction.send(f"`{message}`", view=AsyncHandler.ShowRacesView(self,
-                                                                                   race_id_list,
-                                                                                   self.list_races_impl,
-                                                                                   data,
-                                                                                   False), ephemeral=True)
+                    rows.append([race.id, race.start, race.description])
+            table_message_list = render_table(field_names, rows, DiscordApiCharLimit, max_width={"Mode": 50}, align={"Mode": "l"})
+            response.add(*table_message_list)
+            # The page buttons go on the last message of the table
+            await response.send(view=AsyncHandler.ShowRacesView(self, race_id_list, self.list_races_impl, data, False))
         else:
-            await interaction.send("No races found in that range", ephemeral=True)
+            response.add("No races found in that range")
+            await response.send()
 
 ########################################################################################################################
 # RACE_INFO
@@ -1251,11 +1390,11 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     async def info(self,
                    interaction,
                    race_id: int = nextcord.SlashOption(description="Race ID to view race info for", required=False, min_value=1)):
-        self.checkAddMember(interaction.user)
+        await self.checkAddMember(interaction.user)
         self.log_command(interaction.user, "RACE_INFO")
         # If no race ID was provided, prompt the user to select one
         if race_id is None:
-            race_select_view = AsyncHandler.RaceSelectView(self.show_race_info_impl)
+            race_select_view = AsyncHandler.RaceSelectView(self.show_race_info_impl, await self.db.get_active_races(interaction.guild_id))
             await interaction.send(view=race_select_view, ephemeral=True)
         else:
             await self.show_race_info_impl(interaction, race_id)
@@ -1263,12 +1402,8 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     ########################################################################################################################
     # Does the work of showing a race
     async def show_race_info_impl(self, interaction, race_id):
-        try:
-            race = AsyncRace.select()                       \
-                            .where(AsyncRace.id == race_id) \
-                            .get()
-        except:
-            race = None
+        snapshot = await self.db.get_race_snapshot(race_id)
+        race = None if snapshot is None or snapshot.race.guild_id != interaction.guild_id else snapshot.race
 
         is_race_creator = self.isRaceCreator(interaction.guild, interaction.user)
         if race is None:
@@ -1280,19 +1415,20 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             # A) It's a public race
             # B) They're assigned to the race
             # C) They're a race creator running the command in the race creation channel
-            if self.has_permission(race_id, interaction.user.id) or self.checkRaceCreatorCommand(interaction):
-                message = self.getRaceInfoTable(race, is_race_creator)
+            entry = snapshot.get_entry(interaction.user.id)
+            if snapshot.is_public or entry is not None or self.checkRaceCreatorCommand(interaction):
+                message = self.getRaceInfoTable(snapshot, is_race_creator)
                 await interaction.send(message, embed=self.getSeedEmbed(race), ephemeral=True)
-                race_info_view = AsyncHandler.RaceInfoButtonView(self, race_id)
+                race_info_view = AsyncHandler.RaceInfoButtonView(self, race, snapshot.is_public)
                 await interaction.send(f"Click below to submit/edit or view leaderboard for race {race_id}", view=race_info_view, ephemeral=True)
-                if not self.is_public_race(race_id):
+                if entry is not None:
                     # Log the time the user got the race info for assigned races
-                    assignment = self.get_assignment(race_id, interaction.user.id)
+                    assignment = entry.assignment
                     if assignment is not None:
                         # We only care about the first time the user got the race info
                         if assignment.race_info_time is None:
                             assignment.race_info_time = datetime.now().isoformat(timespec='minutes').replace('T', ' ')
-                            assignment.save()
+                            await self.db.save(assignment)
             else:
                 await interaction.send("You do not have permission to view this race info in this channel", ephemeral=True)
 
@@ -1304,54 +1440,60 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
                      interaction,
                      race_id: int = nextcord.SlashOption(description="Race to Verify")):
         self.log_command(interaction.user, "VERIFY_RACE")
-        if self.is_public_race(race_id):
-            await interaction.send("Cannot verify a public (non-assigned) race", ephemeral=True)
+        response = ResponsePipeline(interaction, DiscordApiCharLimit)
+        await response.defer()
+        snapshot = await self.db.get_race_snapshot(race_id)
+        if snapshot is not None and snapshot.race.guild_id != interaction.guild_id:
+            snapshot = None
+        if snapshot is not None and snapshot.is_public:
+            response.add("Cannot verify a public (non-assigned) race")
+            await response.send()
             return
 
-        race = self.get_race(race_id)
-        if race is not None:
+        if snapshot is not None:
             # Only allow race creators to use verify prior to race completion
-            if not self.is_race_complete(race):
+            if not self.is_race_complete(snapshot):
                 if not self.isRaceCreator(interaction.guild, interaction.user):
-                    await interaction.send(f"Non-race creators can only verify races once they are complete")
+                    response.add(f"Non-race creators can only verify races once they are complete")
+                    await response.send()
                     return
 
-            roster = self.get_roster(race_id)
-            if roster is not None:
+            if not snapshot.is_public:
                 # For each assigned racer print: username, start date/time (race_info_time), submit date/time, IGT or RTA, VoD link
-                info_str = f"`|           Race Verification Info for race {race_id}            | `\n"
+                response.add(f"`|           Race Verification Info for race {race_id}            | `")
 
-                for r in roster:
-                    user = self.get_user(r.user_id)
-                    s = self.getSubmission(race_id, r.user_id)
+                for entry in snapshot.roster:
+                    s = entry.submission
                     start_time = "Not Started"
                     submit_time = "Not Completed"
                     game_time_str = "RTA" if config.RtaIsPrimary else "IGT"
                     vod_link = ""
                     game_time_cr = ""
                     if s is not None:
-                        start_time = r.race_info_time
+                        start_time = entry.assignment.race_info_time
                         submit_time = s.submit_date
                         vod_link = s.vod_link
                         if config.RtaIsPrimary:
                             game_time = s.finish_time_rta
                         else:
                             game_time = s.finish_time_igt
-                        if game_time == DnfTime:
+                        if s.is_dnf:
                             game_time_cr = "DNF"
                         else:
                             game_time_cr += f"{game_time} / {s.collection_rate}"
-                    info_str += "`+==========================================================+`\n"
-                    info_str += f"`| Racer Name:           |` **{user.username}**\n"
+                    # Each racer is added as one part so a racer's info is never split across messages
+                    info_str = "`+==========================================================+`\n"
+                    info_str += f"`| Racer Name:           |` **{entry.username}**\n"
                     info_str += f"`| Start Date/Time:      |` {start_time}\n"
                     info_str += f"`| Submission Date/Time: |` {submit_time}\n"
                     info_str += f"`| VoD Link:             |` {vod_link}\n"
-                    info_str += f"`| {game_time_str} / CR:             |` {game_time_cr}\n"
-                await interaction.send(info_str, ephemeral=True)
+                    info_str += f"`| {game_time_str} / CR:             |` {game_time_cr}"
+                    response.add(info_str)
             else:
-                await interaction.send("No racers assigned to this race", ephemeral=True)
+                response.add("No racers assigned to this race")
         else:
-            await interaction.send(f"Race ID {race_id} does not exist", ephemeral=True)
+            response.add(f"Race ID {race_id} does not exist")
+        await response.send()
 
 ########################################################################################################################
 ########################################################################################################################
@@ -1377,7 +1519,7 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             return
 
         if user is not None:
-            self.checkAddMember(user)
+            await self.checkAddMember(user)
         else:
             await interaction.send("Invalid user", ephemeral=True)
             return
@@ -1385,14 +1527,16 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
         if race_id is not None:
             await self.assign_racer_impl(interaction, race_id, user)
         else:
-            race_select_view = AsyncHandler.RaceSelectView(self.assign_racer_impl, user)
+            race_select_view = AsyncHandler.RaceSelectView(self.assign_racer_impl, await self.db.get_active_races(interaction.guild_id), user)
             await interaction.send(view=race_select_view, ephemeral=True)
 
     async def assign_racer_impl(self, interaction, race_id, user):
-        race = self.get_race(race_id)
+        race = await self.db.get_race(race_id, interaction.guild_id)
         if race is not None:
-            r = RaceRoster(race_id= race_id, user_id = user.id)
-            r.save()
+            await self.db.assign_racer(race_id, user.id)
+            if isinstance(user, nextcord.Member):
+                cache_members(interaction.guild, [user])
+            self.leaderboard_cache.invalidate(race_id)
             await interaction.send(f"Assigned {user.name} to race {race_id}", ephemeral=True)
         else:
             await interaction.send(f"No race found for race ID {race_id}", ephemeral=True)
@@ -1413,24 +1557,24 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
         if race_id is not None:
             await self.start_race_impl(interaction, race_id, notify_racers)
         else:
-            race_select_view = AsyncHandler.RaceSelectView(self.start_race_impl, notify_racers)
+            race_select_view = AsyncHandler.RaceSelectView(self.start_race_impl, await self.db.get_active_races(interaction.guild_id), notify_racers)
             await interaction.send(view=race_select_view, ephemeral=True)
 
     ########################################################################################################################
     # Starts a race
     async def start_race_impl(self, interaction, race_id, notify_racers=False):
-        race = self.get_race(race_id)
+        race = await self.db.get_race(race_id, interaction.guild_id)
         if race is not None:
             if config.RosterPromptOnRaceStart:
                 # Search for race roster entries for this race
                 msg = ""
-                roster = self.get_roster(race_id)
+                roster = await self.db.get_roster(race_id)
                 if roster is None:
                     msg = f"Race ID {race_id} is currently set as a public race (no racers listed)"
                 else:
                     msg = f"Race ID {race_id} currently has the following racers assigned:"
                     for r in roster:
-                        racer = AsyncRacer.select().where(AsyncRacer.user_id == r.user_id).get()
+                        racer = await self.db.get_user(r.user_id)
                         msg += f"\n{racer.username}"
                 await interaction.send(msg, ephemeral=True)
                 # Show confirmation
@@ -1445,18 +1589,23 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
         if user_confirmed:
             race = data[0]
             notify_racers = data[1]
+            previous_weekly_id = await self.queryLatestWeeklyRaceId(race.guild_id)
             start_date = date.today().isoformat()
             race.start = start_date
             race.active = True
-            race.save()
+            await self.db.save(race)
+            self.leaderboard_cache.invalidate(race.id)
             await interaction.send(f"Started race {race.id}")
-            if race.category_id == self.server_info.weekly_category_id:
-                await self.add_submit_buttons(race)
+            if self.isWeeklyRace(race):
+                # The previous weekly's times were left out of its racers' stats while it was the current race
+                if previous_weekly_id not in (0, race.id):
+                    await self.db.refresh_race_stats(previous_weekly_id)
+                await self.add_submit_buttons(self.get_server_info(race.guild_id), race)
                 await self.updateLeaderboardMessage(race.id, interaction.guild)
                 await self.removeWeeklyAsyncRole(interaction)
                 await self.post_announcement(race, interaction)
-            if not self.is_public_race(race.id) and notify_racers:
-                await self.notify_assigned_racers(race.id)
+            if notify_racers and not await self.db.is_public_race(race.id):
+                await self.notify_assigned_racers(race)
         else:
             await interaction.send("start_race cancelled", ephemeral=True)
 
@@ -1476,16 +1625,19 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
         if race_id is not None:
             await self.end_race_impl(interaction, race_id, post_result)
         else:
-            race_select_view = AsyncHandler.RaceSelectView(self.end_race_impl, post_result)
+            race_select_view = AsyncHandler.RaceSelectView(self.end_race_impl, await self.db.get_active_races(interaction.guild_id), post_result)
             await interaction.send(view=race_select_view, ephemeral=True)
 
     async def end_race_impl(self, interaction, race_id, post_result):
-        race = self.get_race(race_id)
+        race = await self.db.get_race(race_id, interaction.guild_id)
         if race is not None:
+            post_result = post_result and not await self.db.is_public_race(race_id)
+            # Deactivating the race and adding the forfeits happen in one transaction, so a race is never left half ended
+            await self.db.finalize_race(race_id, deactivate=True, add_forfeits=post_result)
             race.active = False
-            race.save()
-            if post_result and not self.is_public_race(race_id):
-                await self.post_results(race)
+            self.leaderboard_cache.invalidate(race_id)
+            if post_result:
+                await self.post_race_leaderboard(race)
             await interaction.send(f"Ended race {race.id}")
         else:
             await interaction.send(f"No race found for race ID {race_id}", ephemeral=True)
@@ -1501,14 +1653,17 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
         self.log_command(interaction.user, "ADD_RACE")
 
         if self.checkRaceCreatorCommand(interaction):
-            add_race_modal = AsyncHandler.AddRaceModal()
+            add_race_modal = AsyncHandler.AddRaceModal(self)
             if start_race:
                 add_race_modal.start_race_callback = self.start_race_impl
-            if RaceCategory.select().count() == 1:
-                add_race_modal.category_id = 1
+            categories = await self.db.get_categories(interaction.guild_id)
+            if len(categories) == 0:
+                await interaction.send("No race categories have been added yet, use `/async_race mod add_category` first", ephemeral=True)
+            elif len(categories) == 1:
+                add_race_modal.category_id = categories[0].id
                 await interaction.response.send_modal(add_race_modal)
             else:
-                add_race_view = AsyncHandler.AddRaceView(add_race_modal)
+                add_race_view = AsyncHandler.AddRaceView(add_race_modal, categories)
                 await interaction.send(view=add_race_view, ephemeral=True)
         else:
             await interaction.send(NoPermissionMsg, ephemeral=True)
@@ -1523,12 +1678,11 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             await interaction.send(NoPermissionMsg, ephemeral=True)
             return
 
-        race = self.get_race(race_id)
+        race = await self.db.get_race(race_id, interaction.guild_id)
         if race is not None:
             # Only allow editing of inactive races with no submissions
-            race_submissions = self.get_leaderboard(race)
-            if race.active == False and len(race_submissions) == 0:
-                add_race_modal = AsyncHandler.AddRaceModal(race=race)
+            if race.active == False and not await self.db.race_has_submissions(race_id):
+                add_race_modal = AsyncHandler.AddRaceModal(self, race=race)
                 add_race_modal.mode.default_value = race.description
                 add_race_modal.seed.default_value = race.seed
                 add_race_modal.instructions.default_value = race.additional_instructions
@@ -1553,14 +1707,14 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
         if race_id is not None:
             await self.pause_race_impl(interaction, race_id)
         else:
-            race_select_view = AsyncHandler.RaceSelectView(self.pause_race_impl)
+            race_select_view = AsyncHandler.RaceSelectView(self.pause_race_impl, await self.db.get_active_races(interaction.guild_id))
             await interaction.send(view=race_select_view, ephemeral=True)
 
     async def pause_race_impl(self, interaction, race_id):
-        race = self.get_race(race_id)
+        race = await self.db.get_race(race_id, interaction.guild_id)
         if race is not None:
             race.active = False
-            race.save()
+            await self.db.save(race)
             await interaction.send(f"Deactivated race {race.id}")
         else:
             await interaction.send(f"No race found for race ID {race_id}", ephemeral=True)
@@ -1576,14 +1730,10 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             await interaction.send(NoPermissionMsg, ephemeral=True)
             return
 
-        race = self.get_race(race_id)
+        race = await self.db.get_race(race_id, interaction.guild_id)
         if race is not None:
             # Check first to see if there are any submissions to this race
-            try:
-                submissions = AsyncSubmission.select().where(AsyncSubmission.race_id == race.id).get()
-            except:
-                submissions = None
-            if submissions is not None:
+            if await self.db.race_has_submissions(race.id):
                 await interaction.send("This race has user submissions and cannot be removed via command, please contact the bot overlord to remove it.", ephemeral=True)
             else:
                 confirm_view = AsyncHandler.YesNoView(self.remove_race_impl, race)
@@ -1596,7 +1746,8 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     async def remove_race_impl(self, interaction, user_confirmed, race):
         if user_confirmed:
             await interaction.send(f"Removing race {race.id}")
-            race.delete_instance()
+            await self.db.remove_race(race)
+            self.leaderboard_cache.invalidate(race.id)
         else:
             await interaction.send("Remove cancelled")
 
@@ -1614,21 +1765,17 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             return
 
         # Send Select to choose which category
-        await interaction.send(view=AsyncHandler.CategorySelectView(self.pin_race_info_get_races, (channel, remove_existing)), ephemeral=True)
+        category_select_view = AsyncHandler.CategorySelectView(self.pin_race_info_get_races, (channel, remove_existing), await self.db.get_categories(interaction.guild_id))
+        await interaction.send(view=category_select_view, ephemeral=True)
 
     ########################################################################################################################
     async def pin_race_info_get_races(self, interaction, category_id, data):
         # Verify this category has active races to pin
-        try:
-            races = AsyncRace.select()                                                                   \
-                             .where((AsyncRace.category_id == category_id) & (AsyncRace.active == True)) \
-                             .get()
-        except:
-            races = None
+        races = await self.db.get_active_races(interaction.guild_id, category_id)
 
-        if races is not None:
+        if len(races) > 0:
             # Send Select to choose which races to pin
-            await interaction.send(view=AsyncHandler.MultiRaceSelectView(self.pin_race_info_impl, data, category_id), ephemeral=True)
+            await interaction.send(view=AsyncHandler.MultiRaceSelectView(self.pin_race_info_impl, data, races), ephemeral=True)
         else:
             await interaction.send("There are no active races for that category")
 
@@ -1642,9 +1789,9 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
         await interaction.send("Adding new race messages")
         for c in user_race_choices:
             race_id = int(c)
-            race = self.get_race(race_id)
-            await channel.send(self.getRaceInfoTable(race), embed=self.getSeedEmbed(race))
-            await channel.send(view=AsyncHandler.RaceInfoButtonView(self, race_id))
+            snapshot = await self.db.get_race_snapshot(race_id)
+            await channel.send(self.getRaceInfoTable(snapshot), embed=self.getSeedEmbed(snapshot.race))
+            await channel.send(view=AsyncHandler.RaceInfoButtonView(self, snapshot.race, snapshot.is_public))
             await channel.send("`------------------------------------------------------------------------`")
         await interaction.send("Done")
 
@@ -1664,7 +1811,7 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     @mod.subcommand(description="Mod Utilities")
     async def util(self,
                    interaction,
-                   function: int = nextcord.SlashOption(description="Utility Function to Run", choices = { "Force Update Leaderboard Channel": 1, "Post Race Results": 2, "Notify Racers": 3, "Add Submit Buttons": 4}),
+                   function: int = nextcord.SlashOption(description="Utility Function to Run", choices = { "Force Update Leaderboard Channel": 1, "Post Race Results": 2, "Notify Racers": 3, "Add Submit Buttons": 4, "Show Cache Stats": 5}),
                    race_id: int = nextcord.SlashOption(description="Race ID", required=False)):
 
         self.log_command(interaction.user, "MOD_UTIL")
@@ -1673,18 +1820,22 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             return
 
         if function == 1:
-            await self.updateLeaderboardMessage(self.queryLatestWeeklyRaceId(), interaction.guild)
+            await self.updateLeaderboardMessage(await self.queryLatestWeeklyRaceId(interaction.guild_id), interaction.guild)
             await interaction.send("Updated weekly leaderboard channel", ephemeral=True)
         elif function == 2:
-            race = self.get_race(race_id)
+            race = await self.db.get_race(race_id, interaction.guild_id)
             if race is not None:
                 await self.post_results(race)
                 await interaction.send("Done")
         elif function == 3:
-            await self.notify_assigned_racers(race_id)
-            await interaction.send("Done")
+            race = await self.db.get_race(race_id, interaction.guild_id)
+            if race is not None:
+                await self.notify_assigned_racers(race)
+                await interaction.send("Done")
         elif function == 4:
-            await self.add_submit_buttons()
+            await self.add_submit_buttons(self.get_server_info(interaction.guild_id))
+        elif function == 5:
+            await interaction.send(f"Leaderboard cache: {self.leaderboard_cache.stats_str()}", ephemeral=True)
         await interaction.send("Done", ephemeral=True)
 
 ########################################################################################################################
@@ -1700,48 +1851,143 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
         new_category = RaceCategory()
         new_category.name = name
         new_category.description = description
-        new_category.save()
+        new_category.guild_id = interaction.guild_id
+        await self.db.save(new_category)
         await interaction.send(f"Created race category {new_category.name} with ID {new_category.id}")
 
+########################################################################################################################
+# ADD_SEASON
+########################################################################################################################
+    @mod.subcommand(description="Add a season of races to keep standings for")
+    async def add_season(self,
+                         interaction,
+                         name: str = nextcord.SlashOption(description="Season name"),
+                         start_date: str = nextcord.SlashOption(description="First day of the season, YYYY-MM-DD"),
+                         end_date: str = nextcord.SlashOption(description="Last day of the season, YYYY-MM-DD"),
+                         scoring: str = nextcord.SlashOption(description="How each race is scored", choices={"Placement": "placement", "Time relative to par": "par"}, required=False, default="placement"),
+                         category_id: int = nextcord.SlashOption(description="Race category, the weekly category if not provided", required=False)):
+        self.log_command(interaction.user, "ADD_SEASON")
+        if not self.checkRaceCreatorCommand(interaction):
+            await interaction.send(NoPermissionMsg, ephemeral=True)
+            return
+
+        try:
+            start = date.fromisoformat(start_date)
+            end = date.fromisoformat(end_date)
+        except ValueError:
+            await interaction.send("Season dates must be in the YYYY-MM-DD format", ephemeral=True)
+            return
+        if end < start:
+            await interaction.send("The season can't end before it starts", ephemeral=True)
+            return
+
+        if category_id is None:
+            category_id = self.get_server_info(interaction.guild_id).weekly_category_id
+        if category_id not in [c.id for c in await self.db.get_categories(interaction.guild_id)]:
+            await interaction.send(f"No race category found with ID {category_id}", ephemeral=True)
+            return
+
+        await interaction.response.defer()
+        season = Season(guild_id=interaction.guild_id, category_id=category_id, name=name, start_date=start, end_date=end, scoring=scoring)
+        # Scores the races the season already covers
+        await self.db.add_season(season)
+        await interaction.send(f"Created season {season.name} with ID {season.id}, "
+                               f"{await self.db.get_season_standing_count(season.id)} racers have standings so far")
+
+########################################################################################################################
+# EXPORT
+########################################################################################################################
+    @mod.subcommand(description="Export submissions as a compressed CSV or JSON Lines file")
+    async def export(self,
+                     interaction,
+                     export_format: str = nextcord.SlashOption(name="format", description="File format", choices={"CSV": "csv", "JSON Lines": "jsonl"}, required=False, default="csv"),
+                     race_id: int = nextcord.SlashOption(description="Only export this race", required=False, min_value=1),
+                     category_id: int = nextcord.SlashOption(description="Only export races in this category", required=False),
+                     start_date: str = nextcord.SlashOption(description="Only export submissions made on or after this date, YYYY-MM-DD", required=False),
+                     end_date: str = nextcord.SlashOption(description="Only export submissions made on or before this date, YYYY-MM-DD", required=False)):
+        self.log_command(interaction.user, "EXPORT")
+        if not self.checkRaceCreatorCommand(interaction):
+            await interaction.send(NoPermissionMsg, ephemeral=True)
+            return
+        if export_format not in ExportFormats:
+            await interaction.send(f"Unknown export format {export_format}", ephemeral=True)
+            return
+        try:
+            start = None if start_date is None else date.fromisoformat(start_date)
+            end = None if end_date is None else date.fromisoformat(end_date)
+        except ValueError:
+            await interaction.send("Dates must be in the YYYY-MM-DD format", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        scope = "submissions"
+        if race_id is not None:
+            scope += f"_race{race_id}"
+        if category_id is not None:
+            scope += f"_category{category_id}"
+        if start is not None or end is not None:
+            scope += f"_{start or 'start'}_to_{end or 'now'}"
+        # Written to a temporary file on a reader thread a chunk at a time, then uploaded as an attachment
+        with tempfile.TemporaryFile() as export_file:
+            row_count = await self.db.export_submissions(export_file, export_format, race_id=race_id, category_id=category_id,
+                                                         guild_id=interaction.guild_id, start_date=start, end_date=end)
+            size = export_file.tell()
+            if size > interaction.guild.filesize_limit:
+                await interaction.send(f"The export is {size / 2**20:.1f} MiB, more than this server's upload limit. "
+                                       f"Narrow it down or use race_export.py on the database instead", ephemeral=True)
+                return
+            export_file.seek(0)
+            await interaction.send(f"Exported {row_count} submissions",
+                                   file=nextcord.File(export_file, filename=f"{scope}.{export_format}.gz"),
+                                   ephemeral=True)
+
 ########################################################################################################################
 # NEXT_MODE_SUGGESTIONS
 ########################################################################################################################
     @mod.subcommand(description="Show suggestions for next mode from users who completed the most recent weekly asyncs")
     async def next_mode_suggstions(self, interaction):
         self.log_command(interaction.user, "NEXT_MODE_SUGGESTIONS")
-        racers = AsyncRacer.select()
-        # Query the most recent weekly races
-        recent_races = AsyncRace.select()                                                                                           \
-                                .where((AsyncRace.category_id == self.server_info.weekly_category_id) & (AsyncRace.active == True)) \
-                                .order_by(AsyncRace.start.desc())
-
-        wheel_list = ["**Name** > **Mode Suggestion**\n"]
-        for r in racers:
-            # Query mode suggestions for this user, we will query each of the two most recent weekly async races. If the user has not completed
-            # either async then the query will return None
-            try:
-                submission1 = AsyncSubmission.select()                                                                                        \
-                                             .where((AsyncSubmission.race_id == recent_races[0].id) & (AsyncSubmission.user_id == r.user_id)) \
-                                             .get()
-            except:
-                submission1 = None
-            try:
-                submission2 = AsyncSubmission.select()                                                                                        \
-                                             .where((AsyncSubmission.race_id == recent_races[1].id) & (AsyncSubmission.user_id == r.user_id)) \
-                                             .get()
-            except:
-                submission2 = None
-            if submission1 is not None and submission1.next_mode is not None and submission1.next_mode != "":
-                next_mode_str = submission1.next_mode.strip().replace('\n', ' ')
-                if next_mode_str != "None":
-                    wheel_list.append(f"{r.username} > {next_mode_str}")
+        server_info = self.get_server_info(interaction.guild_id)
+        suggestions = await self.db.get_next_mode_suggestions(server_info.weekly_category_id, config.NextModeSuggestionRaces)
+        if len(suggestions) == 0:
+            await interaction.send("No mode suggestions found", ephemeral=True)
+            return
+
+        wheel_list = ["**Count** | **Mode Suggestion** > **Names**\n"]
+        for suggestion, usernames in suggestions:
+            wheel_list.append(f"{len(usernames)} | {suggestion} > {', '.join(usernames)}")
+        # A suggestion with a lot of names can be longer than one message by itself, packing splits it up
+        message_list = pack_messages(wheel_list, DiscordApiCharLimit)
+        if len(message_list) <= config.NextModeSuggestionMaxMessages:
+            for message in message_list:
+                await interaction.send(message, ephemeral=True)
+        else:
+            # Too long to page through, send the plain text as a file instead
+            text = '\n'.join(wheel_list).replace('**', '')
+            suggestions_file = nextcord.File(io.BytesIO(text.encode()), filename="next_mode_suggestions.txt")
+            await interaction.send(f"{len(suggestions)} mode suggestions", file=suggestions_file, ephemeral=True)
 
-            if submission2 is not None and submission2.next_mode is not None and submission2.next_mode != "":
-                next_mode_str = submission2.next_mode.strip().replace('\n', ' ')
-                if next_mode_str != "None":
-                    wheel_list.append(f"{r.username} > {next_mode_str}")
+########################################################################################################################
+# STATS
+########################################################################################################################
+    @mod.subcommand(description="Show command latency and query stats")
+    async def stats(self, interaction):
+        self.log_command(interaction.user, "STATS")
+        if not self.checkRaceCreatorCommand(interaction):
+            await interaction.send(NoPermissionMsg, ephemeral=True)
+            return
 
-        await interaction.send('\n'.join(wheel_list), ephemeral=True)
+        rows = metrics.summary_rows()
+        if len(rows) == 0:
+            await interaction.send("No commands have been timed yet", ephemeral=True)
+            return
+        # Times are in ms, DB, REST and queries are averages per run
+        response = ResponsePipeline(interaction, DiscordApiCharLimit)
+        response.add(*render_table(["Command", "Runs", "p50", "p95", "Max", "DB", "REST", "Queries", "Errors"],
+                                   rows,
+                                   DiscordApiCharLimit,
+                                   align={"Command": "l"}))
+        await response.send()
 
 ########################################################################################################################
 # PARROT
@@ -1767,9 +2013,9 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
     @mod.subcommand(description="Edit User Submission")
     async def edit_submission(self, interaction, submission_id: int = nextcord.SlashOption(description="Submission to Edit"),):
         self.log_command(interaction.user, "EDIT_SUBMISSION")
-        try:
-            submission_to_edit = AsyncSubmission.select().where(AsyncSubmission.id == submission_id).get()
-        except:
+        submission_to_edit = await self.db.get_submission_by_id(submission_id)
+        # Submissions to another server's races are treated as missing
+        if submission_to_edit is not None and await self.db.get_race(submission_to_edit.race_id, interaction.guild_id) is None:
             submission_to_edit = None
 
         if submission_to_edit is None:
@@ -1777,13 +2023,14 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
             return
 
         is_race_creator = self.isRaceCreator(interaction.guild, interaction.user)
-        is_public_race = self.is_public_race(submission_to_edit.race_id)
+        is_public_race = await self.db.is_public_race(submission_to_edit.race_id)
         # In order to edit a submission the user must be a race creator or editing their own submission for a public race
         if is_race_creator or (submission_to_edit.user_id == interaction.user.id and is_public_race):
-            race = self.get_race(submission_to_edit.race_id)
+            race = await self.db.get_race(submission_to_edit.race_id)
             submit_time_modal = AsyncHandler.SubmitTimeModal(self,
                                                              race.id,
-                                                             (race.category_id == self.server_info.weekly_category_id),
+                                                             self.isWeeklyRace(race),
+                                                             is_public_race,
                                                              AsyncHandler.SubmitType.EDIT)
             submit_time_modal.user_id = submission_to_edit.user_id
             submit_time_modal.igt.default_value = submission_to_edit.finish_time_igt
@@ -1809,24 +2056,145 @@ class AsyncHandler(commands.Cog, name='AsyncRaceHandler'):
 ########################################################################################################################
 # STARTUP and SHUTDOWN
 ########################################################################################################################
+    @commands.Cog.listener("on_application_command_error")
+    async def on_application_command_error_handler(self, interaction, error):
+        command = interaction.application_command
+        if command is not None and command.parent_cog is self:
+            metrics.record_error(command.qualified_name)
+
     @commands.Cog.listener("on_ready")
     async def on_ready_handler(self):
+        # on_ready fires again after every gateway reconnect, the startup work only needs doing once per process
+        if self.started:
+            logging.info("Async Handler reconnected")
+            return
+        self.started = True
         logging.info("Async Handler Ready")
         if self.test_mode:
             logging.info("  Running in test mode")
-        check_add_db_tables()
-        await self.bot.sync_application_commands()
+        try:
+            await self.startup()
+        except Exception:
+            self.started = False
+            raise
+
+    async def startup(self):
+        phase_start = self.created_at
+
+        def phase_done(phase):
+            nonlocal phase_start
+            now = time.perf_counter()
+            logging.info(f"  {phase} took {(now - phase_start) * 1000:.0f} ms")
+            phase_start = now
+
+        phase_done("Connecting")
+        # When the shards are spread over several processes, only the one running shard 0 migrates the database and
+        # syncs the commands. The others wait for the migrations before touching the database.
+        is_primary_shard = self.isPrimaryShard()
+        if is_primary_shard:
+            await self.db.check_db_tables()
+        else:
+            while not await self.db.is_schema_current():
+                logging.info("  Waiting for shard 0 to update the database schema")
+                await asyncio.sleep(5)
+        phase_done("Schema check")
+        await self.db.seed_servers([self.default_server] + config.ADDITIONAL_SERVERS)
+        self.servers = await self.db.get_servers()
+        logging.info(f"  Serving {len(self.servers)} server(s)")
+        phase_done("Loading servers")
+        await self.racer_directory.load()
+        phase_done("Loading racers")
+        # Paging through the member lists of large servers takes a while, it runs in the background
+        for server_info in self.servers.values():
+            guild = self.bot.get_guild(server_info.server_id)
+            if guild is not None:
+                self.member_cache_tasks[guild.id] = asyncio.create_task(self.cacheServerMembers(guild, server_info))
+        if is_primary_shard:
+            await sync_if_changed(self.bot, config.CommandTreeHashFile)
+            phase_done("Command sync")
+        if config.MetricsFile is not None:
+            self.metrics_task = asyncio.create_task(self.write_metrics_file())
+        # Checkpointing is shared by all processes using the database, shard 0 does it for everyone
+        if is_primary_shard and profile_uses_wal(config.DbProfile) and config.DbCheckpointSeconds is not None:
+            self.checkpoint_task = asyncio.create_task(self.checkpoint_database())
+        logging.info(f"  Startup took {(time.perf_counter() - self.created_at) * 1000:.0f} ms in total")
+
+    ####################################################################################################################
+    # Returns the test for the members of a server the cog keeps in the member cache: the holders of the weekly race
+    # done role, which the weekly role reset goes through, and the racers assigned to active races, whose names are
+    # shown on the race info and leaderboards. None if there's nobody to keep.
+    async def memberCacheFilter(self, guild, server_info):
+        role_id = server_info.weekly_race_done_role
+        rostered_ids = await self.db.get_rostered_user_ids(guild.id)
+        if role_id == 0 and len(rostered_ids) == 0:
+            return None
+
+        def should_cache(member):
+            return member.id in rostered_ids or (role_id != 0 and member.get_role(role_id) is not None)
+
+        return should_cache
+
+    ####################################################################################################################
+    # Loads the members of a server the cog keeps cached, see memberCacheFilter. Members that get the role or are
+    # assigned later are cached when that happens. Returns False if the member list couldn't be fully read.
+    async def cacheServerMembers(self, guild, server_info):
+        start = time.perf_counter()
+        should_cache = await self.memberCacheFilter(guild, server_info)
+        if should_cache is None:
+            return True
+        try:
+            cached = await cache_matching_members(guild, should_cache)
+        except nextcord.HTTPException:
+            logging.exception(f"Failed to load the member cache for {guild.name}")
+            return False
+        logging.info(f"Cached {cached} members of {guild.name} in {time.perf_counter() - start:.1f}s")
+        return True
+
+    ####################################################################################################################
+    # Drops the cached members of a server that should_cache (from memberCacheFilter) doesn't keep: past role holders
+    # after a role reset, and members nextcord cached because they joined or were updated
+    def pruneMemberCache(self, guild, should_cache):
+        dropped = uncache_members(guild, should_cache if should_cache is not None else lambda member: False)
+        logging.info(f"Dropped {dropped} members of {guild.name} from the member cache")
+
+    ####################################################################################################################
+    # True if this process runs shard 0, or isn't sharded
+    def isPrimaryShard(self):
+        shard_ids = getattr(self.bot, 'shard_ids', None)
+        return shard_ids is None or 0 in shard_ids
 
     async def close(self):
         logging.info("Shutting down Async Handler")
         # Remove any existing submit messages/buttons in the weekly and tourney submit channels. Async messages pinned
         # in other channels will be orphaned
-        if self.server_info.weekly_submit_channel != 0:
-            weekly_submit_channel = self.bot.get_channel(self.server_info.weekly_submit_channel)
-            await self.purge_bot_messages(weekly_submit_channel)
-        if self.server_info.tourney_submit_channel != 0:
-            tourney_channel = self.bot.get_channel(self.server_info.tourney_submit_channel)
-            await self.purge_bot_messages(tourney_channel)
+        for server_info in self.servers.values():
+            # Servers handled by other shard processes clean up their own channels
+            if self.bot.get_guild(server_info.server_id) is None:
+                continue
+            if server_info.weekly_submit_channel != 0:
+                weekly_submit_channel = self.bot.get_channel(server_info.weekly_submit_channel)
+                await self.purge_bot_messages(weekly_submit_channel)
+            if server_info.tourney_submit_channel != 0:
+                tourney_channel = self.bot.get_channel(server_info.tourney_submit_channel)
+                await self.purge_bot_messages(tourney_channel)
+        for publisher in self.leaderboard_publishers.values():
+            await publisher.close()
+        for role_reset_job in self.role_reset_jobs.values():
+            await role_reset_job.close()
+        for member_cache_task in self.member_cache_tasks.values():
+            member_cache_task.cancel()
+        await self.racer_directory.close()
+        if self.metrics_task is not None:
+            self.metrics_task.cancel()
+            metrics.write_file(config.MetricsFile)
+        if self.checkpoint_task is not None:
+            self.checkpoint_task.cancel()
+            # Leave an empty WAL behind so the database file is complete on its own
+            try:
+                await self.db.checkpoint_wal('TRUNCATE')
+            except Exception:
+                logging.exception("Failed to checkpoint the database WAL")
+        self.db.close()
 
 def setup(bot):
     bot.add_cog(AsyncHandler(bot))
@@ -6,6 +6,9 @@ from datetime import datetime
 import random
 import config
 
+# Voice channels are checked for emptiness with their voice states, which are tracked without caching members
+RequiredIntents = nextcord.Intents(guilds=True, voice_states=True)
+
 ServerId        = 0
 RaceCreatorRole = 1
 PermanentVcId   = 2
@@ -96,12 +99,12 @@ class ServerUtils(commands.Cog, name='ServerUtils'):
             found_empty = False
             logging.info("Channel join, checking for empty channels")
             perm_vc = join_channel.guild.get_channel(self.server_info[PermanentVcId])
-            if not perm_vc.members:
+            if not perm_vc.voice_states:
                 logging.info(f"Permanent Voice Channel '{perm_vc.name}' is empty")
             else:
                 for vc in after.channel.guild.voice_channels:
                     if vc.id in self.server_info[VcIgnoreList] or vc.id == self.server_info[PermanentVcId]: continue
-                    if not vc.members:
+                    if not vc.voice_states:
                         found_empty = True
                         logging.info(f"Found empty channel {vc.name}")
                         break
@@ -124,10 +127,10 @@ class ServerUtils(commands.Cog, name='ServerUtils'):
             guild = leave_channel.guild
             perm_vc = guild.get_channel(self.server_info[PermanentVcId])
             # Skip removing the first empty on-demand channel if the permanent VC is not empty
-            skip_first_empty = False if not perm_vc.members else True
+            skip_first_empty = False if not perm_vc.voice_states else True
             for vc in self.on_demand_vc_ids:
                 channel = guild.get_channel(vc)
-                if not channel.members:
+                if not channel.voice_states:
                     if skip_first_empty:
                         skip_first_empty = False
                         continue
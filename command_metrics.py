@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from nextcord.webhook.async_ import async_context
+
+# Upper bounds (in seconds) of the latency histogram buckets, the last bucket catches everything slower
+LatencyBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+class CommandTiming():
+    '''Time and query counts collected while one command or UI callback runs.
+
+    The current timing is held in a context variable, so anything awaited by the command (and database work the
+    repository runs on its executor threads, see AsyncRaceRepo.read/write) adds to it without being passed it.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.wall_seconds = 0.0
+        self.db_seconds = 0.0
+        self.rest_seconds = 0.0
+        self.rest_calls = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.finished = False
+        # Queries are counted on the database threads
+        self.lock = threading.Lock()
+
+    def finish(self):
+        self.wall_seconds = time.perf_counter() - self.start
+        self.finished = True
+
+current_timing = contextvars.ContextVar('current_timing', default=None)
+
+####################################################################################################################
+# Hooks called by the database, repository and REST wrappers. They do nothing outside of a timed command.
+def record_query(seconds):
+    timing = current_timing.get()
+    if timing is not None and not timing.finished:
+        with timing.lock:
+            timing.queries += 1
+            timing.query_seconds += seconds
+
+def record_db_call(seconds):
+    timing = current_timing.get()
+    if timing is not None and not timing.finished:
+        timing.db_seconds += seconds
+
+def record_rest_call(seconds):
+    timing = current_timing.get()
+    if timing is not None and not timing.finished:
+        timing.rest_seconds += seconds
+        timing.rest_calls += 1
+
+class Histogram():
+    '''Count of observations per LatencyBuckets bucket plus their sum and maximum.'''
+
+    def __init__(self):
+        self.counts = [0] * len(LatencyBuckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LatencyBuckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    ####################################################################################################################
+    # Estimates a percentile (0-100) as the upper bound of the bucket it falls in, capped at the slowest observation
+    def percentile(self, pct):
+        if self.count == 0:
+            return 0.0
+        target = self.count * pct / 100
+        seen = 0
+        for bound, count in zip(LatencyBuckets, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+class CommandStats():
+    '''Totals for every run of one command.'''
+
+    def __init__(self):
+        self.wall = Histogram()
+        self.db_seconds = 0.0
+        self.rest_seconds = 0.0
+        self.rest_calls = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.errors = 0
+
+    def add_run(self, timing):
+        self.wall.observe(timing.wall_seconds)
+        self.db_seconds += timing.db_seconds
+        self.rest_seconds += timing.rest_seconds
+        self.rest_calls += timing.rest_calls
+        self.queries += timing.queries
+        self.query_seconds += timing.query_seconds
+
+class CommandMetrics():
+    '''In-process latency histograms and counters for each command, keyed by command name.'''
+
+    def __init__(self):
+        self.commands = {}
+        self.started_at = time.time()
+
+    ####################################################################################################################
+    # Starts timing a command, returns the context variable token to pass to finish
+    def start(self, name):
+        return current_timing.set(CommandTiming(name))
+
+    def finish(self, token):
+        timing = current_timing.get()
+        current_timing.reset(token)
+        if timing is None:
+            return
+        timing.finish()
+        self.get_stats(timing.name).add_run(timing)
+        logging.debug(f"{timing.name} took {timing.wall_seconds * 1000:.1f} ms, db {timing.db_seconds * 1000:.1f} ms, "
+                      f"rest {timing.rest_seconds * 1000:.1f} ms, {timing.queries} queries")
+
+    ####################################################################################################################
+    # Counts a run of the command that raised an exception, the run itself is recorded by finish
+    def record_error(self, name):
+        self.get_stats(name).errors += 1
+
+    def get_stats(self, name):
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = CommandStats()
+            self.commands[name] = stats
+        return stats
+
+    ####################################################################################################################
+    # Table rows for the stats command, slowest p95 first. Times are in milliseconds and averaged per run.
+    def summary_rows(self):
+        rows = []
+        for name, stats in self.commands.items():
+            runs = max(stats.wall.count, 1)
+            rows.append([name,
+                         stats.wall.count,
+                         f"{stats.wall.percentile(50) * 1000:.0f}",
+                         f"{stats.wall.percentile(95) * 1000:.0f}",
+                         f"{stats.wall.max * 1000:.0f}",
+                         f"{stats.db_seconds * 1000 / runs:.0f}",
+                         f"{stats.rest_seconds * 1000 / runs:.0f}",
+                         f"{stats.queries / runs:.1f}",
+                         stats.errors])
+        rows.sort(key=lambda row: (-float(row[3]), row[0]))
+        return rows
+
+    ####################################################################################################################
+    # Renders the metrics in the Prometheus text format
+    def metrics_text(self):
+        lines = [f"# Async race bot command metrics, collected since {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at))}",
+                 "# TYPE arb_command_seconds histogram"]
+        for name in sorted(self.commands):
+            stats = self.commands[name]
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(LatencyBuckets, stats.wall.counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else f"{bound}"
+                lines.append(f'arb_command_seconds_bucket{{command="{label}",le="{le}"}} {cumulative}')
+            lines.append(f'arb_command_seconds_sum{{command="{label}"}} {stats.wall.sum:.6f}')
+            lines.append(f'arb_command_seconds_count{{command="{label}"}} {stats.wall.count}')
+            lines.append(f'arb_command_db_seconds_total{{command="{label}"}} {stats.db_seconds:.6f}')
+            lines.append(f'arb_command_rest_seconds_total{{command="{label}"}} {stats.rest_seconds:.6f}')
+            lines.append(f'arb_command_rest_calls_total{{command="{label}"}} {stats.rest_calls}')
+            lines.append(f'arb_command_queries_total{{command="{label}"}} {stats.queries}')
+            lines.append(f'arb_command_query_seconds_total{{command="{label}"}} {stats.query_seconds:.6f}')
+            lines.append(f'arb_command_errors_total{{command="{label}"}} {stats.errors}')
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.metrics_text())
+        os.replace(tmp_path, path)
+
+# Metrics for the whole process, shared by the cogs and the timing hooks
+metrics = CommandMetrics()
+
+####################################################################################################################
+# Decorator for UI callbacks (modals, selects, buttons) that times them under their class and method name, e.g.
+# "SubmitTimeModal.callback". Calls made inside an already timed command are counted as part of that command.
+def timed_callback(func):
+    name = func.__qualname__.split('.', 1)[-1]
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        timing = current_timing.get()
+        if timing is not None and not timing.finished:
+            return await func(*args, **kwargs)
+        token = metrics.start(name)
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            metrics.record_error(name)
+            raise
+        finally:
+            metrics.finish(token)
+    return wrapper
+
+####################################################################################################################
+# Wraps a REST request coroutine function so the time spent in it is added to the current command
+def timed_request(request):
+    if getattr(request, 'is_timed_request', False):
+        return request
+
+    @functools.wraps(request)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await request(*args, **kwargs)
+        finally:
+            record_rest_call(time.perf_counter() - start)
+    wrapper.is_timed_request = True
+    return wrapper
+
+####################################################################################################################
+# Times the bot's REST calls. Interaction responses and followups go through the webhook adapter rather than the
+# bot's HTTP client, so both are wrapped.
+def instrument_rest(bot):
+    bot.http.request = timed_request(bot.http.request)
+    adapter = async_context.get()
+    adapter.request = timed_request(adapter.request)
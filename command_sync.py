@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import time
+
+####################################################################################################################
+# Hashes the payloads Discord would be sent for the bot's global application commands. The application ID is part of
+# the hash so the production and test bots don't share a stored hash.
+def command_tree_hash(bot):
+    payloads = [command.get_payload(None) for command in bot.get_all_application_commands() if command.is_global]
+    payloads.sort(key=lambda payload: (payload.get('type', 1), payload['name']))
+    tree = {'application_id': bot.application_id, 'commands': payloads}
+    return hashlib.sha256(json.dumps(tree, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def read_stored_hash(hash_file):
+    try:
+        with open(hash_file, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def write_stored_hash(hash_file, tree_hash):
+    tmp_file = f"{hash_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        f.write(tree_hash)
+    os.replace(tmp_file, hash_file)
+
+####################################################################################################################
+# Syncs the application commands with Discord, unless the command tree is the same as the last time it was synced.
+# Returns True if a sync was done. Delete the hash file to force a sync, e.g. if the commands were changed from
+# somewhere else.
+async def sync_if_changed(bot, hash_file):
+    tree_hash = command_tree_hash(bot)
+    if read_stored_hash(hash_file) == tree_hash:
+        logging.info("Application commands unchanged since the last sync, skipping sync")
+        return False
+    start = time.perf_counter()
+    await bot.sync_application_commands()
+    logging.info(f"Synced application commands in {(time.perf_counter() - start) * 1000:.0f} ms")
+    try:
+        write_stored_hash(hash_file, tree_hash)
+    except OSError:
+        logging.exception(f"Failed to store the command tree hash in {hash_file}")
+    return True
@@ -7,6 +7,10 @@ TEST_DB = "testDbUtil.db"
 PRODUCTION_SERVER = GmpServerInfo
 TEST_SERVER = BttServerInfo
 
+# Other servers served by the same bot process and database. Each is added to the server_settings table the first time
+# the bot starts with it listed here, after that the database copy is used so edit the table to change its settings.
+ADDITIONAL_SERVERS = []
+
 # Controls whether the bot will start in test mode
 TEST_MODE = True
 
@@ -25,6 +29,87 @@ PingRaceCreatorOnRaceEnd = True
 # If True, race creators will be prompted to confirm starting a race to ensure the roster is correct
 RosterPromptOnRaceStart = False
 
+# Sharding. If ShardCount is set the bot runs as an AutoShardedBot with that many shards, 0 lets Discord recommend the
+# count. ShardIds optionally limits this process to some of the shards, so the shards can be spread over several
+# processes sharing the database (see the -shard_count and -shard_ids command line options). None runs unsharded.
+ShardCount = None
+ShardIds = None
+
+# File storing a hash of the application commands as last synced with Discord. The commands are only synced on startup
+# when they differ from the stored hash, delete the file to force a sync.
+CommandTreeHashFile = "command_tree.hash"
+
+# Text file the per-command latency and query metrics are written to every MetricsFileSeconds seconds, in the
+# Prometheus text format. None disables the file, the metrics are still shown by /async_race mod stats.
+MetricsFile = "command_metrics.txt"
+MetricsFileSeconds = 60
+
+# How long a database write waits for another process's write to finish before failing with "database is locked"
+DbBusyTimeoutSeconds = 30
+
+# SQLite connection profile, the name of one of the DbProfiles below. Its pragmas are set on every database connection,
+# busy_timeout is always set from DbBusyTimeoutSeconds.
+#   "wal":      write-ahead log, reads don't block the writer or each other and a commit doesn't wait for an fsync
+#   "rollback": SQLite's defaults, a rollback journal with a full fsync on every commit
+DbProfile = "wal"
+DbProfiles = {
+    "rollback": {
+        'journal_mode': 'delete',
+        'synchronous': 'full',
+    },
+    "wal": {
+        'journal_mode': 'wal',
+        # In WAL mode NORMAL only syncs on checkpoints. A power cut can lose the last few commits, never corrupt the file
+        'synchronous': 'normal',
+        # Negative sizes are in KiB, i.e. 16 MiB of page cache per connection
+        'cache_size': -16000,
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'memory',
+    },
+}
+
+# How often (in seconds) the WAL is copied back into the database file when using a WAL profile. SQLite also does this
+# by itself once the WAL reaches 1000 pages, but only when no reader holds on to the WAL. None disables the task.
+DbCheckpointSeconds = 300
+
+# Number of threads used to run database reads off the event loop. Writes always go through a single writer thread.
+DbReaderThreads = 4
+
+# Maximum number of rendered race leaderboards kept in memory
+LeaderboardCacheSize = 32
+
+# Submissions to the weekly race within this many seconds of each other are coalesced into one leaderboard channel update
+LeaderboardDebounceSeconds = 5
+
+# A leaderboard channel update that keeps failing (e.g. the bot lost access to the channel) is retried this many times,
+# waiting twice as long before each retry, then dropped until the race changes again
+LeaderboardPublishMaxRetries = 5
+
+# Maximum number of role removals in flight when resetting the weekly race done role, and how often (in seconds) the
+# progress message is updated while it runs
+RoleResetConcurrency = 5
+RoleResetProgressSeconds = 10
+
+# Number of recent weekly races the next mode suggestions are collected from
+NextModeSuggestionRaces = 2
+
+# Next mode suggestions longer than this many messages are sent as a text file instead
+NextModeSuggestionMaxMessages = 3
+
+# Season scoring. By placement, finishers get the points for their place (1st, 2nd, ...) and SeasonFinishPoints below
+# the last listed place. By par time, par is the average of the fastest SeasonParRacers finishes, a finish at par is
+# worth SeasonParPoints and each percent slower than par costs one percent of them. Forfeits score nothing.
+SeasonPlacementPoints = [25, 18, 15, 12, 10, 8, 6, 4, 2, 1]
+SeasonFinishPoints = 1
+SeasonParRacers = 5
+SeasonParPoints = 100
+
+# Rows read from the database at a time when exporting submissions
+ExportChunkRows = 1000
+
+# Username changes are written to the database in one batch at most this many seconds after they're first seen
+RacerNameFlushSeconds = 60
+
 # These are the coolest guys (no gender assumed). The user IDs of the users who are authorized to use the really sensitive features like text_talk which allows the user to talk as the bot
 CoolestGuyIds = [ 178293242045923329 ]
 
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import importlib
+import logging
+import nextcord
+
+####################################################################################################################
+# Builds the gateway intents and member cache flags to run the given cogs with. Each cog module declares the intents
+# it needs in RequiredIntents and, if it reads cached members, the member cache flags in RequiredMemberCacheFlags.
+# A cog that doesn't declare its intents gets everything, the same as before cogs declared them.
+def cog_requirements(cog_names):
+    intents = nextcord.Intents.none()
+    member_cache_flags = nextcord.MemberCacheFlags.none()
+    for cog in cog_names:
+        try:
+            module = importlib.import_module(cog)
+        except Exception:
+            # The bot logs the details when it fails to load the extension
+            continue
+        cog_intents = getattr(module, 'RequiredIntents', None)
+        if cog_intents is None:
+            logging.warning(f"{cog} doesn't declare RequiredIntents, requesting all intents")
+            return nextcord.Intents.all(), nextcord.MemberCacheFlags.all()
+        intents.value |= cog_intents.value
+        cog_cache_flags = getattr(module, 'RequiredMemberCacheFlags', None)
+        if cog_cache_flags is not None:
+            member_cache_flags.value |= cog_cache_flags.value
+    return intents, member_cache_flags
+
+####################################################################################################################
+# Adds members to their server's member cache. The bot doesn't chunk the member lists into the cache, a cog adds the
+# members it reads from the cache itself. Once cached, a member is kept up to date by the member update events and
+# dropped when it leaves the server.
+def cache_members(guild, members):
+    for member in members:
+        if guild.get_member(member.id) is None:
+            guild._add_member(member)
+
+####################################################################################################################
+# With any member cache flag set, nextcord keeps the user of every member it creates until it's dereferenced. Releases
+# the user if it isn't a cached member of any server.
+def release_user(state, user_id):
+    if user_id != state.self_id and all(guild.get_member(user_id) is None for guild in state.guilds):
+        state.deref_user(user_id)
+
+####################################################################################################################
+# Caches the members should_cache returns True for and releases the users of the rest. Returns the number cached.
+def cache_matching(guild, members, should_cache):
+    cached = 0
+    for member in members:
+        if should_cache(member):
+            cache_members(guild, [member])
+            cached += 1
+        else:
+            release_user(guild._state, member.id)
+    return cached
+
+####################################################################################################################
+# Pages through a server's member list and caches the members should_cache returns True for. Each page is dropped
+# once it's been filtered, the full member list is never held at once. Returns the number of members cached.
+async def cache_matching_members(guild, should_cache):
+    cached = 0
+    async for member in guild.fetch_members(limit=None):
+        cached += cache_matching(guild, [member], should_cache)
+    return cached
+
+####################################################################################################################
+# Drops the cached members of a server should_cache returns False for, other than the bot's own member. Returns the
+# number of members dropped.
+def uncache_members(guild, should_cache):
+    dropped = 0
+    self_id = guild._state.self_id
+    for member in list(guild.members):
+        if member.id != self_id and not should_cache(member):
+            guild._remove_member(member)
+            release_user(guild._state, member.id)
+            dropped += 1
+    return dropped
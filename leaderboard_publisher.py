@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+
+class LeaderboardPublisher():
+    '''Background task that republishes a leaderboard channel when its race changes.
+
+    Callers signal that a race changed and return straight away. The first signal opens a debounce window and every
+    signal that arrives during the window is coalesced into a single publish of the most recently signalled race.
+    A signal that arrives while a publish is running opens a new window, so a change is never dropped. A publish that
+    raises is logged and retried, each retry window twice as long as the last. After max_retries failed retries in a row
+    the change is dropped, the next signal starts over.
+    '''
+
+    def __init__(self, publish_func, debounce_seconds, max_retries):
+        self.publish_func = publish_func
+        self.debounce_seconds = debounce_seconds
+        self.max_retries = max_retries
+        self.failures = 0
+        self.pending_race_id = None
+        self.changed = asyncio.Event()
+        self.task = None
+
+    ####################################################################################################################
+    # Records that the race changed, starting the background task on first use
+    def signal(self, race_id):
+        self.pending_race_id = race_id
+        self.changed.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await self.changed.wait()
+            await asyncio.sleep(self.debounce_seconds * 2 ** self.failures)
+            await self.publish_pending()
+
+    async def publish_pending(self):
+        self.changed.clear()
+        race_id = self.pending_race_id
+        try:
+            await self.publish_func(race_id)
+            self.failures = 0
+        except asyncio.CancelledError:
+            # Shutting down mid-publish, leave the change pending so close() publishes it
+            self.changed.set()
+            raise
+        except Exception as e:
+            self.failures += 1
+            if self.failures > self.max_retries:
+                logging.error(f"Giving up publishing leaderboard for race {race_id} after {self.failures} attempts: {e}")
+                self.failures = 0
+                return
+            # The full traceback is only logged for the first failure in a row
+            if self.failures == 1:
+                logging.exception(f"Failed to publish leaderboard for race {race_id}, retrying")
+            else:
+                logging.warning(f"Failed to publish leaderboard for race {race_id} again ({e}), retrying in "
+                                f"{self.debounce_seconds * 2 ** self.failures}s")
+            self.changed.set()
+
+    ####################################################################################################################
+    # Stops the background task, publishing any change that is still waiting for its debounce window
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.changed.is_set():
+            self.changed.clear()
+            await self.publish_func(self.pending_race_id)
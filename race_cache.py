@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+class LruCache():
+    '''Bounded in-memory cache that evicts the least recently used entry once it is full.
+
+    Keeps hit/miss/eviction counters so the cache can be checked from the mod utilities. Every invalidation bumps a
+    generation counter. Callers that build a value across an await read the generation first and pass it to put(), so
+    a value built from data that was invalidated mid-build is never stored.
+    '''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    ####################################################################################################################
+    # Returns the cached value for the key, or None on a miss
+    def get(self, key):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    ####################################################################################################################
+    # Stores a value, evicting the least recently used entry if the cache is full. If a generation is provided and
+    # something has been invalidated since, the value may be stale and is not stored.
+    def put(self, key, value, generation=None):
+        if generation is not None and generation != self.generation:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self.generation += 1
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+
+    def stats_str(self):
+        lookups = self.hits + self.misses
+        hit_rate = 0 if lookups == 0 else (100 * self.hits) // lookups
+        return f"{len(self.entries)}/{self.max_size} entries, {self.hits} hits, {self.misses} misses ({hit_rate}% hit rate), {self.evictions} evictions"
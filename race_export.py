@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Exports submissions as gzip compressed CSV or JSON Lines. Rows are streamed from the database cursor in chunks of
+# config.ExportChunkRows and written out as they're read, so an export of the whole async_submissions table never
+# holds more than one chunk in memory. Used by the export mod command through AsyncRaceRepo.export_submissions, and can
+# be run offline against a database file.
+#
+# Usage: python race_export.py [-db DATABASE] [-format csv|jsonl] [-race ID] [-category ID] [-server ID]
+#                              [-start YYYY-MM-DD] [-end YYYY-MM-DD] [-output FILE]
+import argparse
+import csv
+import gzip
+import io
+import json
+import sys
+import time
+from datetime import date, timedelta
+import config
+from async_db_orm import *
+
+ExportFormats = ('csv', 'jsonl')
+
+# gzip's default level, Python's gzip module defaults to the slowest one (9) which saves little on these rows
+ExportCompressLevel = 6
+
+# Column names of the exported rows, in the order export_query selects them
+ExportColumns = ['submission_id', 'race_id', 'category_id', 'race_start', 'race_description', 'user_id', 'username',
+                 'submit_date', 'finish_time_igt', 'finish_time_rta', 'finish_seconds_igt', 'finish_seconds_rta',
+                 'is_dnf', 'collection_rate', 'next_mode', 'comment', 'vod_link']
+
+####################################################################################################################
+# Returns the query for the submissions to export, oldest first. Every filter is optional, without any the whole
+# async_submissions table is exported. Dates are inclusive and compared with the submission date.
+def export_query(race_id=None, category_id=None, guild_id=None, start_date=None, end_date=None):
+    query = AsyncSubmission.select(AsyncSubmission.id, AsyncSubmission.race_id, AsyncRace.category_id, AsyncRace.start,
+                                   AsyncRace.description, AsyncSubmission.user_id,
+                                   fn.COALESCE(AsyncRacer.username, AsyncSubmission.username),
+                                   AsyncSubmission.submit_date, AsyncSubmission.finish_time_igt,
+                                   AsyncSubmission.finish_time_rta, AsyncSubmission.finish_seconds_igt,
+                                   AsyncSubmission.finish_seconds_rta, AsyncSubmission.is_dnf,
+                                   AsyncSubmission.collection_rate, AsyncSubmission.next_mode, AsyncSubmission.comment,
+                                   AsyncSubmission.vod_link)                                                          \
+                           .join(AsyncRace, JOIN.LEFT_OUTER, on=(AsyncSubmission.race_id == AsyncRace.id))            \
+                           .switch(AsyncSubmission)                                                                   \
+                           .join(AsyncRacer, JOIN.LEFT_OUTER, on=(AsyncSubmission.user_id == AsyncRacer.user_id))     \
+                           .order_by(AsyncSubmission.id)
+    if race_id is not None:
+        query = query.where(AsyncSubmission.race_id == race_id)
+    if category_id is not None:
+        query = query.where(AsyncRace.category_id == category_id)
+    if guild_id is not None:
+        query = query.where(AsyncRace.guild_id == guild_id)
+    # Submission dates are stored as "YYYY-MM-DD HH:MM[:SS]" strings
+    if start_date is not None:
+        query = query.where(AsyncSubmission.submit_date >= start_date.isoformat())
+    if end_date is not None:
+        query = query.where(AsyncSubmission.submit_date < (end_date + timedelta(days=1)).isoformat())
+    return query
+
+####################################################################################################################
+# Runs the query and writes its rows to a binary file object as gzip compressed CSV (with a header row) or JSON Lines,
+# one chunk of rows at a time. Returns the number of rows written. The file object is left open.
+def write_export(query, fileobj, export_format):
+    if export_format not in ExportFormats:
+        raise ValueError(f"Unknown export format {export_format}, expected one of {', '.join(ExportFormats)}")
+    row_count = 0
+    with gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=ExportCompressLevel) as gz:
+        text = io.TextIOWrapper(gz, encoding='utf-8', newline='')
+        if export_format == 'csv':
+            writer = csv.writer(text)
+            writer.writerow(ExportColumns)
+        else:
+            encode = json.JSONEncoder(ensure_ascii=False, default=str).encode
+        cursor = db.execute(query)
+        while True:
+            rows = cursor.fetchmany(config.ExportChunkRows)
+            if len(rows) == 0:
+                break
+            if export_format == 'csv':
+                writer.writerows(rows)
+            else:
+                text.writelines(encode(dict(zip(ExportColumns, row))) + '\n' for row in rows)
+            row_count += len(rows)
+        # Flushes into the gzip stream without closing the caller's file object
+        text.detach()
+    return row_count
+
+####################################################################################################################
+# Writes the export described by the filters (see export_query) to a file object, returns the number of rows written
+def export_submissions(fileobj, export_format, **filters):
+    return write_export(export_query(**filters), fileobj, export_format)
+
+def parse_date(value):
+    return None if value is None else date.fromisoformat(value)
+
+def main():
+    parser = argparse.ArgumentParser(description='Exports race submissions as gzip compressed CSV or JSON Lines')
+    parser.add_argument('-db', default=config.PRODUCTION_DB, help='Database file to export from')
+    parser.add_argument('-format', default='csv', choices=ExportFormats, help='Export format')
+    parser.add_argument('-race', type=int, default=None, help='Only export submissions to this race')
+    parser.add_argument('-category', type=int, default=None, help='Only export submissions to races in this category')
+    parser.add_argument('-server', type=int, default=None, help='Only export submissions to races on this server')
+    parser.add_argument('-start', default=None, help='Only export submissions made on or after this date, YYYY-MM-DD')
+    parser.add_argument('-end', default=None, help='Only export submissions made on or before this date, YYYY-MM-DD')
+    parser.add_argument('-output', default=None, help='Output file, defaults to submissions.<format>.gz')
+    args = parser.parse_args()
+
+    output = args.output if args.output is not None else f"submissions.{args.format}.gz"
+    db.init(args.db, timeout=config.DbBusyTimeoutSeconds, pragmas=db_pragmas(config.DbProfile))
+    if not schema_is_current():
+        sys.exit(f"{args.db} has pending schema migrations, start the bot with it once to apply them")
+    start = time.perf_counter()
+    with open(output, 'wb') as f:
+        row_count = export_submissions(f, args.format, race_id=args.race, category_id=args.category,
+                                       guild_id=args.server, start_date=parse_date(args.start),
+                                       end_date=parse_date(args.end))
+    db.close()
+    print(f"Exported {row_count} submissions to {output} in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
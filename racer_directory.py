@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+
+class RacerDirectory():
+    '''In-memory copy of the async_racers usernames, keyed by user ID.
+
+    Loaded once on startup so checking a member on every command doesn't touch the database when their name hasn't
+    changed. New racers are inserted straight away since other queries join against async_racers, name changes are
+    written back in one bulk update every flush_seconds and on close. Until then the database can hold a stale name
+    for a renamed racer.
+    '''
+
+    def __init__(self, repo, flush_seconds):
+        self.repo = repo
+        self.flush_seconds = flush_seconds
+        self.names = {}
+        self.pending_names = {}
+        self.loaded = False
+        self.load_lock = asyncio.Lock()
+        self.task = None
+
+    async def load(self):
+        async with self.load_lock:
+            if not self.loaded:
+                self.names = await self.repo.get_racer_names()
+                self.loaded = True
+                logging.info(f"Loaded {len(self.names)} racers into the racer directory")
+
+    ####################################################################################################################
+    # Makes sure the member is in the directory with their current username
+    async def check_add(self, user_id, username):
+        if not self.loaded:
+            await self.load()
+        known_name = self.names.get(user_id)
+        if known_name == username:
+            return
+        if known_name is None:
+            await self.repo.check_add_member(user_id, username)
+        else:
+            self.pending_names[user_id] = username
+            if self.task is None or self.task.done():
+                self.task = asyncio.create_task(self.run())
+        self.names[user_id] = username
+
+    async def run(self):
+        while len(self.pending_names) > 0:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    ####################################################################################################################
+    # Writes any pending name changes to the database
+    async def flush(self):
+        if len(self.pending_names) == 0:
+            return
+        names = self.pending_names
+        self.pending_names = {}
+        try:
+            await self.repo.update_racer_names(names)
+            logging.info(f"Updated {len(names)} racer names")
+        except Exception:
+            logging.exception(f"Failed to update {len(names)} racer names, retrying")
+            # Keep any newer name that came in while the update was running
+            names.update(self.pending_names)
+            self.pending_names = names
+
+    ####################################################################################################################
+    # Stops the flush task and writes any pending name changes
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
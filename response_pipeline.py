@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import logging
+import nextcord
+
+####################################################################################################################
+# Packs message parts into as few messages as possible without going over char_limit. Parts are joined with newlines
+# and kept in order, a part is only split (on line boundaries) if it is over the limit by itself.
+def pack_messages(parts, char_limit):
+    messages = []
+    current = ""
+    for part in parts:
+        for piece in split_part(part, char_limit):
+            if current != "" and len(current) + 1 + len(piece) > char_limit:
+                messages.append(current)
+                current = ""
+            current = piece if current == "" else current + "\n" + piece
+    if current != "":
+        messages.append(current)
+    return messages
+
+def split_part(part, char_limit):
+    if len(part) <= char_limit:
+        return [part]
+    pieces = []
+    current = ""
+    for line in part.split("\n"):
+        while len(line) > char_limit:
+            if current != "":
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:char_limit])
+            line = line[char_limit:]
+        if current != "" and len(current) + 1 + len(line) > char_limit:
+            pieces.append(current)
+            current = ""
+        current = line if current == "" else current + "\n" + line
+    if current != "":
+        pieces.append(current)
+    return pieces
+
+class ResponsePipeline():
+    '''Collects the response to an interaction and sends it as a few ordered followup messages.
+
+    Commands that query the database before responding call defer() first, which acknowledges the interaction straight
+    away so the work isn't racing Discord's 3 second initial response deadline. Parts added with add() are packed into
+    as few messages as the character limit allows and sent in order by send(), with an optional view attached to the
+    last message.
+    '''
+
+    def __init__(self, interaction, char_limit, ephemeral=True):
+        self.interaction = interaction
+        self.char_limit = char_limit
+        self.ephemeral = ephemeral
+        self.parts = []
+
+    ####################################################################################################################
+    # Acknowledges the interaction if nothing has responded to it yet, later sends become followup messages
+    async def defer(self):
+        if not self.interaction.response.is_done():
+            try:
+                await self.interaction.response.defer(ephemeral=self.ephemeral, with_message=True)
+            except nextcord.InteractionResponded:
+                pass
+
+    def add(self, *parts):
+        for part in parts:
+            if part is not None and part != "":
+                self.parts.append(part)
+
+    ####################################################################################################################
+    # Sends the queued parts, then clears the queue so the pipeline can be reused
+    async def send(self, view=None):
+        messages = pack_messages(self.parts, self.char_limit)
+        self.parts = []
+        if len(messages) == 0:
+            if view is not None:
+                await self.interaction.send(view=view, ephemeral=self.ephemeral)
+            return
+        logging.debug(f"Sending {len(messages)} response messages")
+        for message in messages[:-1]:
+            await self.interaction.send(message, ephemeral=self.ephemeral)
+        if view is not None:
+            await self.interaction.send(messages[-1], view=view, ephemeral=self.ephemeral)
+        else:
+            await self.interaction.send(messages[-1], ephemeral=self.ephemeral)
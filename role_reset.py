@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+import nextcord
+
+class RoleResetJob():
+    '''Background job that removes a role from every member holding it.
+
+    Only the members that hold the role are visited, read from the member cache once members_loaded (if given) has
+    finished loading it. members_loaded resolves to False if the cache couldn't be fully loaded, which is kept in
+    members_complete for the progress reports. Removals run concurrently with at most max_concurrency
+    requests in flight. nextcord already waits out the per-route rate limit buckets, if a request still comes back 429
+    the job backs off for the retry_after time before trying that member again. Progress is passed to report_func at
+    most once every report_seconds and once more when the job finishes.
+    '''
+
+    MaxRetries = 3
+
+    def __init__(self, role, report_func, max_concurrency, report_seconds, reason=None, members_loaded=None):
+        self.role = role
+        self.members_loaded = members_loaded
+        self.members_complete = True
+        self.report_func = report_func
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.report_seconds = report_seconds
+        self.reason = reason
+        self.members = []
+        self.kept_ids = set()
+        self.removed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.last_report = 0
+        self.task = None
+
+    @property
+    def total(self):
+        return len(self.members)
+
+    @property
+    def done_count(self):
+        return self.removed + self.skipped + self.failed
+
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    ####################################################################################################################
+    # Keeps the role on a member that earned it again while the job is running
+    def keep(self, member_id):
+        self.kept_ids.add(member_id)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def run(self):
+        start = time.perf_counter()
+        self.members_complete = await self.wait_members_loaded()
+        self.members = list(self.role.members)
+        logging.info(f"Removing role {self.role.name} from {self.total} members")
+        await self.report(False)
+        await asyncio.gather(*(self.remove(member) for member in self.members))
+        elapsed = time.perf_counter() - start
+        logging.info(f"Removed role {self.role.name} from {self.removed} members in {elapsed:.1f}s, {self.failed} failed")
+        await self.report(True)
+
+    ####################################################################################################################
+    # Waits for members_loaded, returns False if the member cache couldn't be fully loaded
+    async def wait_members_loaded(self):
+        if self.members_loaded is None:
+            return True
+        try:
+            # Shielded so closing the job doesn't cancel the load, which later jobs wait on too
+            return await asyncio.shield(self.members_loaded)
+        except Exception:
+            logging.exception(f"Failed to load the holders of role {self.role.name}")
+            return False
+
+    async def remove(self, member):
+        if member.id not in self.kept_ids:
+            async with self.semaphore:
+                if await self.remove_with_retry(member):
+                    self.removed += 1
+                else:
+                    self.failed += 1
+        else:
+            self.skipped += 1
+        if time.monotonic() - self.last_report >= self.report_seconds:
+            await self.report(False)
+
+    async def remove_with_retry(self, member):
+        for attempt in range(self.MaxRetries):
+            try:
+                await member.remove_roles(self.role, reason=self.reason)
+                return True
+            except nextcord.NotFound:
+                # Member left the server, nothing to remove
+                return True
+            except nextcord.HTTPException as e:
+                if e.status != 429:
+                    logging.warning(f"Failed to remove role {self.role.name} from {member.id}: {e}")
+                    return False
+                retry_after = getattr(e.response, 'headers', {}).get('Retry-After', 1)
+                logging.info(f"Rate limited removing role {self.role.name}, retrying in {retry_after}s")
+                await asyncio.sleep(float(retry_after))
+        logging.warning(f"Gave up removing role {self.role.name} from {member.id} after {self.MaxRetries} attempts")
+        return False
+
+    async def report(self, finished):
+        self.last_report = time.monotonic()
+        try:
+            await self.report_func(self, finished)
+        except Exception:
+            logging.exception(f"Failed to report progress for role {self.role.name} reset")
+
+    ####################################################################################################################
+    # Stops the job if it's still running
+    async def close(self):
+        if self.running():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
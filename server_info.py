@@ -78,8 +78,6 @@ GmpServerInfo = ServerInfo(
     weekly_racer_role = 631572574312202260,
     tourney_async_channel = 0)
 
-SupportedServerList = [ BttServerInfo.server_id ]
-
-# To add a supported server, create a ServerInfo structure then override the list like so:
-#     SupportedServerList = [ FortyBonksServerInfo.server_id ]
-# Adding multiple servers to the list is NOT supported, it is formatted as a list to match nextcord interface. The AsyncHandler class assumes a single supported server at a time, set by the server_info class field
\ No newline at end of file
+# Servers are configured in config.py, PRODUCTION_SERVER (or TEST_SERVER in test mode) plus any ADDITIONAL_SERVERS. On
+# startup each one is added to the server_settings table in the database if it isn't there yet, and the bot handles
+# commands for every server in that table. Races and race categories are stored per server.
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Display width of a string and wrapping by display width. Discord renders wide characters (CJK, most emoji) as two
+# columns in a code block, use wcwidth to account for them when it's installed
+try:
+    from wcwidth import width as display_width, wrap as wrap_display
+except ImportError:
+    try:
+        from wcwidth import wcswidth
+
+        def display_width(text):
+            width = wcswidth(text)
+            return len(text) if width < 0 else width
+    except ImportError:
+        def display_width(text):
+            return len(text)
+
+    # Greedy word wrap for when wcwidth is missing or too old to have wrap(), words wider than the line are split
+    def wrap_display(text, width):
+        lines = []
+        current = ''
+        for word in text.split():
+            candidate = word if current == '' else current + ' ' + word
+            if display_width(candidate) <= width:
+                current = candidate
+                continue
+            if current != '':
+                lines.append(current)
+            current = ''
+            for char in word:
+                if current != '' and display_width(current + char) > width:
+                    lines.append(current)
+                    current = ''
+                current += char
+        if current != '':
+            lines.append(current)
+        return lines
+
+####################################################################################################################
+# Splits a cell value into the lines it is displayed on, wrapping lines wider than width
+def cell_lines(value, width=None):
+    lines = []
+    for line in str(value).split('\n'):
+        if width is None or display_width(line) <= width:
+            lines.append(line)
+        else:
+            lines.extend(wrap_display(line, width) or [''])
+    return lines
+
+def justify(text, width, align):
+    excess = width - display_width(text)
+    if align == 'l':
+        return text + (' ' * excess)
+    elif align == 'r':
+        return (' ' * excess) + text
+    # Centered, with the odd space placed the same way as str.center()
+    left = excess // 2
+    if excess % 2 and display_width(text) % 2 == 0:
+        left += 1
+    return (' ' * left) + text + (' ' * (excess - left))
+
+####################################################################################################################
+# Renders a fixed-width table in the same layout as PrettyTable's default style and returns it as a list of code-block
+# messages, each at most char_limit characters. Messages are only split between rows so a wrapped row is never cut in
+# half.
+#
+# This keeps no state between calls, so it is safe to use from concurrent interactions.
+#   field_names: Column headers
+#   rows:        Iterable of row tuples/lists, values are converted with str()
+#   max_width:   Optional dict of column name to maximum width, longer values are wrapped onto multiple lines
+#   align:       Optional dict of column name to 'l', 'r' or 'c' (the default)
+#   hrules:      If True, a rule is drawn between every row instead of only around the header
+def render_table(field_names, rows, char_limit, max_width=None, align=None, hrules=False):
+    max_width = {} if max_width is None else max_width
+    align = {} if align is None else align
+    column_max_widths = [max_width.get(name) for name in field_names]
+    column_aligns = [align.get(name, 'c') for name in field_names]
+
+    # Column widths are computed the same way as PrettyTable, from the header and each value capped at its max width,
+    # then the values wider than their column are wrapped to it
+    header = [cell_lines(name) for name in field_names]
+    widths = [max(display_width(line) for line in lines) for lines in header]
+    rows = [[str(value) for value in row] for row in rows]
+    for row in rows:
+        for i, value in enumerate(row):
+            value_width = max(display_width(line) for line in value.split('\n'))
+            if column_max_widths[i] is not None:
+                value_width = min(value_width, column_max_widths[i])
+            widths[i] = max(widths[i], value_width)
+    wrapped_rows = [[cell_lines(value, widths[i]) for i, value in enumerate(row)] for row in rows]
+    # A character wider than its column can't be wrapped any narrower
+    for row in wrapped_rows:
+        for i, lines in enumerate(row):
+            for line in lines:
+                widths[i] = max(widths[i], display_width(line))
+
+    rule = '+' + '+'.join('-' * (w + 2) for w in widths) + '+'
+
+    def row_block(cells):
+        height = max(len(lines) for lines in cells)
+        block = []
+        for line_idx in range(height):
+            parts = []
+            for i, lines in enumerate(cells):
+                text = lines[line_idx] if line_idx < len(lines) else ''
+                parts.append(' ' + justify(text, widths[i], column_aligns[i]) + ' ')
+            block.append('|' + '|'.join(parts) + '|')
+        return block
+
+    # Build each row as a single string so messages can only be split between rows
+    blocks = ['\n'.join([rule] + row_block(header) + [rule])]
+    for row in wrapped_rows:
+        block = row_block(row)
+        if hrules:
+            block.append(rule)
+        blocks.append('\n'.join(block))
+    if not hrules:
+        blocks.append(rule)
+
+    # Pack the blocks into messages, leaving room for the code formatting
+    limit = char_limit - 2
+    messages = []
+    current = ''
+    for block in blocks:
+        if current != '' and len(current) + 1 + len(block) > limit:
+            messages.append(current)
+            current = ''
+        current = block if current == '' else current + '\n' + block
+    if current != '':
+        messages.append(current)
+    return [f"`{message}`" for message in messages]